@@ -1,4 +1,5 @@
 """智能体基类"""
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Dict, Any, List, Optional
 from langchain_core.messages import BaseMessage
@@ -28,6 +29,20 @@ class BaseAgent(ABC):
             更新后的状态
         """
         pass
+
+    async def aprocess(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        异步处理输入状态，默认在线程中执行process
+
+        有异步实现的智能体应重写此方法，避免占用线程
+        
+        Args:
+            state: 当前状态
+            
+        Returns:
+            更新后的状态
+        """
+        return await asyncio.to_thread(self.process, state)
     
     def add_tool(self, tool) -> None:
         """添加工具"""
@@ -3,6 +3,7 @@ from typing import Dict, Any, Optional
 from multi_agent_framework.agents.base import BaseAgent
 from multi_agent_framework.rag.manager import RAGManager
 from multi_agent_framework.rag.answer_validator import AnswerValidator
+from multi_agent_framework.core.tracing import tracer
 from langchain_core.messages import HumanMessage, AIMessage
 
 
@@ -18,7 +19,7 @@ class RAGAgent(BaseAgent):
                  llm=None):
         super().__init__(agent_id, name, "处理基于RAG的知识问答任务")
         self.rag_manager = rag_manager
-        self.answer_validator = AnswerValidator(llm)
+        self.answer_validator = AnswerValidator(llm, rag_manager)
         self.capabilities = ["knowledge_qa", "document_retrieval", "rag"]
 
     def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
@@ -31,6 +32,48 @@ class RAGAgent(BaseAgent):
         Returns:
             更新后的状态，包含答案和其他相关信息
         """
+        question, domain, filter, extra_kwargs = self._parse_state(state)
+
+        with tracer.span("agent.rag.process", agent_id=self.agent_id) as span:
+            # 使用RAG管理器查询答案（如果未指定领域，将使用默认领域）
+            result = self.rag_manager.query(question, domain, filter,
+                                            **extra_kwargs)
+            span.set_attribute("domain", result.get("domain"))
+            span.set_attribute("success", result["success"])
+
+            validation_result = None
+            if result["success"]:
+                # 验证答案相关性
+                validation_result = self.answer_validator.validate_answer(
+                    question, result["answer"], result.get("sources", []),
+                    result.get("domain"))
+
+        return self._update_state(state, question, result, validation_result)
+
+    async def aprocess(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        异步处理基于RAG的知识问答任务，参数和返回值同process
+        
+        查询和答案验证都使用异步接口，等待大模型时不占用线程
+        """
+        question, domain, filter, extra_kwargs = self._parse_state(state)
+
+        with tracer.span("agent.rag.process", agent_id=self.agent_id) as span:
+            result = await self.rag_manager.aquery(question, domain, filter,
+                                                   **extra_kwargs)
+            span.set_attribute("domain", result.get("domain"))
+            span.set_attribute("success", result["success"])
+
+            validation_result = None
+            if result["success"]:
+                validation_result = await self.answer_validator.avalidate_answer(
+                    question, result["answer"], result.get("sources", []),
+                    result.get("domain"))
+
+        return self._update_state(state, question, result, validation_result)
+
+    def _parse_state(self, state: Dict[str, Any]):
+        """从状态中取出问题、领域、过滤器和额外的prompt变量"""
         # 获取问题、领域信息和过滤器
         question = state.get("question", "")
         domain = state.get("domain", None)
@@ -42,11 +85,13 @@ class RAGAgent(BaseAgent):
             for key, value in state.items()
             if key not in ["question", "domain", "filter"]
         }
+        return question, domain, filter, extra_kwargs
 
-        # 使用RAG管理器查询答案（如果未指定领域，将使用默认领域）
-        result = self.rag_manager.query(question, domain, filter,
-                                        **extra_kwargs)
-
+    def _update_state(self, state: Dict[str, Any], question: str,
+                      result: Dict[str, Any],
+                      validation_result: Optional[Dict[str, Any]]
+                      ) -> Dict[str, Any]:
+        """根据查询结果和验证结果生成更新后的状态"""
         # 更新状态
         updated_state = state.copy()
         if result["success"]:
@@ -54,10 +99,6 @@ class RAGAgent(BaseAgent):
             answer_content = result["answer"]
             updated_state["answer"] = AIMessage(content=answer_content)
             updated_state["sources"] = result.get("sources", [])
-
-            # 验证答案相关性
-            validation_result = self.answer_validator.validate_answer(
-                question, answer_content, result.get("sources", []))
             updated_state["answer_validation"] = validation_result
         else:
             # 错误情况下也转换为AIMessage格式
@@ -0,0 +1,296 @@
+"""
+会话状态检查点
+按会话ID把AgentState（含chat_history）持久化到本地SQLite文件（WAL模式），
+写入由后台线程合并成批提交，会话活跃时才从数据库加载，空闲的会话从内存中移出
+"""
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional
+
+from langchain_core.messages import (BaseMessage, message_to_dict,
+                                     messages_from_dict)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 序列化后LangChain消息的标记字段
+_MESSAGE_KEY = "__message__"
+
+
+def _encode(value: Any) -> Any:
+    """json.dumps的default：LangChain消息转为带标记的字典，其他对象转为字符串"""
+    if isinstance(value, BaseMessage):
+        return {_MESSAGE_KEY: message_to_dict(value)}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    """json.loads的object_hook：还原LangChain消息"""
+    if _MESSAGE_KEY in obj and len(obj) == 1:
+        return messages_from_dict([obj[_MESSAGE_KEY]])[0]
+    return obj
+
+
+def dumps_state(state: Dict[str, Any]) -> str:
+    """序列化会话状态"""
+    return json.dumps(state, ensure_ascii=False, default=_encode)
+
+
+def loads_state(data: str) -> Dict[str, Any]:
+    """反序列化会话状态"""
+    return json.loads(data, object_hook=_decode)
+
+
+class CheckpointStore:
+    """
+    会话状态检查点存储
+
+    save只更新内存并登记待写入的快照，后台线程每flush_interval秒（或待写入达到
+    batch_size条时）在一个事务中写入，同一会话的多次保存只写最后一次。
+    get先查内存，再查待写入的快照，最后查数据库，都没有时用default_factory新建。
+    超过idle_timeout秒未访问、或活跃会话数超过max_active时，最久未访问的会话移出内存
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 default_factory: Optional[Callable[[], Dict[str, Any]]] = None,
+                 flush_interval: float = 0.5,
+                 batch_size: int = 64,
+                 idle_timeout: float = 1800.0,
+                 max_active: int = 1000):
+        """
+        初始化检查点存储
+
+        Args:
+            db_path: SQLite文件路径
+            default_factory: 新会话的初始状态，为None时为空字典
+            flush_interval: 后台写入的间隔（秒）
+            batch_size: 待写入的会话数达到该值时立即写入
+            idle_timeout: 会话空闲多少秒后移出内存
+            max_active: 内存中最多保留的会话数
+        """
+        self.db_path = db_path
+        self.default_factory = default_factory or dict
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.idle_timeout = idle_timeout
+        self.max_active = max(1, max_active)
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # WAL模式下读写使用各自的连接，加载会话不必等待批量写入
+        self._write_conn = self._connect()
+        self._write_conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self._write_conn.commit()
+        self._read_conn = self._connect()
+
+        # 会话ID -> 状态，按最近访问排序
+        self._active: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        # 会话ID -> (序列化的状态, 保存时间)，尚未写入数据库
+        self._pending: Dict[str, tuple] = {}
+        # 正在写入数据库的一批快照
+        self._writing: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_needed = threading.Condition(self._lock)
+        self._closed = False
+        # 统计信息
+        self.stats = {"loads": 0, "saves": 0, "writes": 0, "batches": 0,
+                      "evictions": 0}
+
+        self._writer = threading.Thread(target=self._run,
+                                        name="checkpoint-writer",
+                                        daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL只在检查点时同步，进程崩溃不会丢失已提交的事务
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, conversation_id: str) -> Dict[str, Any]:
+        """
+        获取会话状态，不在内存中时加载
+
+        Args:
+            conversation_id: 会话ID
+
+        Returns:
+            会话状态，修改后需调用save
+        """
+        with self._lock:
+            state = self._active.get(conversation_id)
+            if state is not None:
+                self._touch(conversation_id)
+                return state
+            pending = (self._pending.get(conversation_id)
+                       or self._writing.get(conversation_id))
+        if pending is not None:
+            state = loads_state(pending[0])
+        else:
+            state = self._load(conversation_id)
+        with self._lock:
+            # 加载期间其他线程可能已经加载或保存了该会话
+            current = self._active.get(conversation_id)
+            if current is not None:
+                state = current
+            else:
+                self._active[conversation_id] = state
+            self._touch(conversation_id)
+            self._evict_locked()
+        return state
+
+    def _load(self, conversation_id: str) -> Dict[str, Any]:
+        """从数据库加载会话状态，不存在时新建"""
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT state FROM conversations WHERE conversation_id = ?",
+                (conversation_id, )).fetchone()
+        if row is None:
+            return self.default_factory()
+        with self._lock:
+            self.stats["loads"] += 1
+        return loads_state(row[0])
+
+    def save(self, conversation_id: str, state: Dict[str, Any]) -> None:
+        """
+        保存会话状态，由后台线程异步写入数据库
+
+        Args:
+            conversation_id: 会话ID
+            state: 会话状态
+        """
+        data = dumps_state(state)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("检查点存储已关闭")
+            self._active[conversation_id] = state
+            self._touch(conversation_id)
+            self._pending[conversation_id] = (data, time.time())
+            self.stats["saves"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._flush_needed.notify()
+            self._evict_locked()
+
+    def delete(self, conversation_id: str) -> None:
+        """删除会话的内存状态和持久化状态"""
+        with self._write_lock:
+            with self._lock:
+                self._active.pop(conversation_id, None)
+                self._last_access.pop(conversation_id, None)
+                self._pending.pop(conversation_id, None)
+            with self._write_conn:
+                self._write_conn.execute(
+                    "DELETE FROM conversations WHERE conversation_id = ?",
+                    (conversation_id, ))
+
+    def _touch(self, conversation_id: str) -> None:
+        self._active.move_to_end(conversation_id)
+        self._last_access[conversation_id] = time.monotonic()
+
+    def _evict_locked(self) -> None:
+        """从最久未访问的会话开始移出内存，待写入的快照保留到写入完成"""
+        now = time.monotonic()
+        while self._active:
+            conversation_id = next(iter(self._active))
+            idle = now - self._last_access[conversation_id]
+            if len(self._active) <= self.max_active and idle < self.idle_timeout:
+                break
+            del self._active[conversation_id]
+            del self._last_access[conversation_id]
+            self.stats["evictions"] += 1
+
+    def evict_idle(self) -> None:
+        """移出空闲超时的会话"""
+        with self._lock:
+            self._evict_locked()
+
+    def _run(self) -> None:
+        """后台写入线程"""
+        while True:
+            with self._lock:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._flush_needed.wait(self.flush_interval)
+                closed = self._closed
+                self._evict_locked()
+            self.flush()
+            if closed:
+                return
+
+    def flush(self) -> None:
+        """把所有待写入的快照在一个事务中写入数据库"""
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch = self._writing = self._pending
+                self._pending = {}
+            rows = [(conversation_id, data, updated_at)
+                    for conversation_id, (data, updated_at) in batch.items()]
+            try:
+                with self._write_conn:
+                    self._write_conn.executemany(
+                        """INSERT INTO conversations
+                           (conversation_id, state, updated_at)
+                           VALUES (?, ?, ?)
+                           ON CONFLICT(conversation_id) DO UPDATE SET
+                           state = excluded.state,
+                           updated_at = excluded.updated_at""", rows)
+            except sqlite3.Error as e:
+                logger.warning(f"写入会话检查点失败: {e}，将在下次重试")
+                with self._lock:
+                    # 期间又保存过的会话以新快照为准
+                    for conversation_id, snapshot in batch.items():
+                        self._pending.setdefault(conversation_id, snapshot)
+                    self._writing = {}
+                return
+            with self._lock:
+                self._writing = {}
+                self.stats["writes"] += len(rows)
+                self.stats["batches"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取存储指标
+
+        Returns:
+            内存中的会话数、待写入的会话数，以及加载、保存、写入、移出的计数
+        """
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "pending": len(self._pending),
+                **self.stats
+            }
+
+    def close(self) -> None:
+        """写入剩余的快照并关闭数据库"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush_needed.notify()
+        self._writer.join()
+        with self._write_lock:
+            self._write_conn.close()
+        with self._read_lock:
+            self._read_conn.close()
@@ -1,7 +1,16 @@
 """核心引擎 - 管理智能体协作流程"""
-from typing import Dict, Any, List, Optional
-from langgraph.graph import StateGraph, END
+import os
+import time
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
 from multi_agent_framework.core.state import GlobalState, AgentState
+from multi_agent_framework.core.scheduler import TaskScheduler
+from multi_agent_framework.core.message_bus import (MessageBus, RingBuffer,
+                                                    SpillFile)
+from multi_agent_framework.core.checkpoint import CheckpointStore
+from multi_agent_framework.core.workflow import (CollaborationEdge,
+                                                 CollaborationWorkflow)
 
 
 class MultiAgentEngine:
@@ -9,24 +18,114 @@ class MultiAgentEngine:
     多智能体协作引擎
     """
     
-    def __init__(self):
+    def __init__(self,
+                 max_workers: int = 8,
+                 max_queue_size: int = 1000,
+                 agent_concurrency: int = 2,
+                 task_timeout: Optional[float] = 120.0,
+                 mailbox_capacity: int = 256,
+                 history_capacity: int = 1024,
+                 spill_directory: Optional[str] = None,
+                 checkpoint_path: Optional[str] = None,
+                 conversation_idle_timeout: float = 1800.0,
+                 max_active_conversations: int = 1000):
+        """
+        初始化引擎
+        
+        Args:
+            max_workers: 同时执行的任务数上限
+            max_queue_size: 排队任务数上限
+            agent_concurrency: 每个智能体默认的并发上限
+            task_timeout: 默认的任务执行超时（秒），为None时不限制
+            mailbox_capacity: 每个智能体信箱的容量
+            history_capacity: 消息历史和协作历史在内存中保留的条数
+            spill_directory: 超出容量的历史溢写目录，为None时直接丢弃
+            checkpoint_path: 会话状态检查点的SQLite文件，为None时不持久化会话状态
+            conversation_idle_timeout: 会话空闲多少秒后移出内存
+            max_active_conversations: 内存中最多保留的会话数
+        """
+        self.mailbox_capacity = mailbox_capacity
+        self.history_capacity = history_capacity
+        self.spill_directory = spill_directory
         self.agents: Dict[str, Any] = {}
-        self.workflows: Dict[str, StateGraph] = {}
+        # 拓扑 -> 编译后的协作工作流，每种拓扑只编译一次
+        self.workflows: Dict[Tuple, Any] = {}
+        self.collaboration_edges: List[CollaborationEdge] = []
+        self.reflector = None
+        self._workflows_lock = threading.Lock()
+        # RingBuffer不加锁，并发的工作流追加协作历史时由引擎加锁
+        self._history_lock = threading.Lock()
         self.global_state: GlobalState = self._initialize_global_state()
+        self.scheduler = TaskScheduler(self.agents,
+                                       max_workers=max_workers,
+                                       max_queue_size=max_queue_size,
+                                       agent_concurrency=agent_concurrency,
+                                       task_timeout=task_timeout)
+        self.checkpoints: Optional[CheckpointStore] = None
+        if checkpoint_path:
+            self.checkpoints = CheckpointStore(
+                checkpoint_path,
+                default_factory=self._initialize_agent_state,
+                idle_timeout=conversation_idle_timeout,
+                max_active=max_active_conversations)
         
     def _initialize_global_state(self) -> GlobalState:
-        """初始化全局状态"""
+        """初始化全局状态，消息总线和协作历史都有固定容量"""
+        spill_paths = {"message_bus": None, "collaboration_history": None}
+        if self.spill_directory:
+            spill_paths = {
+                name: os.path.join(self.spill_directory, f"{name}.jsonl")
+                for name in spill_paths
+            }
+        self._history_spill = (SpillFile(spill_paths["collaboration_history"])
+                               if spill_paths["collaboration_history"] else
+                               None)
         return {
             "agent_states": {},
             "task_queue": [],
-            "message_bus": [],
-            "collaboration_history": []
+            "message_bus": MessageBus(mailbox_capacity=self.mailbox_capacity,
+                                      history_capacity=self.history_capacity,
+                                      spill_path=spill_paths["message_bus"]),
+            "collaboration_history": RingBuffer(
+                self.history_capacity,
+                on_evict=self._history_spill.write
+                if self._history_spill else None)
         }
+
+    @property
+    def message_bus(self) -> MessageBus:
+        """智能体间的消息总线"""
+        return self.global_state["message_bus"]
+
+    def record_collaboration(self, entry: Dict[str, Any]) -> None:
+        """
+        记录一条协作历史，超出容量时覆盖最旧的记录，可在多个会话的工作流中并发调用
+        
+        Args:
+            entry: 协作记录
+        """
+        record = {"timestamp": time.time(), **entry}
+        with self._history_lock:
+            self.global_state["collaboration_history"].append(record)
     
-    def register_agent(self, agent_id: str, agent: Any) -> None:
-        """注册智能体"""
+    def register_agent(self,
+                       agent_id: str,
+                       agent: Any,
+                       max_concurrency: Optional[int] = None) -> None:
+        """
+        注册智能体
+        
+        Args:
+            agent_id: 智能体ID
+            agent: 智能体实例
+            max_concurrency: 该智能体的并发上限，为None时使用引擎的默认值
+        """
         self.agents[agent_id] = agent
         self.global_state["agent_states"][agent_id] = self._initialize_agent_state()
+        # 智能体的信箱，接收发给自己的消息
+        self.message_bus.subscribe(agent_id)
+        if max_concurrency is not None:
+            self.scheduler.set_agent_concurrency(agent_id, max_concurrency)
         
     def _initialize_agent_state(self) -> AgentState:
         """初始化单个智能体状态"""
@@ -44,19 +143,182 @@ class MultiAgentEngine:
             "chat_history": []
         }
     
-    def create_collaboration_workflow(self) -> StateGraph:
-        """创建协作工作流"""
-        # 这里将实现多个智能体之间的协作逻辑
-        pass
+    def set_reflector(self, reflector: Any) -> None:
+        """设置协作工作流最后使用的反思器，为None时不反思"""
+        self.reflector = reflector
+
+    def _entry_agents(self, agent_ids: Optional[List[str]]) -> List[str]:
+        """并行分支的入口智能体，默认为不是任何协作边目标的已注册智能体"""
+        if agent_ids is not None:
+            return list(agent_ids)
+        targets = {target for _, target, _ in self.collaboration_edges}
+        return [agent_id for agent_id in self.agents if agent_id not in targets]
+
+    def _workflow_key(self, entry_agents: List[str]) -> Tuple:
+        """工作流的拓扑：入口智能体、协作边和反思器"""
+        return (tuple(entry_agents), tuple(self.collaboration_edges),
+                id(self.reflector) if self.reflector is not None else None)
+
+    def _checkpoint_store(self) -> CheckpointStore:
+        if self.checkpoints is None:
+            raise ValueError("未配置checkpoint_path，无法保存会话状态")
+        return self.checkpoints
+
+    def get_conversation_state(self, conversation_id: str) -> AgentState:
+        """
+        获取会话状态，重启后首次访问时从检查点加载，新会话返回初始状态
+        
+        Args:
+            conversation_id: 会话ID，如微信联系人
+            
+        Returns:
+            会话的AgentState
+        """
+        return self._checkpoint_store().get(conversation_id)
+
+    def save_conversation_state(self, conversation_id: str,
+                                state: AgentState) -> None:
+        """
+        保存会话状态，由后台线程批量写入检查点
+        
+        Args:
+            conversation_id: 会话ID
+            state: 会话的AgentState（包含chat_history）
+        """
+        self._checkpoint_store().save(conversation_id, state)
+
+    def create_collaboration_workflow(self,
+                                      agent_ids: Optional[List[str]] = None):
+        """
+        获取协作工作流：路由 -> 并行的智能体分支 -> 择优 -> 反思
+        
+        同一拓扑只编译一次，可在启动时调用以预先编译
+        
+        Args:
+            agent_ids: 作为并行分支入口的智能体ID，为None时使用所有不是协作边目标的智能体
+            
+        Returns:
+            编译后的LangGraph图
+        """
+        entry_agents = self._entry_agents(agent_ids)
+        key = self._workflow_key(entry_agents)
+        workflow = self.workflows.get(key)
+        if workflow is not None:
+            return workflow
+        with self._workflows_lock:
+            workflow = self.workflows.get(key)
+            if workflow is None:
+                workflow = CollaborationWorkflow(self.agents, entry_agents,
+                                                 self.collaboration_edges,
+                                                 self.reflector).compile()
+                self.workflows[key] = workflow
+        return workflow
     
     def add_collaboration_edge(self, source_agent: str, target_agent: str, condition: str) -> None:
-        """添加智能体间的协作边"""
-        # 实现智能体间的条件连接
-        pass
+        """
+        添加智能体间的协作边
+        
+        源智能体处理完成后，condition为"always"或其返回状态中condition字段为真时，
+        由目标智能体在同一分支中继续处理
+        
+        Args:
+            source_agent: 源智能体ID
+            target_agent: 目标智能体ID
+            condition: 条件
+        """
+        for agent_id in (source_agent, target_agent):
+            if agent_id not in self.agents:
+                raise ValueError(f"智能体 {agent_id} 未注册")
+        edge = (source_agent, target_agent, condition)
+        if edge not in self.collaboration_edges:
+            self.collaboration_edges.append(edge)
+
+    def run_workflow(self,
+                     state: Dict[str, Any],
+                     agent_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        执行协作工作流
+        
+        Args:
+            state: 初始状态，可以用task_type限定参与的分支
+            agent_ids: 入口智能体ID，同create_collaboration_workflow
+            
+        Returns:
+            最终状态，candidates中包含各分支的结果和得分
+        """
+        result = self.create_collaboration_workflow(agent_ids).invoke(state)
+        self._record_workflow(result)
+        return result
+
+    async def arun_workflow(self,
+                            state: Dict[str, Any],
+                            agent_ids: Optional[List[str]] = None
+                            ) -> Dict[str, Any]:
+        """异步执行协作工作流，分支使用智能体的aprocess，参数和返回值同run_workflow"""
+        result = await self.create_collaboration_workflow(agent_ids).ainvoke(
+            state)
+        self._record_workflow(result)
+        return result
+
+    def _record_workflow(self, result: Dict[str, Any]) -> None:
+        """把工作流的分支得分和选中的智能体记入协作历史"""
+        self.record_collaboration({
+            "task_type": result.get("task_type"),
+            "selected_agent": result.get("current_agent"),
+            "branches": {
+                candidate["agent_id"]: candidate["score"]
+                for candidate in result.get("candidates", [])
+            }
+        })
     
+    def submit(self,
+               task: Dict[str, Any],
+               priority: int = 0,
+               timeout: Optional[float] = None,
+               block: bool = False) -> Future:
+        """
+        提交任务到调度器，由能处理该任务类型的智能体执行
+        
+        Args:
+            task: 任务，包含type（任务类型）和state（传给智能体的状态），
+                可以用agent_id指定智能体
+            priority: 优先级，数值越小越先执行
+            timeout: 任务执行超时（秒），为None时使用引擎的默认值
+            block: 队列已满时是否等待，为False时抛出QueueFullError
+            
+        Returns:
+            Future，结果为智能体返回的状态
+        """
+        return self.scheduler.submit(task, priority, timeout, block)
+
+    async def asubmit(self,
+                      task: Dict[str, Any],
+                      priority: int = 0,
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
+        """异步提交任务并等待结果，参数同submit"""
+        return await self.scheduler.asubmit(task, priority, timeout)
+
     def execute_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
-        """执行任务"""
-        # 将任务添加到队列并执行
-        self.global_state["task_queue"].append(task)
-        # 执行逻辑
-        return {}
\ No newline at end of file
+        """
+        执行任务并等待结果
+        
+        Args:
+            task: 任务，格式同submit，可以包含priority
+            
+        Returns:
+            智能体返回的状态
+        """
+        return self.submit(task, task.get("priority", 0), block=True).result()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取调度指标：队列深度、执行中的任务数、吞吐等"""
+        return self.scheduler.metrics()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """关闭调度器、消息总线和检查点存储，参数同TaskScheduler.shutdown"""
+        self.scheduler.shutdown(wait)
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+        self.message_bus.close()
+        if self._history_spill is not None:
+            self._history_spill.close()
\ No newline at end of file
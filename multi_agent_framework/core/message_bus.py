@@ -0,0 +1,363 @@
+"""
+消息总线
+按主题和智能体订阅投递消息，每个订阅者的信箱和协作历史都是固定容量的环形缓冲区，
+满时按策略覆盖最旧的消息或丢弃新消息，被覆盖的历史可以溢写到磁盘
+"""
+
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Callable, Set
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 缓冲区满时的策略
+OVERWRITE = "overwrite"
+DROP = "drop"
+
+
+class RingBuffer:
+    """
+    固定容量的环形缓冲区
+
+    追加和弹出都是O(1)，内存占用不随写入次数增长。满时按policy处理：
+    overwrite覆盖最旧的元素（被覆盖的元素交给on_evict），drop丢弃新元素。
+    本类不加锁，由调用方保证线程安全
+    """
+
+    def __init__(self,
+                 capacity: int,
+                 policy: str = OVERWRITE,
+                 on_evict: Optional[Callable[[Any], None]] = None):
+        """
+        初始化环形缓冲区
+
+        Args:
+            capacity: 容量
+            policy: 满时的策略，overwrite或drop
+            on_evict: 元素被覆盖时的回调，如溢写到磁盘
+        """
+        if policy not in (OVERWRITE, DROP):
+            raise ValueError(f"不支持的缓冲区策略: {policy}")
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self.on_evict = on_evict
+        self._items: List[Any] = [None] * self.capacity
+        self._head = 0
+        self._size = 0
+        # 被覆盖和被丢弃的元素数
+        self.overwritten = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Any]:
+        """从旧到新遍历"""
+        for i in range(self._size):
+            yield self._items[(self._head + i) % self.capacity]
+
+    def append(self, item: Any) -> bool:
+        """
+        追加元素
+
+        Args:
+            item: 元素
+
+        Returns:
+            是否写入，drop策略下缓冲区已满时为False
+        """
+        if self._size == self.capacity:
+            if self.policy == DROP:
+                self.dropped += 1
+                return False
+            evicted = self._items[self._head]
+            self._items[self._head] = item
+            self._head = (self._head + 1) % self.capacity
+            self.overwritten += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+            return True
+        self._items[(self._head + self._size) % self.capacity] = item
+        self._size += 1
+        return True
+
+    def popleft(self) -> Any:
+        """弹出最旧的元素"""
+        if not self._size:
+            raise IndexError("环形缓冲区为空")
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+        return item
+
+    def drain(self, max_items: Optional[int] = None) -> List[Any]:
+        """
+        按从旧到新的顺序弹出元素
+
+        Args:
+            max_items: 最多弹出的元素数，为None时全部弹出
+
+        Returns:
+            弹出的元素
+        """
+        count = self._size if max_items is None else min(max_items,
+                                                         self._size)
+        return [self.popleft() for _ in range(count)]
+
+    def tail(self, n: int) -> List[Any]:
+        """最新的n个元素，从旧到新"""
+        n = min(n, self._size)
+        return [
+            self._items[(self._head + self._size - n + i) % self.capacity]
+            for i in range(n)
+        ]
+
+    def clear(self) -> None:
+        self._items = [None] * self.capacity
+        self._head = 0
+        self._size = 0
+
+
+class SpillFile:
+    """
+    历史溢写文件，每行一条JSON记录，无法序列化的字段转为字符串
+    """
+
+    def __init__(self, path: str, flush_every: int = 64):
+        """
+        初始化溢写文件
+
+        Args:
+            path: 文件路径
+            flush_every: 每写入多少条记录刷新一次
+        """
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.written = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, record: Any) -> None:
+        with self._lock:
+            self._file.write(
+                json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self.written += 1
+            if self.written % self.flush_every == 0:
+                self._file.flush()
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        """按写入顺序读取已溢写的记录"""
+        with self._lock:
+            self._file.flush()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class MessageBus:
+    """
+    消息总线
+
+    订阅者（通常是智能体ID）各有一个信箱，发布到主题的消息投递到该主题每个订阅者的信箱，
+    指定recipient的消息只投递给该订阅者；每次投递为一次环形缓冲区追加。
+    所有消息同时写入容量为history_capacity的历史，被覆盖的历史可溢写到spill_path
+    """
+
+    def __init__(self,
+                 mailbox_capacity: int = 256,
+                 history_capacity: int = 1024,
+                 policy: str = OVERWRITE,
+                 spill_path: Optional[str] = None):
+        """
+        初始化消息总线
+
+        Args:
+            mailbox_capacity: 每个订阅者信箱的容量
+            history_capacity: 内存中保留的历史消息数
+            policy: 信箱满时的策略，overwrite覆盖最旧的消息，drop丢弃新消息
+            spill_path: 历史溢写文件（JSONL），为None时被覆盖的历史直接丢弃
+        """
+        self.mailbox_capacity = mailbox_capacity
+        self.policy = policy
+        self._spill = SpillFile(spill_path) if spill_path else None
+        self._history = RingBuffer(
+            history_capacity,
+            OVERWRITE,
+            on_evict=self._spill.write if self._spill else None)
+        self._mailboxes: Dict[str, RingBuffer] = {}
+        self._topics: Dict[str, Set[str]] = {}
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        # 统计信息
+        self.stats = {"published": 0, "delivered": 0, "undeliverable": 0}
+
+    def subscribe(self,
+                  subscriber_id: str,
+                  topics: Optional[Iterable[str]] = None) -> None:
+        """
+        订阅主题，首次订阅时创建信箱；不指定主题时只接收发给自己的消息
+
+        Args:
+            subscriber_id: 订阅者ID
+            topics: 主题
+        """
+        with self._cond:
+            if subscriber_id not in self._mailboxes:
+                self._mailboxes[subscriber_id] = RingBuffer(
+                    self.mailbox_capacity, self.policy)
+            for topic in topics or []:
+                self._topics.setdefault(topic, set()).add(subscriber_id)
+
+    def unsubscribe(self,
+                    subscriber_id: str,
+                    topics: Optional[Iterable[str]] = None) -> None:
+        """
+        取消订阅
+
+        Args:
+            subscriber_id: 订阅者ID
+            topics: 要取消的主题，为None时取消全部主题并删除信箱
+        """
+        with self._cond:
+            for topic in list(self._topics if topics is None else topics):
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscriber_id)
+                    if not subscribers:
+                        del self._topics[topic]
+            if topics is None:
+                self._mailboxes.pop(subscriber_id, None)
+
+    def publish(self,
+                topic: str,
+                payload: Any,
+                sender: Optional[str] = None,
+                recipient: Optional[str] = None) -> int:
+        """
+        发布消息
+
+        Args:
+            topic: 主题
+            payload: 消息内容
+            sender: 发送者ID
+            recipient: 接收者ID，指定时只投递给该订阅者
+
+        Returns:
+            成功投递的信箱数
+        """
+        message = {
+            "id": next(self._ids),
+            "topic": topic,
+            "sender": sender,
+            "recipient": recipient,
+            "timestamp": time.time(),
+            "payload": payload
+        }
+        with self._cond:
+            self.stats["published"] += 1
+            self._history.append(message)
+            if recipient is not None:
+                targets = [recipient] if recipient in self._mailboxes else []
+            else:
+                targets = self._topics.get(topic, ())
+            delivered = 0
+            for subscriber_id in targets:
+                if self._mailboxes[subscriber_id].append(message):
+                    delivered += 1
+            self.stats["delivered"] += delivered
+            if not delivered:
+                self.stats["undeliverable"] += 1
+            else:
+                self._cond.notify_all()
+        return delivered
+
+    def receive(self,
+                subscriber_id: str,
+                max_messages: Optional[int] = None,
+                timeout: Optional[float] = 0) -> List[Dict[str, Any]]:
+        """
+        取出信箱中的消息
+
+        Args:
+            subscriber_id: 订阅者ID
+            max_messages: 最多取出的消息数，为None时全部取出
+            timeout: 信箱为空时等待的秒数，0为不等待，None为一直等待
+
+        Returns:
+            从旧到新的消息
+        """
+        with self._cond:
+            mailbox = self._mailboxes.get(subscriber_id)
+            if mailbox is None:
+                raise KeyError(f"订阅者 {subscriber_id} 未订阅")
+            if not len(mailbox) and timeout != 0:
+                self._cond.wait_for(lambda: len(mailbox), timeout=timeout)
+            return mailbox.drain(max_messages)
+
+    def pending(self, subscriber_id: str) -> int:
+        """信箱中未取出的消息数"""
+        with self._cond:
+            mailbox = self._mailboxes.get(subscriber_id)
+            return len(mailbox) if mailbox is not None else 0
+
+    def history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        内存中最近的历史消息
+
+        Args:
+            limit: 最多返回的消息数，为None时全部返回
+
+        Returns:
+            从旧到新的消息
+        """
+        with self._cond:
+            if limit is None:
+                return list(self._history)
+            return self._history.tail(limit)
+
+    def spilled_history(self) -> Iterator[Dict[str, Any]]:
+        """已溢写到磁盘的历史消息，未配置溢写时为空"""
+        if self._spill is None:
+            return iter(())
+        return self._spill.read()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取总线指标
+
+        Returns:
+            发布、投递计数，信箱覆盖和丢弃的消息数，积压的消息数和溢写条数
+        """
+        with self._cond:
+            return {
+                **self.stats,
+                "subscribers": len(self._mailboxes),
+                "topics": len(self._topics),
+                "pending": sum(len(m) for m in self._mailboxes.values()),
+                "overwritten": sum(m.overwritten
+                                   for m in self._mailboxes.values()),
+                "dropped": sum(m.dropped for m in self._mailboxes.values()),
+                "history": len(self._history),
+                "spilled": self._spill.written if self._spill else 0
+            }
+
+    def close(self) -> None:
+        """关闭溢写文件"""
+        if self._spill is not None:
+            self._spill.close()
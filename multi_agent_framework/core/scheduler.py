@@ -0,0 +1,378 @@
+"""
+任务调度器
+按优先级排队的任务经BaseAgent.can_handle分派给已注册的智能体，
+在有界的工作池中执行，支持单智能体并发上限、超时和队列满时的背压
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from multi_agent_framework.agents.base import BaseAgent
+from multi_agent_framework.core.tracing import tracer
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """任务队列已满"""
+
+
+class _ScheduledTask:
+    """队列中的任务，按 (优先级, 提交顺序) 排序"""
+
+    __slots__ = ("priority", "seq", "task", "future", "timeout",
+                 "submitted_at")
+
+    def __init__(self, priority: int, seq: int, task: Dict[str, Any],
+                 future: Future, timeout: Optional[float]):
+        self.priority = priority
+        self.seq = seq
+        self.task = task
+        self.future = future
+        self.timeout = timeout
+        self.submitted_at = time.perf_counter()
+
+    def __lt__(self, other: "_ScheduledTask") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class TaskScheduler:
+    """
+    任务调度器
+
+    任务以agent.aprocess协程在调度器自己的事件循环中执行，同时执行的任务数不超过
+    max_workers；只有同步实现的智能体由事件循环的默认线程池（同样为max_workers个线程）
+    执行process。队列头部的任务没有空闲的智能体时，不阻塞后面可以分派的任务。
+    超时的任务会被取消，但在线程中执行的process无法中断，会继续运行到结束，
+    期间一直占用智能体和工作池的名额，线程池中不会积压等待线程的任务
+    """
+
+    def __init__(self,
+                 agents: Dict[str, Any],
+                 max_workers: int = 8,
+                 max_queue_size: int = 1000,
+                 agent_concurrency: int = 2,
+                 task_timeout: Optional[float] = 120.0,
+                 throughput_window: float = 60.0):
+        """
+        初始化任务调度器
+
+        Args:
+            agents: 智能体ID -> 智能体，与引擎共用同一个字典，之后注册的智能体自动可用
+            max_workers: 同时执行的任务数上限
+            max_queue_size: 排队任务数上限，达到后submit按block参数等待或抛出QueueFullError
+            agent_concurrency: 每个智能体默认的并发上限
+            task_timeout: 默认的任务执行超时（秒），为None时不限制
+            throughput_window: 计算吞吐的时间窗口（秒）
+        """
+        self.agents = agents
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.agent_concurrency = max(1, agent_concurrency)
+        self.task_timeout = task_timeout
+        self.throughput_window = throughput_window
+        # 智能体ID -> 单独设置的并发上限
+        self.agent_limits: Dict[str, int] = {}
+
+        self._queue: List[_ScheduledTask] = []
+        self._seq = itertools.count()
+        self._running: Dict[str, int] = {}
+        self._in_flight = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # 统计信息
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "cancelled": 0,
+            "rejected": 0
+        }
+        self._finished_at: deque = deque()
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=self.max_workers,
+                               thread_name_prefix="agent-worker"))
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name="agent-scheduler",
+                                        daemon=True)
+        self._thread.start()
+
+    def set_agent_concurrency(self, agent_id: str, limit: int) -> None:
+        """
+        设置单个智能体的并发上限
+
+        Args:
+            agent_id: 智能体ID
+            limit: 同时执行的任务数上限
+        """
+        with self._cond:
+            self.agent_limits[agent_id] = max(1, limit)
+        self._wake()
+
+    def submit(self,
+               task: Dict[str, Any],
+               priority: int = 0,
+               timeout: Optional[float] = None,
+               block: bool = False,
+               queue_timeout: Optional[float] = None) -> Future:
+        """
+        提交任务
+
+        Args:
+            task: 任务，包含type（任务类型）和state（传给智能体的状态），
+                可以用agent_id指定智能体；没有state时整个任务作为状态
+            priority: 优先级，数值越小越先执行
+            timeout: 任务执行超时（秒），为None时使用task_timeout
+            block: 队列已满时是否等待
+            queue_timeout: block为True时最多等待的秒数，为None时一直等待
+
+        Returns:
+            Future，结果为智能体返回的状态
+
+        Raises:
+            QueueFullError: 队列已满且不等待，或等待超时
+        """
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("调度器已关闭")
+            if len(self._queue) >= self.max_queue_size:
+                has_room = block and self._cond.wait_for(
+                    lambda: (len(self._queue) < self.max_queue_size or
+                             self._closed),
+                    timeout=queue_timeout)
+                if not has_room or self._closed:
+                    self.stats["rejected"] += 1
+                    raise QueueFullError(
+                        f"任务队列已满（{self.max_queue_size}），请稍后重试")
+            heapq.heappush(
+                self._queue,
+                _ScheduledTask(priority, next(self._seq), task, future,
+                               self.task_timeout if timeout is None else
+                               timeout))
+            self.stats["submitted"] += 1
+        self._wake()
+        return future
+
+    async def asubmit(self,
+                      task: Dict[str, Any],
+                      priority: int = 0,
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        异步提交任务并等待结果，参数同submit，队列已满时抛出QueueFullError
+
+        Returns:
+            智能体返回的状态
+        """
+        return await asyncio.wrap_future(self.submit(task, priority, timeout))
+
+    def _wake(self) -> None:
+        """在事件循环中尝试分派任务"""
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch)
+
+    def _candidates(self, task: Dict[str, Any]) -> List[str]:
+        """能处理任务的智能体ID"""
+        agent_id = task.get("agent_id")
+        if agent_id:
+            return [agent_id] if agent_id in self.agents else []
+        task_type = task.get("type", "")
+        return [
+            agent_id for agent_id, agent in list(self.agents.items())
+            if agent.can_handle(task_type)
+        ]
+
+    def _dispatch(self) -> None:
+        """按优先级分派任务，直到工作池已满或剩余任务都没有空闲的智能体"""
+        with self._cond:
+            if self._in_flight >= self.max_workers or not self._queue:
+                return
+            dispatched = []
+            for item in sorted(self._queue):
+                if self._in_flight >= self.max_workers:
+                    break
+                candidates = self._candidates(item.task)
+                if not candidates:
+                    dispatched.append(item)
+                    if item.future.set_running_or_notify_cancel():
+                        item.future.set_exception(
+                            ValueError(f"没有能处理任务类型 "
+                                       f"{item.task.get('type')} 的智能体"))
+                        self.stats["failed"] += 1
+                    else:
+                        self.stats["cancelled"] += 1
+                    continue
+                free = [
+                    agent_id for agent_id in candidates
+                    if self._running.get(agent_id, 0) < self.agent_limits.get(
+                        agent_id, self.agent_concurrency)
+                ]
+                if not free:
+                    continue
+                dispatched.append(item)
+                if not item.future.set_running_or_notify_cancel():
+                    self.stats["cancelled"] += 1
+                    continue
+                # 选择正在执行任务最少的智能体
+                agent_id = min(free, key=lambda a: self._running.get(a, 0))
+                self._running[agent_id] = self._running.get(agent_id, 0) + 1
+                self._in_flight += 1
+                self._loop.create_task(self._run(item, agent_id))
+            if dispatched:
+                removed = set(map(id, dispatched))
+                self._queue = [
+                    item for item in self._queue if id(item) not in removed
+                ]
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    @staticmethod
+    def _runs_in_thread(agent: Any) -> bool:
+        """智能体没有自己的异步实现，aprocess只是在线程中执行process"""
+        aprocess = getattr(type(agent), "aprocess", None)
+        return aprocess is None or aprocess is BaseAgent.aprocess
+
+    async def _run(self, item: _ScheduledTask, agent_id: str) -> None:
+        """
+        执行单个任务并设置其future
+
+        在线程中执行的process超时后，future立即以TimeoutError结束，
+        并发名额等线程真正结束后才释放
+        """
+        started_at = time.perf_counter()
+        state = item.task.get("state", item.task)
+        agent = self.agents[agent_id]
+        worker: Optional[asyncio.Future] = None
+        status = "completed"
+        try:
+            with tracer.span("scheduler.task",
+                             agent_id=agent_id,
+                             task_type=item.task.get("type"),
+                             priority=item.priority,
+                             queue_wait_ms=(started_at - item.submitted_at) *
+                             1000):
+                if self._runs_in_thread(agent):
+                    # 与asyncio.to_thread一样把当前span带到线程中
+                    context = contextvars.copy_context()
+                    worker = self._loop.run_in_executor(
+                        None, context.run, agent.process, state)
+                    # shield保证超时不会取消worker，由它的回调释放名额
+                    awaitable = asyncio.shield(worker)
+                else:
+                    awaitable = agent.aprocess(state)
+                result = await asyncio.wait_for(awaitable, item.timeout)
+            item.future.set_result(result)
+        except asyncio.TimeoutError:
+            status = "timed_out"
+            item.future.set_exception(
+                TimeoutError(f"智能体 {agent_id} 执行任务超时（{item.timeout}s）"))
+        except Exception as e:
+            status = "failed"
+            logger.warning(f"智能体 {agent_id} 执行任务失败: {e}")
+            item.future.set_exception(e)
+        finally:
+            if worker is not None and not worker.done():
+                worker.add_done_callback(
+                    lambda done: self._release_overrun(done, item, agent_id,
+                                                       started_at, status))
+            else:
+                self._release(item, agent_id, started_at, status)
+
+    def _release_overrun(self, worker: asyncio.Future, item: _ScheduledTask,
+                         agent_id: str, started_at: float, status: str) -> None:
+        """超时后仍在运行的线程结束时释放名额"""
+        if not worker.cancelled() and worker.exception() is not None:
+            logger.warning(f"智能体 {agent_id} 超时后执行失败: "
+                           f"{worker.exception()}")
+        self._release(item, agent_id, started_at, status)
+
+    def _release(self, item: _ScheduledTask, agent_id: str, started_at: float,
+                 status: str) -> None:
+        """释放任务占用的智能体和工作池名额，记录统计并继续分派"""
+        finished_at = time.perf_counter()
+        with self._cond:
+            self._running[agent_id] -= 1
+            self._in_flight -= 1
+            self.stats[status] += 1
+            self._total_wait += started_at - item.submitted_at
+            self._total_run += finished_at - started_at
+            self._finished_at.append(finished_at)
+            self._trim_finished(finished_at)
+            self._cond.notify_all()
+        self._dispatch()
+
+    def _trim_finished(self, now: float) -> None:
+        """丢弃吞吐窗口之外的完成时间，调用方需持有self._cond"""
+        while self._finished_at and (now - self._finished_at[0] >
+                                     self.throughput_window):
+            self._finished_at.popleft()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取调度指标
+
+        Returns:
+            队列深度、执行中的任务数、各智能体执行中的任务数、计数器、
+            最近throughput_window秒的吞吐（任务/秒）和平均排队、执行耗时
+        """
+        now = time.perf_counter()
+        with self._cond:
+            self._trim_finished(now)
+            finished = sum(self.stats[key] for key in ("completed", "failed",
+                                                        "timed_out"))
+            return {
+                "queue_depth": len(self._queue),
+                "in_flight": self._in_flight,
+                "running_by_agent": {
+                    agent_id: count
+                    for agent_id, count in self._running.items() if count
+                },
+                **self.stats,
+                "throughput_per_sec":
+                len(self._finished_at) / self.throughput_window,
+                "avg_queue_wait_ms":
+                self._total_wait / finished * 1000 if finished else 0.0,
+                "avg_run_ms":
+                self._total_run / finished * 1000 if finished else 0.0
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        关闭调度器，不再接受新任务
+
+        Args:
+            wait: 是否等待排队的任务执行完成，为False时取消排队的任务；
+                执行中的任务总会等待其结束
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            if not wait:
+                for item in self._queue:
+                    if item.future.cancel():
+                        self.stats["cancelled"] += 1
+                self._queue = []
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._queue and not self.
+                                _in_flight)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        self._loop.close()
@@ -1,8 +1,10 @@
 """状态管理模块"""
+import operator
 from typing import Annotated, Sequence, Dict, Any, List, Optional
 from typing_extensions import TypedDict
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
+from multi_agent_framework.core.message_bus import MessageBus, RingBuffer
 
 
 class AgentState(TypedDict):
@@ -43,6 +45,17 @@ class AgentState(TypedDict):
     chat_history: List[Dict[str, Any]]
 
 
+class WorkflowState(AgentState, total=False):
+    """
+    协作工作流状态定义
+    """
+    # 任务类型，路由节点据此选择能处理该任务的智能体
+    task_type: str
+    
+    # 各并行分支的结果，分支并发写入时按列表拼接
+    candidates: Annotated[List[Dict[str, Any]], operator.add]
+
+
 class GlobalState(TypedDict):
     """
     全局状态定义 - 用于多智能体协作
@@ -54,7 +67,7 @@ class GlobalState(TypedDict):
     task_queue: List[Dict[str, Any]]
     
     # 消息总线
-    message_bus: List[Dict[str, Any]]
+    message_bus: MessageBus
     
-    # 协作历史
-    collaboration_history: List[Dict[str, Any]]
\ No newline at end of file
+    # 协作历史（固定容量的环形缓冲区）
+    collaboration_history: RingBuffer
\ No newline at end of file
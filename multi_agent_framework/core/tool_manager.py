@@ -1,5 +1,11 @@
 """工具管理器"""
-from typing import Dict, Any, List
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import (CancelledError, Future, ThreadPoolExecutor,
+                                TimeoutError as FutureTimeoutError)
+from typing import Dict, Any, List, Optional, Tuple
 from multi_agent_framework.tools.base import BaseTool
 
 
@@ -7,36 +13,65 @@ class ToolManager:
     """
     工具管理器 - 管理所有可用工具
     """
-    
-    def __init__(self):
+
+    def __init__(self,
+                 max_workers: int = 8,
+                 default_timeout: Optional[float] = 30.0,
+                 cache_size: int = 1024):
+        """
+        初始化工具管理器
+
+        Args:
+            max_workers: 共享线程池的线程数，execute_many的调用在其中并发执行
+            default_timeout: 工具未设置timeout时execute_many使用的超时（秒）
+            cache_size: 每个工具最多缓存的结果数
+        """
         self.tools: Dict[str, BaseTool] = {}
-        
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.cache_size = cache_size
+        # 工具名 -> 并发上限信号量
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        # 工具名 -> (输入的规范化JSON -> (过期时间, 结果))，按LRU淘汰
+        self._caches: Dict[str, OrderedDict] = {}
+        self._cache_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # 统计信息
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "timeouts": 0}
+
     def register_tool(self, tool: BaseTool) -> None:
         """
         注册工具
-        
+
         Args:
             tool: 工具实例
         """
         self.tools[tool.name] = tool
+        if tool.max_concurrency:
+            self._semaphores[tool.name] = threading.BoundedSemaphore(
+                tool.max_concurrency)
+        else:
+            self._semaphores.pop(tool.name, None)
+        self.clear_cache(tool.name)
         print(f"工具 {tool.name} 注册成功")
-        
+
     def get_tool(self, tool_name: str) -> BaseTool:
         """
         获取工具
-        
+
         Args:
             tool_name: 工具名称
-            
+
         Returns:
             工具实例
         """
         return self.tools.get(tool_name)
-        
+
     def list_tools(self) -> List[Dict[str, str]]:
         """
         列出所有工具
-        
+
         Returns:
             工具列表
         """
@@ -47,30 +82,194 @@ class ToolManager:
                 "description": tool.get_description()
             })
         return tool_list
-        
+
     def execute_tool(self, tool_name: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        执行工具
-        
+        执行工具，工具设置了timeout时在共享线程池中执行并等待不超过timeout秒
+
         Args:
             tool_name: 工具名称
             input_data: 输入数据
-            
+
         Returns:
             执行结果
         """
         tool = self.get_tool(tool_name)
         if not tool:
-            return {
-                "success": False,
-                "error": f"工具 {tool_name} 未找到"
-            }
-            
+            return self._not_found(tool_name)
+        if tool.timeout is not None:
+            return self.execute_many([{"tool": tool_name, "input": input_data}])[0]
+        return self._run_tool(tool, input_data)
+
+    def execute_many(self,
+                     calls: List[Dict[str, Any]],
+                     timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        在共享线程池中并发执行多个互不依赖的工具调用
+
+        每个调用的超时为timeout、工具的timeout、default_timeout中第一个不为None的值，
+        从提交时开始计算；开启缓存的工具，同一批中输入相同的调用只执行一次
+
+        Args:
+            calls: 工具调用列表，每项包含tool（工具名称）和input（输入数据）
+            timeout: 统一的超时（秒），为None时按工具设置
+
+        Returns:
+            与calls一一对应的执行结果
+        """
+        start = time.monotonic()
+        futures: List[Optional[Future]] = []
+        shared: Dict[Tuple[str, str], Future] = {}
+        for call in calls:
+            tool = self.get_tool(call.get("tool"))
+            if not tool:
+                futures.append(None)
+                continue
+            input_data = call.get("input") or {}
+            key = None
+            if tool.cache_ttl:
+                key = (tool.name, self._cache_key(input_data))
+                if key in shared:
+                    futures.append(shared[key])
+                    continue
+            future = self._get_executor().submit(self._run_tool, tool,
+                                                 input_data)
+            if key is not None:
+                shared[key] = future
+            futures.append(future)
+
+        # 每个Future还有多少个调用在等待，同一批中输入相同的调用共用一个Future
+        waiting: Dict[int, int] = {}
+        for future in futures:
+            if future is not None:
+                waiting[id(future)] = waiting.get(id(future), 0) + 1
+
+        results = []
+        for call, future in zip(calls, futures):
+            tool_name = call.get("tool")
+            if future is None:
+                results.append(self._not_found(tool_name))
+                continue
+            waiting[id(future)] -= 1
+            call_timeout = self._timeout(self.tools[tool_name], timeout)
+            remaining = (None if call_timeout is None else
+                         max(0.0, start + call_timeout - time.monotonic()))
+            try:
+                results.append(dict(future.result(timeout=remaining)))
+            except FutureTimeoutError:
+                # 没有其他调用在等待时，还未开始的调用直接取消，
+                # 已开始的会在后台执行完并写入缓存
+                if not waiting[id(future)]:
+                    future.cancel()
+                self.stats["timeouts"] += 1
+                results.append({
+                    "success": False,
+                    "error": f"工具 {tool_name} 执行超时（{call_timeout}s）"
+                })
+            except CancelledError:
+                # 线程池关闭时取消了未开始的调用
+                results.append({
+                    "success": False,
+                    "error": f"工具 {tool_name} 调用已取消"
+                })
+        return results
+
+    def _timeout(self, tool: BaseTool,
+                 timeout: Optional[float]) -> Optional[float]:
+        for value in (timeout, tool.timeout, self.default_timeout):
+            if value is not None:
+                return value
+        return None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """首次并发执行时创建共享线程池"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="tool-worker")
+        return self._executor
+
+    def _run_tool(self, tool: BaseTool,
+                  input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """查缓存并在并发上限内执行工具，只缓存成功的结果"""
+        key = self._cache_key(input_data) if tool.cache_ttl else None
+        if key is not None:
+            cached = self._cache_get(tool.name, key)
+            if cached is not None:
+                return cached
+
+        semaphore = self._semaphores.get(tool.name)
         try:
-            result = tool.run(input_data)
-            return result
+            if semaphore is not None:
+                with semaphore:
+                    result = tool.run(input_data)
+            else:
+                result = tool.run(input_data)
         except Exception as e:
             return {
                 "success": False,
                 "error": f"工具执行失败: {str(e)}"
-            }
\ No newline at end of file
+            }
+
+        if key is not None and result.get("success"):
+            self._cache_put(tool.name, key, result, tool.cache_ttl)
+        return result
+
+    @staticmethod
+    def _not_found(tool_name: str) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "error": f"工具 {tool_name} 未找到"
+        }
+
+    @staticmethod
+    def _cache_key(input_data: Dict[str, Any]) -> str:
+        """输入数据的规范化JSON，字段顺序不影响缓存命中"""
+        return json.dumps(input_data, sort_keys=True, ensure_ascii=False,
+                          default=str)
+
+    def _cache_get(self, tool_name: str,
+                   key: str) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            cache = self._caches.get(tool_name)
+            entry = cache.get(key) if cache is not None else None
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del cache[key]
+                self.stats["cache_misses"] += 1
+                return None
+            cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            # 返回副本，调用方修改结果不会影响缓存
+            return dict(entry[1])
+
+    def _cache_put(self, tool_name: str, key: str, result: Dict[str, Any],
+                   ttl: float) -> None:
+        with self._cache_lock:
+            cache = self._caches.setdefault(tool_name, OrderedDict())
+            cache[key] = (time.monotonic() + ttl, dict(result))
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def clear_cache(self, tool_name: Optional[str] = None) -> None:
+        """
+        清空工具结果缓存
+
+        Args:
+            tool_name: 工具名称，为None时清空所有工具的缓存
+        """
+        with self._cache_lock:
+            if tool_name is None:
+                self._caches.clear()
+            else:
+                self._caches.pop(tool_name, None)
+
+    def shutdown(self) -> None:
+        """关闭共享线程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,554 @@
+"""
+链路追踪与指标模块
+以上下文管理器记录各阶段的span（父子关系、耗时、token数、缓存命中），
+汇总到进程内的直方图注册表，可导出为JSONL文件和Prometheus文本格式。
+未启用时span()返回共享的空操作对象，开销只有一次属性判断
+"""
+
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认的耗时直方图分桶（毫秒）
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000,
+                      10000, 30000)
+
+# 当前线程/协程所在的span
+_current_span: contextvars.ContextVar[Optional["Span"]] = \
+    contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    一次阶段调用的记录
+
+    作为上下文管理器使用时成为当前span，其中创建的span自动以它为父节点；
+    asyncio任务和asyncio.to_thread会复制上下文，ThreadPoolExecutor提交的任务不会
+    """
+
+    def __init__(self,
+                 tracer: "Tracer",
+                 name: str,
+                 parent: Optional["Span"] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """设置属性，如领域、检索模式、cache_hit"""
+        self.attributes[key] = value
+
+    def add(self, key: str, value: float = 1) -> None:
+        """累加计数属性，如prompt_tokens、completion_tokens"""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """结束span并交给追踪器记录，重复调用无效"""
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer._on_finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current_span.reset(self._token)
+        self.finish(exc)
+        return False
+
+
+class _NoopSpan:
+    """追踪未启用时使用的空操作span"""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add(self, key: str, value: float = 1) -> None:
+        pass
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Histogram:
+    """累积分桶直方图，格式与Prometheus histogram一致"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按分桶上界估计分位数"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...],
+                   extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = [(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+               for key, value in items]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+
+    直方图和计数器以 (指标名, 标签) 区分，线程安全
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets = buckets
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """记录一次观测值"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """累加计数器"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取指标快照
+
+        Returns:
+            {"histograms": [...], "counters": [...]}，直方图包含count、sum和估计的p50/p95/p99
+        """
+        with self._lock:
+            histograms = [{
+                "name": name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99)
+            } for (name, labels), histogram in self.histograms.items()]
+            counters = [{
+                "name": name,
+                "labels": dict(labels),
+                "value": value
+            } for (name, labels), value in self.counters.items()]
+        return {"histograms": histograms, "counters": counters}
+
+    def to_prometheus(self) -> str:
+        """导出为Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            by_name: Dict[str, list] = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                by_name.setdefault(name, []).append((labels, histogram))
+            for name, series in by_name.items():
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets,
+                                            histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket"
+                                     f"{_format_labels(labels, ('le', str(bound)))}"
+                                     f" {cumulative}")
+                    lines.append(f"{name}_bucket"
+                                 f"{_format_labels(labels, ('le', '+Inf'))}"
+                                 f" {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} "
+                                 f"{histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} "
+                                 f"{histogram.count}")
+
+            counter_names = sorted({name for name, _ in self.counters})
+            for name in counter_names:
+                lines.append(f"# TYPE {name} counter")
+                for (counter_name, labels), value in sorted(
+                        self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class JsonlExporter:
+    """将结束的span逐行追加写入JSONL文件"""
+
+    def __init__(self, path: str, flush_every: int = 64):
+        """
+        初始化JSONL导出器
+
+        Args:
+            path: 输出文件路径
+            flush_every: 每写入多少个span刷新一次文件缓冲
+        """
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.flush()
+            self._file.close()
+
+
+class PrometheusExporter:
+    """在后台线程中提供 /metrics 文本接口"""
+
+    def __init__(self, registry: MetricsRegistry, port: int,
+                 host: str = "0.0.0.0"):
+        """
+        启动Prometheus指标接口
+
+        Args:
+            registry: 指标注册表
+            port: 监听端口
+            host: 监听地址
+        """
+        handler = self._make_handler(registry)
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="prometheus-exporter",
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Prometheus指标接口已启动: http://{host}:{port}/metrics")
+
+    @staticmethod
+    def _make_handler(registry: MetricsRegistry):
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
+
+    def export(self, span: Span) -> None:
+        # 指标由追踪器写入注册表，接口按需读取
+        pass
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Tracer:
+    """
+    追踪器
+
+    span结束时记录耗时直方图 span_duration_ms{span=...}，
+    cache_hit属性（单次请求）或cache_hits/cache_misses属性（批量请求的命中和未命中数）
+    计入 cache_requests_total{span=..., result=hit|miss}，
+    *_tokens属性计入 tokens_total{span=..., kind=...}，再交给各导出器
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.registry = MetricsRegistry()
+        self.exporters: List[Any] = []
+
+    def span(self, name: str, **attributes) -> Any:
+        """
+        创建以当前span为父节点的span，未启用时返回空操作对象
+
+        Args:
+            name: span名称，如 rag.query、router.semantic
+            **attributes: 初始属性
+
+        Returns:
+            可作为上下文管理器使用的span
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def start_span(self, name: str,
+                   parent: Optional[Span] = None,
+                   **attributes) -> Any:
+        """
+        创建不改变当前上下文的span，需要手动调用finish，用于回调等无法使用with的场景
+
+        Args:
+            name: span名称
+            parent: 父span，默认为当前span
+            **attributes: 初始属性
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, parent or _current_span.get(), attributes)
+
+    def current_span(self) -> Any:
+        """获取当前span，没有时返回空操作对象"""
+        return _current_span.get() or _NOOP_SPAN
+
+    def _on_finish(self, span: Span) -> None:
+        self.registry.observe("span_duration_ms", span.duration_ms,
+                              span=span.name)
+        if span.status == "error":
+            self.registry.inc("span_errors_total", span=span.name)
+        cache_hit = span.attributes.get("cache_hit")
+        if cache_hit is not None:
+            self.registry.inc("cache_requests_total",
+                              span=span.name,
+                              result="hit" if cache_hit else "miss")
+        for key, result in (("cache_hits", "hit"), ("cache_misses", "miss")):
+            count = span.attributes.get(key)
+            if count:
+                self.registry.inc("cache_requests_total",
+                                  count,
+                                  span=span.name,
+                                  result=result)
+        for key, value in span.attributes.items():
+            if key.endswith("_tokens") and isinstance(value, (int, float)):
+                self.registry.inc("tokens_total",
+                                  value,
+                                  span=span.name,
+                                  kind=key[:-len("_tokens")])
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"导出span失败: {e}")
+
+    def configure(self,
+                  enabled: bool = True,
+                  jsonl_path: Optional[str] = None,
+                  prometheus_port: Optional[int] = None) -> None:
+        """
+        启用或关闭追踪，并设置导出器
+
+        Args:
+            enabled: 是否启用
+            jsonl_path: span的JSONL输出文件，为None时不写文件
+            prometheus_port: Prometheus指标接口端口，为None时不启动
+        """
+        self.shutdown()
+        if jsonl_path:
+            self.exporters.append(JsonlExporter(jsonl_path))
+        if prometheus_port:
+            self.exporters.append(PrometheusExporter(self.registry,
+                                                     prometheus_port))
+        self.enabled = enabled
+
+    def shutdown(self) -> None:
+        """关闭追踪并释放导出器"""
+        self.enabled = False
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain回调处理器
+
+    为链内部的检索器和大模型调用创建子span，并把token用量累加到span上
+    """
+
+    # 异步调用时也在当前协程中执行回调，子span才能找到正确的父span
+    run_inline = True
+
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+        self._spans: Dict[Any, Any] = {}
+
+    def _start(self, run_id, name: str, **attributes) -> None:
+        self._spans[run_id] = self.tracer.start_span(name, **attributes)
+
+    def _end(self, run_id, error: Optional[BaseException] = None):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.finish(error)
+        return span
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retriever")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None:
+            span.set_attribute("documents", len(documents))
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None:
+            for key, value in _token_usage(response).items():
+                span.add(key, value)
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+def _token_usage(response) -> Dict[str, int]:
+    """从LLMResult中提取token用量"""
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage")
+    if usage:
+        return {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0)
+        }
+    totals = {"prompt_tokens": 0, "completion_tokens": 0}
+    for generations in getattr(response, "generations", []):
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None),
+                               "usage_metadata", None)
+            if metadata:
+                totals["prompt_tokens"] += metadata.get("input_tokens", 0)
+                totals["completion_tokens"] += metadata.get("output_tokens", 0)
+    return totals
+
+
+def record_token_usage(span, message) -> None:
+    """
+    把AIMessage上的token用量累加到span
+
+    Args:
+        span: 当前span
+        message: 大模型返回的消息
+    """
+    metadata = getattr(message, "usage_metadata", None)
+    if metadata:
+        span.add("prompt_tokens", metadata.get("input_tokens", 0))
+        span.add("completion_tokens", metadata.get("output_tokens", 0))
+
+
+# 进程内共享的追踪器，设置环境变量TRACING_ENABLED=1时自动启用
+tracer = Tracer()
+if os.getenv("TRACING_ENABLED", "").lower() in ("1", "true", "yes"):
+    tracer.configure(jsonl_path=os.getenv("TRACING_JSONL_PATH"),
+                     prometheus_port=int(os.getenv("TRACING_PROMETHEUS_PORT"))
+                     if os.getenv("TRACING_PROMETHEUS_PORT") else None)
+
+
+def callbacks_config() -> Optional[Dict[str, Any]]:
+    """
+    获取传给LangChain invoke的config，追踪未启用时返回None
+
+    Returns:
+        {"callbacks": [TracingCallbackHandler]} 或 None
+    """
+    if not tracer.enabled:
+        return None
+    return {"callbacks": [TracingCallbackHandler(tracer)]}
+
@@ -0,0 +1,239 @@
+"""
+协作工作流
+由声明的协作边构建 路由 -> 智能体分支 -> 择优 -> 反思 的LangGraph图，
+能处理任务的入口智能体作为独立分支在同一步中并行执行
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
+
+from multi_agent_framework.core.state import WorkflowState
+from multi_agent_framework.core.tracing import tracer
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 协作边: (源智能体, 目标智能体, 条件)
+CollaborationEdge = Tuple[str, str, str]
+
+# 工作流状态的全部字段
+_STATE_KEYS = WorkflowState.__required_keys__ | WorkflowState.__optional_keys__
+
+# 分支结果写回工作流状态时不覆盖的字段
+_MERGE_EXCLUDED = ("messages", "candidates")
+
+
+def candidate_score(state: Dict[str, Any]) -> float:
+    """
+    分支结果的得分
+
+    有答案验证结果时使用overall_score（判定不相关时减半），
+    没有验证结果但有答案时为0.5，没有答案时为0
+
+    Args:
+        state: 分支返回的状态
+
+    Returns:
+        0到1之间的得分
+    """
+    answer = state.get("answer")
+    if not getattr(answer, "content", answer):
+        return 0.0
+    validation = state.get("answer_validation")
+    if not validation:
+        return 0.5
+    score = float(validation.get("overall_score", 0.5))
+    return score if validation.get("is_relevant", True) else score / 2
+
+
+def select_candidate(candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    选出得分最高的分支结果，得分相同时取排在前面的分支
+
+    Args:
+        candidates: 各分支的结果，包含agent_id、score和state
+
+    Returns:
+        得分最高的分支结果
+    """
+    return max(candidates, key=lambda candidate: candidate["score"])
+
+
+def _edge_matches(condition: str, state: Dict[str, Any]) -> bool:
+    """条件为always，或状态中同名字段为真时沿协作边继续"""
+    return condition == "always" or bool(state.get(condition))
+
+
+class CollaborationWorkflow:
+    """
+    协作工作流的构建和节点实现
+
+    每个入口智能体对应一个分支节点，分支内沿协作边依次调用后续智能体；
+    路由节点一次返回所有能处理任务的分支，LangGraph在同一步中并行执行它们，
+    择优节点在所有分支结束后执行一次
+    """
+
+    def __init__(self,
+                 agents: Dict[str, Any],
+                 entry_agents: List[str],
+                 edges: List[CollaborationEdge],
+                 reflector: Optional[Any] = None):
+        """
+        初始化协作工作流
+
+        Args:
+            agents: 智能体ID -> 智能体
+            entry_agents: 作为并行分支入口的智能体ID
+            edges: 协作边
+            reflector: 反思器，为None时不反思
+        """
+        self.agents = agents
+        self.entry_agents = list(entry_agents)
+        self.edges = list(edges)
+        self.reflector = reflector
+
+    def compile(self):
+        """
+        构建并编译LangGraph图
+
+        Returns:
+            编译后的图
+        """
+        graph = StateGraph(WorkflowState)
+        graph.add_node("route", RunnableLambda(self._route))
+        graph.add_edge(START, "route")
+        for agent_id in self.entry_agents:
+            graph.add_node(
+                self._branch_name(agent_id),
+                RunnableLambda(self._make_branch(agent_id),
+                               afunc=self._make_abranch(agent_id)))
+            graph.add_edge(self._branch_name(agent_id), "select")
+        graph.add_conditional_edges(
+            "route", self._fan_out,
+            [self._branch_name(agent_id) for agent_id in self.entry_agents] +
+            ["select"])
+        graph.add_node("select", RunnableLambda(self._select))
+        if self.reflector is not None:
+            graph.add_node("reflect",
+                           RunnableLambda(self._reflect, afunc=self._areflect))
+            graph.add_edge("select", "reflect")
+            graph.add_edge("reflect", END)
+        else:
+            graph.add_edge("select", END)
+        return graph.compile()
+
+    @staticmethod
+    def _branch_name(agent_id: str) -> str:
+        return f"branch_{agent_id}"
+
+    def _route(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """路由节点，分支的选择见_fan_out"""
+        return {}
+
+    def _fan_out(self, state: Dict[str, Any]) -> List[str]:
+        """选出能处理任务类型的入口智能体，未指定任务类型时使用全部入口"""
+        task_type = state.get("task_type")
+        branches = [
+            self._branch_name(agent_id) for agent_id in self.entry_agents
+            if not task_type or self.agents[agent_id].can_handle(task_type)
+        ]
+        return branches or ["select"]
+
+    def _next_agent(self, agent_id: str, state: Dict[str, Any],
+                    visited: set) -> Optional[str]:
+        """沿第一条满足条件且未访问过的协作边找到下一个智能体"""
+        for source, target, condition in self.edges:
+            if (source == agent_id and target not in visited
+                    and _edge_matches(condition, state)):
+                return target
+        return None
+
+    def _branch_input(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: value
+            for key, value in state.items() if key != "candidates"
+        }
+
+    def _make_branch(self, entry_agent: str):
+        """同步分支：从入口智能体开始沿协作边依次执行"""
+
+        def branch(state: Dict[str, Any]) -> Dict[str, Any]:
+            with tracer.span("workflow.branch", agent_id=entry_agent):
+                agent_id, visited = entry_agent, set()
+                state = self._branch_input(state)
+                while agent_id is not None:
+                    visited.add(agent_id)
+                    state = self.agents[agent_id].process(state)
+                    state["current_agent"] = agent_id
+                    agent_id = self._next_agent(agent_id, state, visited)
+            return {"candidates": [self._candidate(entry_agent, state)]}
+
+        return branch
+
+    def _make_abranch(self, entry_agent: str):
+        """异步分支，使用智能体的aprocess"""
+
+        async def abranch(state: Dict[str, Any]) -> Dict[str, Any]:
+            with tracer.span("workflow.branch", agent_id=entry_agent):
+                agent_id, visited = entry_agent, set()
+                state = self._branch_input(state)
+                while agent_id is not None:
+                    visited.add(agent_id)
+                    state = await self.agents[agent_id].aprocess(state)
+                    state["current_agent"] = agent_id
+                    agent_id = self._next_agent(agent_id, state, visited)
+            return {"candidates": [self._candidate(entry_agent, state)]}
+
+        return abranch
+
+    @staticmethod
+    def _candidate(agent_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "agent_id": agent_id,
+            "score": candidate_score(state),
+            "state": state
+        }
+
+    def _select(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """择优节点：把得分最高的分支结果写回工作流状态"""
+        candidates = state.get("candidates") or []
+        if not candidates:
+            logger.warning(f"没有能处理任务类型 {state.get('task_type')} 的智能体")
+            return {"final_answer": "", "needs_reflection": False}
+        best = select_candidate(candidates)
+        logger.info(f"协作工作流选择智能体 {best['agent_id']} 的答案，得分 "
+                    f"{best['score']:.4f}（共 {len(candidates)} 个分支）")
+        return {
+            key: value
+            for key, value in best["state"].items()
+            if key in _STATE_KEYS and key not in _MERGE_EXCLUDED
+        }
+
+    def _reflect_update(self, state: Dict[str, Any],
+                        reflected: Dict[str, Any]) -> Dict[str, Any]:
+        """反思器返回状态的副本，只写回其中被替换过的字段"""
+        return {
+            key: value
+            for key, value in reflected.items()
+            if key in _STATE_KEYS and key not in _MERGE_EXCLUDED
+            and state.get(key) is not value
+        }
+
+    def _reflect(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """反思节点，没有答案时跳过"""
+        if not state.get("needs_reflection", True) or not state.get("answer"):
+            return {}
+        return self._reflect_update(state, self.reflector.reflect(dict(state)))
+
+    async def _areflect(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """异步反思节点，反思器只有同步接口，在线程中执行"""
+        if not state.get("needs_reflection", True) or not state.get("answer"):
+            return {}
+        return self._reflect_update(
+            state, await asyncio.to_thread(self.reflector.reflect,
+                                           dict(state)))
@@ -25,11 +25,14 @@ def main():
     try:
         #llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
         llm = local_llm_get()
+        # 路由只需要返回领域名称，使用temperature=0的模型，相同问题命中响应缓存
+        router_llm = local_llm_get(temperature=0)
         print("成功初始化ChatOpenAI")
     except Exception as e:
         print(f"警告：无法初始化ChatOpenAI: {e}")
         print("将使用None作为LLM，这可能会影响RAG功能")
         llm = None
+        router_llm = None
 
     # 初始化RAG管理器，配置文件路径会自动从rag目录下读取
     config_path = os.path.join(os.path.dirname(__file__), "..", "rag",
@@ -45,7 +48,7 @@ def main():
     # 从配置文件加载所有领域
     print("正在从配置文件加载所有领域...")
     rag_manager.load_all_domains_from_config()
-    rag_reoute = HybridRAGRouter(rag_manager, llm)
+    rag_reoute = HybridRAGRouter(rag_manager, router_llm)
 
     # 检查加载的领域
     domains = rag_manager.list_domains()
@@ -0,0 +1,271 @@
+"""
+问答结果缓存
+精确层以 (领域, 过滤条件, 规范化问题) 为键；语义层在同一领域的历史问题向量中
+查找余弦相似度超过阈值的近似问题。两层共用TTL和LRU淘汰
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+# 问题末尾不影响语义的标点
+_TRAILING_PUNCTUATION = "?？!！.。~～ "
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题：去掉首尾空白和末尾标点，合并空白，英文转小写"""
+    question = _WHITESPACE.sub(" ", question.strip().lower())
+    return question.rstrip(_TRAILING_PUNCTUATION)
+
+
+def _scope_key(domain: str, filter: Optional[Any], mode: Optional[str]) -> str:
+    """缓存作用域：领域、过滤条件和检索模式都相同的问题才能共用答案"""
+    filter_key = json.dumps(filter, sort_keys=True, ensure_ascii=False,
+                            default=str) if filter is not None else ""
+    return f"{domain}|{mode or ''}|{filter_key}"
+
+
+class _CacheEntry:
+    """缓存条目"""
+
+    __slots__ = ("scope", "question", "result", "vector", "created_at")
+
+    def __init__(self, scope: str, question: str, result: Dict[str, Any],
+                 vector: Optional[np.ndarray]):
+        self.scope = scope
+        self.question = question
+        self.result = result
+        self.vector = vector
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """
+    问答结果缓存
+
+    语义层的问题向量按作用域分组，查找时做一次矩阵向量乘法；
+    嵌入模型为None时只启用精确层
+    """
+
+    def __init__(self,
+                 embeddings: Optional[Embeddings] = None,
+                 max_entries: int = 1024,
+                 ttl_seconds: float = 3600.0,
+                 semantic_threshold: float = 0.95):
+        """
+        初始化问答结果缓存
+
+        Args:
+            embeddings: 问题嵌入模型，用于语义层
+            max_entries: 最多缓存的条目数，超过时淘汰最久未使用的条目
+            ttl_seconds: 条目有效期（秒），不大于0时不过期
+            semantic_threshold: 语义层命中所需的最小余弦相似度
+        """
+        self.embeddings = embeddings
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+
+        self._entries: "OrderedDict[Tuple[str, str], _CacheEntry]" = OrderedDict()
+        # 作用域 -> (条目键列表, 归一化问题向量矩阵)，条目变化时置为None重建
+        self._semantic_index: Dict[str, Optional[Tuple[List[Tuple[str, str]],
+                                                       np.ndarray]]] = {}
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _expired(self, entry: _CacheEntry) -> bool:
+        return (self.ttl_seconds > 0
+                and time.monotonic() - entry.created_at > self.ttl_seconds)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._semantic_index[entry.scope] = None
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        vector = np.asarray(self.embeddings.embed_query(question),
+                            dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _scope_matrix(
+            self, scope: str
+    ) -> Optional[Tuple[List[Tuple[str, str]], np.ndarray]]:
+        """获取作用域内问题向量组成的矩阵，按需重建"""
+        index = self._semantic_index.get(scope)
+        if index is None:
+            keys = [
+                key for key, entry in self._entries.items()
+                if entry.scope == scope and entry.vector is not None
+            ]
+            if not keys:
+                return None
+            index = (keys, np.stack([self._entries[key].vector
+                                     for key in keys]))
+            self._semantic_index[scope] = index
+        return index
+
+    def _purge_expired(
+            self, scope: str
+    ) -> Optional[Tuple[List[Tuple[str, str]], np.ndarray]]:
+        """删除作用域内已过期的条目，返回只含有效条目的向量矩阵"""
+        index = self._scope_matrix(scope)
+        if index is None or self.ttl_seconds <= 0:
+            return index
+        expired = [key for key in index[0]
+                   if self._expired(self._entries[key])]
+        if not expired:
+            return index
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return self._scope_matrix(scope)
+
+    def lookup(self,
+               question: str,
+               domain: str,
+               filter: Optional[Any] = None,
+               mode: Optional[str] = None
+               ) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """
+        查找缓存的答案
+
+        Args:
+            question: 问题
+            domain: 领域ID
+            filter: 过滤条件
+            mode: 检索模式
+
+        Returns:
+            (缓存的查询结果, 问题向量)，未命中时结果为None；
+            问题向量可以传给put，避免重复嵌入
+        """
+        scope = _scope_key(domain, filter, mode)
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry):
+                    self._remove(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry.result, entry.vector
+
+        vector = self._embed(key[1])
+        if vector is not None:
+            with self._lock:
+                index = self._purge_expired(scope)
+                if index is not None:
+                    keys, matrix = index
+                    scores = matrix @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.semantic_threshold:
+                        self._entries.move_to_end(keys[best])
+                        self.semantic_hits += 1
+                        return self._entries[keys[best]].result, vector
+
+        with self._lock:
+            self.misses += 1
+        return None, vector
+
+    def put(self,
+            question: str,
+            domain: str,
+            result: Dict[str, Any],
+            filter: Optional[Any] = None,
+            mode: Optional[str] = None,
+            vector: Optional[np.ndarray] = None) -> None:
+        """
+        缓存查询结果
+
+        Args:
+            question: 问题
+            domain: 领域ID
+            result: 查询结果
+            filter: 过滤条件
+            mode: 检索模式
+            vector: lookup返回的问题向量
+        """
+        scope = _scope_key(domain, filter, mode)
+        normalized = normalize_question(question)
+        if vector is None:
+            vector = self._embed(normalized)
+        key = (scope, normalized)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _CacheEntry(scope, normalized, result, vector)
+            self._semantic_index[scope] = None
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_domain(self, domain: str) -> int:
+        """
+        删除领域的所有缓存条目，领域重新建立索引后调用
+
+        Args:
+            domain: 领域ID
+
+        Returns:
+            删除的条目数
+        """
+        prefix = f"{domain}|"
+        with self._lock:
+            keys = [key for key in self._entries if key[0].startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        if keys:
+            logger.info(f"领域 {domain} 已重新索引，清除 {len(keys)} 条问答缓存")
+        return len(keys)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._semantic_index.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            命中、未命中、淘汰次数和命中率
+        """
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "size": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
@@ -1,13 +1,19 @@
 """答案验证器 - 用于验证RAG系统生成的答案与用户问题的相关性"""
 
+import asyncio
+import logging
 from typing import Dict, Any, List, Tuple, Optional
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import Runnable
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from numpy import ndarray
+
+from .tfidf_model import TfidfModel
+from multi_agent_framework.core.tracing import tracer, callbacks_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 
 class AnswerValidator:
@@ -15,21 +21,57 @@ class AnswerValidator:
     答案验证器 - 评估答案与问题的相关性
     """
 
-    def __init__(self, llm=None):
+    def __init__(self,
+                 llm=None,
+                 rag_manager=None,
+                 semantic_mode: Optional[str] = None,
+                 uncertain_band: Optional[Tuple[float, float]] = None,
+                 embedding_calibration: Optional[Tuple[float, float]] = None):
         """
         初始化答案验证器
         
         Args:
             llm: 用于语义相关性评估的语言模型（可选）
+            rag_manager: RAG管理器（可选），提供各领域拟合好的TF-IDF模型和
+                嵌入模型；未提供或未指定领域时使用无IDF的哈希词频向量
+            semantic_mode: 语义评估方式，"llm"每次都调用LLM；"embedding"先用校准后的
+                嵌入相似度评估，只在分数落入uncertain_band时调用LLM，需要同时提供
+                embedding_calibration，否则仍按"llm"评估。默认读取配置中的
+                validator.semantic_mode
+            uncertain_band: 需要LLM复核的嵌入分数区间 (下限, 上限)，按校准后的分数，
+                默认读取配置中的validator.uncertain_band
+            embedding_calibration: 嵌入相似度到LLM评分的线性映射 (斜率, 截距)，
+                由calibrate_embedding拟合，默认读取配置中的validator.embedding_calibration
         """
         self.llm = llm
-        self.tfidf_vectorizer = TfidfVectorizer(max_features=1000,
-                                                stop_words='english')
+        self.rag_manager = rag_manager
+        self._default_tfidf_model = TfidfModel()
+
+        validator_config = (rag_manager.config.get("validator", {})
+                            if rag_manager is not None else {})
+        self.semantic_mode = semantic_mode or validator_config.get(
+            "semantic_mode", "llm")
+        self.uncertain_band = tuple(
+            uncertain_band or validator_config.get("uncertain_band",
+                                                   (0.35, 0.65)))
+        calibration = (embedding_calibration or
+                       validator_config.get("embedding_calibration"))
+        self.embedding_calibration = (tuple(calibration)
+                                      if calibration else None)
+        if self.semantic_mode == "embedding" and not self.embedding_calibration:
+            # 未校准的余弦相似度与LLM评分不在同一尺度上，不能直接作为语义分数
+            logger.warning("validator.semantic_mode为embedding但未配置"
+                           "embedding_calibration，改用LLM评估")
+            self.semantic_mode = "llm"
+
+        # 统计信息: 只用嵌入完成评估、升级到LLM评估的次数
+        self.stats = {"embedding_only": 0, "llm_escalations": 0}
 
     def validate_answer(self,
                         question: str,
                         answer: str,
-                        sources: Optional[List[Any]] = None) -> Dict[str, Any]:
+                        sources: Optional[List[Any]] = None,
+                        domain: Optional[str] = None) -> Dict[str, Any]:
         """
         验证答案与问题的相关性
         
@@ -37,25 +79,311 @@ class AnswerValidator:
             question: 用户问题
             answer: RAG系统生成的答案
             sources: 检索到的源文档（可选）
+            domain: 答案所属领域（可选），用于选择TF-IDF模型
             
         Returns:
             包含相关性评估结果的字典
         """
-        # 1. 基于TF-IDF的相似度计算
-        tfidf_similarity = self._calculate_tfidf_similarity(question, answer)
+        with tracer.span("validator.validate", domain=domain) as span:
+            # 1. 基于TF-IDF的相似度计算，3. 基于源文档的验证（如果有源文档）
+            tfidf_similarities, source_validations = self._lexical_scores(
+                [question], [answer], [sources], domain)
+
+            # 2. 基于语义的评估：先用嵌入相似度，不确定时再调用LLM
+            semantic_evaluation = self._embedding_relevance([question],
+                                                            [answer],
+                                                            [sources])[0]
+            escalated = self._needs_llm_judge(semantic_evaluation)
+            span.set_attribute("escalated", escalated)
+            if escalated:
+                semantic_evaluation = self._merge_llm_evaluation(
+                    semantic_evaluation,
+                    self._evaluate_semantic_relevance(question, answer))
+
+            return self._build_result(question, answer, tfidf_similarities[0],
+                                      semantic_evaluation,
+                                      source_validations[0])
+
+    async def avalidate_answer(self,
+                               question: str,
+                               answer: str,
+                               sources: Optional[List[Any]] = None,
+                               domain: Optional[str] = None
+                               ) -> Dict[str, Any]:
+        """
+        异步验证答案与问题的相关性，参数和返回值同validate_answer
+        
+        嵌入计算在线程中执行；semantic_mode为"llm"时LLM评估与TF-IDF计算并发
+        """
+        with tracer.span("validator.validate", domain=domain) as span:
+            semantic_task = None
+            if self.llm and self.semantic_mode == "llm":
+                semantic_task = asyncio.ensure_future(
+                    self._aevaluate_semantic_relevance(question, answer))
 
-        # 2. 基于语义的评估（如果有LLM）
-        semantic_evaluation = None
-        if self.llm:
-            semantic_evaluation = self._evaluate_semantic_relevance(
-                question, answer)
+            tfidf_similarities, source_validations = self._lexical_scores(
+                [question], [answer], [sources], domain)
+
+            if semantic_task:
+                span.set_attribute("escalated", True)
+                semantic_evaluation = self._merge_llm_evaluation(
+                    None, await semantic_task)
+            else:
+                semantic_evaluation = (await asyncio.to_thread(
+                    self._embedding_relevance, [question], [answer],
+                    [sources]))[0]
+                escalated = self._needs_llm_judge(semantic_evaluation)
+                span.set_attribute("escalated", escalated)
+                if escalated:
+                    semantic_evaluation = self._merge_llm_evaluation(
+                        semantic_evaluation, await
+                        self._aevaluate_semantic_relevance(question, answer))
 
-        # 3. 基于源文档的验证（如果有源文档）
-        source_based_validation = None
-        if sources:
-            source_based_validation = self._validate_against_sources(
-                question, answer, sources)
+            return self._build_result(question, answer, tfidf_similarities[0],
+                                      semantic_evaluation,
+                                      source_validations[0])
 
+    def validate_batch(self,
+                       questions: List[str],
+                       answers: List[str],
+                       sources_list: Optional[List[Optional[List[Any]]]] = None,
+                       domain: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        批量验证答案，用于离线评估
+        
+        所有问题、答案和源文档一次transform，相似度为一次稀疏矩阵逐行点积；
+        嵌入评估不确定的答案通过llm.batch批量调用LLM评估
+        
+        Args:
+            questions: 用户问题
+            answers: 与questions一一对应的答案
+            sources_list: 与questions一一对应的源文档列表（可选）
+            domain: 答案所属领域（可选），用于选择TF-IDF模型
+            
+        Returns:
+            与questions一一对应的验证结果，格式同validate_answer
+        """
+        if not questions:
+            return []
+        sources_list = sources_list or [None] * len(questions)
+        with tracer.span("validator.validate_batch",
+                         domain=domain,
+                         batch_size=len(questions)) as span:
+            tfidf_similarities, source_validations = self._lexical_scores(
+                questions, answers, sources_list, domain)
+
+            semantic_evaluations = self._embedding_relevance(
+                questions, answers, sources_list)
+            uncertain = [
+                i for i, evaluation in enumerate(semantic_evaluations)
+                if self._needs_llm_judge(evaluation)
+            ]
+            span.set_attribute("escalated", len(uncertain))
+            if uncertain:
+                llm_evaluations = self._evaluate_semantic_relevance_batch(
+                    [questions[i] for i in uncertain],
+                    [answers[i] for i in uncertain])
+                for i, llm_evaluation in zip(uncertain, llm_evaluations):
+                    semantic_evaluations[i] = self._merge_llm_evaluation(
+                        semantic_evaluations[i], llm_evaluation)
+
+            return [
+                self._build_result(question, answer, tfidf_similarity,
+                                   semantic_evaluation, source_validation)
+                for question, answer, tfidf_similarity, semantic_evaluation,
+                source_validation in zip(questions, answers, tfidf_similarities,
+                                         semantic_evaluations, source_validations)
+            ]
+
+    def _embedding_relevance(
+            self, questions: List[str], answers: List[str],
+            sources_list: List[Optional[List[Any]]]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        用嵌入模型评估问题-答案和答案-源文档的语义相关性
+        
+        问题向量来自嵌入模型的查询缓存（检索时已计算），源文档片段向量来自
+        嵌入缓存（入库时已计算），通常只有答案需要调用一次模型
+        
+        Args:
+            questions: 用户问题
+            answers: 生成的答案
+            sources_list: 各答案的源文档
+            
+        Returns:
+            各答案的语义评估结果，semantic_mode不是"embedding"或没有嵌入模型时为None
+        """
+        if self.semantic_mode != "embedding":
+            return [None] * len(questions)
+        return self._embedding_scores(questions, answers, sources_list,
+                                      self.embedding_calibration)
+
+    def _embedding_scores(
+            self, questions: List[str], answers: List[str],
+            sources_list: List[Optional[List[Any]]],
+            calibration: Optional[Tuple[float, float]]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        计算嵌入相似度，按calibration映射为0-1的语义分数
+
+        Args:
+            questions: 用户问题
+            answers: 生成的答案
+            sources_list: 各答案的源文档
+            calibration: (斜率, 截距)，为None时使用原始相似度
+
+        Returns:
+            各答案的语义评估结果，没有嵌入模型或计算出错时为None
+        """
+        embeddings = getattr(self.rag_manager, "embeddings", None)
+        if embeddings is None:
+            return [None] * len(questions)
+
+        try:
+            n = len(questions)
+            if n == 1:
+                # 单条验证走查询缓存，问题向量直接复用检索时的结果
+                vectors = [
+                    embeddings.embed_query(questions[0]),
+                    embeddings.embed_query(answers[0])
+                ]
+            else:
+                vectors = embeddings.embed_documents(
+                    list(questions) + list(answers))
+            vectors = self._normalize(vectors)
+            question_vectors, answer_vectors = vectors[:n], vectors[n:]
+            question_answer = np.einsum('ij,ij->i', question_vectors,
+                                        answer_vectors)
+
+            source_texts = []
+            owners = []
+            for i, sources in enumerate(sources_list):
+                for doc in (sources or [])[:3]:
+                    source_texts.append(doc.page_content if hasattr(
+                        doc, 'page_content') else str(doc))
+                    owners.append(i)
+            owners = np.asarray(owners, dtype=np.int64)
+            answer_source = np.full(n, np.nan)
+            if len(owners):
+                source_vectors = self._normalize(
+                    embeddings.embed_documents(source_texts))
+                similarities = np.einsum('ij,ij->i', answer_vectors[owners],
+                                         source_vectors)
+                counts = np.bincount(owners, minlength=n)
+                sums = np.bincount(owners, weights=similarities, minlength=n)
+                has_sources = counts > 0
+                answer_source[has_sources] = (sums[has_sources] /
+                                              counts[has_sources])
+        except Exception as e:
+            print(f"嵌入相关性评估出错: {e}")
+            return [None] * len(questions)
+
+        slope, intercept = calibration or (1.0, 0.0)
+        evaluations = []
+        for qa, a_s in zip(question_answer.tolist(), answer_source.tolist()):
+            has_sources = not np.isnan(a_s)
+            raw_score = (qa + a_s) / 2 if has_sources else qa
+            evaluations.append({
+                "score": max(0.0, min(1.0, slope * raw_score + intercept)),
+                "raw_score": raw_score,
+                "reasoning": f"嵌入相似度: 问题-答案 {qa:.3f}" +
+                (f"，答案-源文档 {a_s:.3f}" if has_sources else ""),
+                "method": "embedding",
+                "question_answer_similarity": qa,
+                "answer_source_similarity": a_s if has_sources else None
+            })
+        return evaluations
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _needs_llm_judge(self, evaluation: Optional[Dict[str, Any]]) -> bool:
+        """没有嵌入评估结果，或嵌入分数落在不确定区间时需要LLM评估"""
+        if evaluation is None:
+            return bool(self.llm)
+        low, high = self.uncertain_band
+        if self.llm and low <= evaluation["score"] <= high:
+            self.stats["llm_escalations"] += 1
+            return True
+        self.stats["embedding_only"] += 1
+        return False
+
+    def calibrate_embedding(
+            self,
+            questions: List[str],
+            answers: List[str],
+            sources_list: Optional[List[Optional[List[Any]]]] = None
+    ) -> Dict[str, Any]:
+        """
+        用LLM评分校准嵌入相似度
+
+        对样本同时计算原始嵌入相似度和LLM评分，最小二乘拟合线性映射。
+        样本应来自真实问答日志并覆盖相关和不相关的答案，使用与线上相同的嵌入模型；
+        把返回的embedding_calibration写入配置validator.embedding_calibration
+        并设置semantic_mode为embedding后生效
+
+        Args:
+            questions: 样本问题
+            answers: 与questions一一对应的答案
+            sources_list: 与questions一一对应的源文档列表（可选）
+
+        Returns:
+            embedding_calibration (斜率, 截距)、有效样本数、平均绝对误差，
+            以及校准后分数落入uncertain_band的样本比例（即需要调用LLM的比例）
+
+        Raises:
+            ValueError: 没有LLM或嵌入模型，或有效样本少于2个
+        """
+        if not self.llm or getattr(self.rag_manager, "embeddings",
+                                   None) is None:
+            raise ValueError("校准嵌入相似度需要LLM和嵌入模型")
+        sources_list = sources_list or [None] * len(questions)
+        embedding_evaluations = self._embedding_scores(questions, answers,
+                                                       sources_list, None)
+        llm_evaluations = self._evaluate_semantic_relevance_batch(
+            questions, answers)
+        pairs = [(embedding["raw_score"], judged["score"])
+                 for embedding, judged in zip(embedding_evaluations,
+                                              llm_evaluations)
+                 if embedding is not None and judged["reasoning"] != "评估失败"]
+        if len(pairs) < 2:
+            raise ValueError("有效样本不足，无法校准")
+        raw, judged = np.asarray(pairs, dtype=np.float64).T
+        if np.ptp(raw) == 0:
+            raise ValueError("样本的嵌入相似度没有差异，无法校准")
+        slope, intercept = np.polyfit(raw, judged, 1)
+        calibrated = np.clip(slope * raw + intercept, 0.0, 1.0)
+        low, high = self.uncertain_band
+        return {
+            "embedding_calibration": [float(slope), float(intercept)],
+            "samples": len(pairs),
+            "mean_abs_error": float(np.mean(np.abs(calibrated - judged))),
+            "uncertain_ratio": float(np.mean((calibrated >= low) &
+                                             (calibrated <= high)))
+        }
+
+    @staticmethod
+    def _merge_llm_evaluation(embedding_evaluation: Optional[Dict[str, Any]],
+                              llm_evaluation: Dict[str, Any]
+                              ) -> Dict[str, Any]:
+        """以LLM评分为准，保留嵌入相似度供参考"""
+        merged = dict(embedding_evaluation or {})
+        merged.update(llm_evaluation)
+        merged["method"] = "llm"
+        if embedding_evaluation is not None:
+            merged["embedding_score"] = embedding_evaluation["score"]
+        return merged
+
+    def _build_result(self, question: str, answer: str,
+                      tfidf_similarity: float,
+                      semantic_evaluation: Optional[Dict[str, Any]],
+                      source_based_validation: Optional[Dict[str, Any]]
+                      ) -> Dict[str, Any]:
+        """汇总各项评估结果并计算综合评分"""
         # 综合评分
         overall_score = self._calculate_overall_score(tfidf_similarity,
                                                       semantic_evaluation,
@@ -71,31 +399,75 @@ class AnswerValidator:
             "is_relevant": overall_score > 0.5  # 阈值可调整
         }
 
-    def _calculate_tfidf_similarity(self, question: str, answer: str) -> float:
+    def _tfidf_model(self, domain: Optional[str]) -> TfidfModel:
+        """获取领域的TF-IDF模型，不可用时使用默认模型"""
+        if self.rag_manager is not None and domain is not None:
+            try:
+                return self.rag_manager.get_tfidf_model(domain)
+            except Exception as e:
+                print(f"获取领域 {domain} 的TF-IDF模型出错: {e}")
+        return self._default_tfidf_model
+
+    def _lexical_scores(
+        self, questions: List[str], answers: List[str],
+        sources_list: List[Optional[List[Any]]], domain: Optional[str]
+    ) -> Tuple[List[float], List[Optional[Dict[str, Any]]]]:
         """
-        计算问题和答案之间的TF-IDF相似度
+        计算问题-答案的TF-IDF相似度和答案-源文档的支持度
         
         Args:
-            question: 用户问题
-            answer: 生成的答案
+            questions: 用户问题
+            answers: 生成的答案
+            sources_list: 各答案的源文档，没有源文档时为None或空列表
+            domain: 答案所属领域
             
         Returns:
-            相似度分数 (0-1)
+            (TF-IDF相似度列表 (0-1), 源文档验证结果列表)
         """
-        try:
-            # 计算TF-IDF向量
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform(
-                [question, answer])
+        n = len(questions)
+        source_texts = []
+        owners = []
+        for i, sources in enumerate(sources_list):
+            # 只考虑前3个源文档
+            for doc in (sources or [])[:3]:
+                source_texts.append(doc.page_content if hasattr(
+                    doc, 'page_content') else str(doc))
+                owners.append(i)
+        owners = np.asarray(owners, dtype=np.int64)
+        source_counts = np.bincount(owners, minlength=n)
 
-            # 计算余弦相似度
-            similarity_matrix: ndarray = cosine_similarity(
-                tfidf_matrix[0], tfidf_matrix[1])
-            similarity = similarity_matrix[0][0]
-
-            return float(similarity)
+        try:
+            # 向量已L2归一化，逐行点积即余弦相似度
+            matrix = self._tfidf_model(domain).transform(
+                list(questions) + list(answers) + source_texts)
+            answer_matrix = matrix[n:2 * n]
+            similarities = np.asarray(matrix[:n].multiply(
+                answer_matrix).sum(axis=1)).ravel()
+            source_similarities = np.asarray(answer_matrix[owners].multiply(
+                matrix[2 * n:]).sum(axis=1)).ravel()
+            source_sums = np.bincount(owners,
+                                      weights=source_similarities,
+                                      minlength=n)
         except Exception as e:
             print(f"TF-IDF相似度计算出错: {e}")
-            return 0.0
+            similarities = np.zeros(n)
+            source_sums = np.zeros(n)
+
+        source_validations = []
+        for i, sources in enumerate(sources_list):
+            if not sources:
+                source_validations.append(None)
+                continue
+            # 平均相似度
+            avg_similarity = (float(source_sums[i] / source_counts[i])
+                              if source_counts[i] else 0.0)
+            source_validations.append({
+                "supported_by_sources": avg_similarity > 0.1,  # 阈值可调整
+                "average_similarity_to_sources": avg_similarity,
+                "number_of_sources": len(sources)
+            })
+        return [float(similarity) for similarity in similarities
+                ], source_validations
 
     def _evaluate_semantic_relevance(self, question: str,
                                      answer: str) -> Dict[str, Any]:
@@ -116,8 +488,61 @@ class AnswerValidator:
             }
 
         try:
-            # 构建提示模板
-            prompt_template = PromptTemplate.from_template("""
+            response = self.llm.invoke(
+                [HumanMessage(content=self._semantic_prompt(question, answer))],
+                config=callbacks_config())
+            return self._parse_semantic_response(response)
+        except Exception as e:
+            print(f"语义相关性评估出错: {e}")
+            return {
+                "score": 0.5,  # 默认中等分数
+                "reasoning": "评估失败"
+            }
+
+    async def _aevaluate_semantic_relevance(self, question: str,
+                                            answer: str) -> Dict[str, Any]:
+        """使用LLM的异步接口评估语义相关性，返回值同_evaluate_semantic_relevance"""
+        try:
+            response = await self.llm.ainvoke(
+                [HumanMessage(content=self._semantic_prompt(question, answer))],
+                config=callbacks_config())
+            return self._parse_semantic_response(response)
+        except Exception as e:
+            print(f"语义相关性评估出错: {e}")
+            return {
+                "score": 0.5,  # 默认中等分数
+                "reasoning": "评估失败"
+            }
+
+    def _evaluate_semantic_relevance_batch(
+            self, questions: List[str],
+            answers: List[str]) -> List[Dict[str, Any]]:
+        """使用llm.batch批量评估语义相关性，单个失败时返回默认中等分数"""
+        try:
+            responses = self.llm.batch(
+                [[HumanMessage(content=self._semantic_prompt(question, answer))]
+                 for question, answer in zip(questions, answers)],
+                config=callbacks_config(),
+                return_exceptions=True)
+        except Exception as e:
+            print(f"语义相关性评估出错: {e}")
+            responses = [e] * len(questions)
+
+        evaluations = []
+        for response in responses:
+            if isinstance(response, Exception):
+                evaluations.append({
+                    "score": 0.5,  # 默认中等分数
+                    "reasoning": "评估失败"
+                })
+            else:
+                evaluations.append(self._parse_semantic_response(response))
+        return evaluations
+
+    def _semantic_prompt(self, question: str, answer: str) -> str:
+        """构建语义相关性评估的提示词"""
+        # 构建提示模板
+        prompt_template = PromptTemplate.from_template("""
             请评估以下问题和答案之间的相关性，并给出1-10分的评分：
             
             问题: {question}
@@ -132,82 +557,26 @@ class AnswerValidator:
             评分: [分数]
             理由: [简要说明评分原因]
             """)
+        return prompt_template.format(question=question, answer=answer)
 
-            # 调用LLM进行评估
-            prompt = prompt_template.format(question=question, answer=answer)
-            response = self.llm.invoke([HumanMessage(content=prompt)])
+    def _parse_semantic_response(self, response: Any) -> Dict[str, Any]:
+        """解析LLM的评分回复"""
+        response_text = response.content if hasattr(
+            response, 'content') else str(response)
 
-            # 解析响应
-            response_text = response.content if hasattr(
-                response, 'content') else str(response)
+        # 简单解析评分（实际应用中可以更复杂）
+        score = 5  # 默认评分
+        if "评分:" in response_text:
+            try:
+                score_part = response_text.split("评分:")[1].split()[0]
+                score = int(score_part)
+            except:
+                pass
 
-            # 简单解析评分（实际应用中可以更复杂）
-            score = 5  # 默认评分
-            if "评分:" in response_text:
-                try:
-                    score_part = response_text.split("评分:")[1].split()[0]
-                    score = int(score_part)
-                except:
-                    pass
-
-            return {
-                "score": score / 10.0,  # 转换为0-1范围
-                "reasoning": response_text
-            }
-        except Exception as e:
-            print(f"语义相关性评估出错: {e}")
-            return {
-                "score": 0.5,  # 默认中等分数
-                "reasoning": "评估失败"
-            }
-
-    def _validate_against_sources(self, question: str, answer: str,
-                                  sources: List[Any]) -> Dict[str, Any]:
-        """
-        基于源文档验证答案的相关性和支持度
-        
-        Args:
-            question: 用户问题
-            answer: 生成的答案
-            sources: 检索到的源文档
-            
-        Returns:
-            源文档验证结果
-        """
-        try:
-            # 提取源文档内容
-            source_contents = [
-                doc.page_content if hasattr(doc, 'page_content') else str(doc)
-                for doc in sources[:3]
-            ]  # 只考虑前3个源文档
-
-            # 计算答案与源文档的相似度
-            all_contents = [answer] + source_contents
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform(all_contents)
-
-            # 计算答案与每个源文档的相似度
-            similarities = []
-            for i in range(1, len(all_contents)):
-                similarity_matrix: ndarray = cosine_similarity(
-                    tfidf_matrix[0], tfidf_matrix[i])
-                similarity = similarity_matrix[0][0]
-                similarities.append(float(similarity))
-
-            # 平均相似度
-            avg_similarity = np.mean(similarities) if similarities else 0.0
-
-            return {
-                "supported_by_sources": avg_similarity > 0.1,  # 阈值可调整
-                "average_similarity_to_sources": avg_similarity,
-                "number_of_sources": len(sources)
-            }
-        except Exception as e:
-            print(f"源文档验证出错: {e}")
-            return {
-                "supported_by_sources": False,
-                "average_similarity_to_sources": 0.0,
-                "number_of_sources": len(sources)
-            }
+        return {
+            "score": score / 10.0,  # 转换为0-1范围
+            "reasoning": response_text
+        }
 
     def _calculate_overall_score(
             self, tfidf_score: float, semantic_eval: Optional[Dict[str, Any]],
@@ -243,14 +612,15 @@ class AnswerValidator:
         return max(0.0, min(1.0, score))
 
 
-def create_answer_validator(llm=None) -> AnswerValidator:
+def create_answer_validator(llm=None, rag_manager=None) -> AnswerValidator:
     """
     创建答案验证器实例的工厂函数
     
     Args:
         llm: 用于语义相关性评估的语言模型（可选）
+        rag_manager: 提供领域TF-IDF模型的RAG管理器（可选）
         
     Returns:
         AnswerValidator实例
     """
-    return AnswerValidator(llm)
+    return AnswerValidator(llm, rag_manager)
@@ -0,0 +1,491 @@
+"""
+RAG离线评估与延迟基准
+在领域语料上依次运行入库、路由、检索、生成（桩LLM）和答案验证，
+输出检索质量、各阶段延迟分位数、吞吐和内存峰值，结果保存为JSON以便与基线对比
+
+问题文件为JSONL，每行一个问题:
+    {"question": "...", "domain": "dns_professor",
+     "gold_chunks": ["片段ID"], "gold_sources": ["rfc1035.txt"],
+     "gold_answers": ["答案中应出现的文本"]}
+domain可选，用于统计路由准确率；gold_chunks、gold_sources、gold_answers至少提供一项。
+片段ID命中gold_chunks即视为相关；否则片段需同时满足已提供的其余条件：来源文件名
+在gold_sources中，且文本包含任一gold_answers。标准答案按整词匹配（前后不能紧邻
+英文字母或数字），空白不敏感，含大写字母时区分大小写，应使用能定位到具体片段的
+较长原文，避免只写记录类型等在语料中随处可见的短词
+
+用法:
+    python -m multi_agent_framework.rag.benchmark --questions questions.jsonl \\
+        --output bench.json --baseline baseline.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from .manager import RAGManager
+from .router import SemanticRAGRouter
+from .answer_validator import AnswerValidator
+from .embedding_cache import CachedEmbeddings
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 数值越大越好的指标，其余指标（延迟、耗时、内存）越小越好
+_HIGHER_IS_BETTER = ("recall", "mrr", "accuracy", "per_sec")
+# 描述测试规模而非性能的字段，不参与基线对比
+_NOT_COMPARED = ("k", "questions", "count", "chunks")
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    读取JSONL问题文件
+
+    Args:
+        path: 问题文件路径
+
+    Returns:
+        问题列表
+    """
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                raise ValueError(f"{path} 第{line_no}行缺少question")
+            questions.append(item)
+    return questions
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """计算延迟统计（毫秒）"""
+    if not latencies:
+        return {"count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0,
+                "p99_ms": 0.0}
+    values = np.asarray(latencies, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+    return {
+        "count": len(latencies),
+        "mean_ms": float(values.mean()),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99
+    }
+
+
+def peak_rss() -> Optional[int]:
+    """获取进程的常驻内存峰值（字节），无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS为字节
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memory = psutil.Process(os.getpid()).memory_info()
+        return getattr(memory, "peak_wset", memory.rss)
+    except ImportError:
+        return None
+
+
+def _answer_pattern(answer: str) -> "re.Pattern":
+    """
+    标准答案的整词匹配模式
+
+    前后不能紧邻英文字母或数字（OPT不匹配option），空白按任意空白匹配
+    （RFC正文会在句中换行），答案含大写字母时区分大小写
+    """
+    body = r"\s+".join(re.escape(word) for word in answer.split())
+    flags = 0 if any(c.isupper() for c in answer) else re.IGNORECASE
+    return re.compile(rf"(?<![A-Za-z0-9]){body}(?![A-Za-z0-9])", flags)
+
+
+def is_relevant(document: Document, item: Dict[str, Any]) -> bool:
+    """判断检索到的片段是否为问题的相关片段，规则见模块说明"""
+    doc_id = getattr(document, "id", None) or document.metadata.get("_id")
+    if doc_id and str(doc_id) in set(map(str, item.get("gold_chunks", []))):
+        return True
+    gold_sources = item.get("gold_sources") or []
+    gold_answers = [answer for answer in item.get("gold_answers") or []
+                    if answer.strip()]
+    if not gold_sources and not gold_answers:
+        return False
+    if gold_sources:
+        source = os.path.basename(str(document.metadata.get("source", "")))
+        if source not in set(gold_sources):
+            return False
+    if gold_answers:
+        return any(_answer_pattern(answer).search(document.page_content)
+                   for answer in gold_answers)
+    return True
+
+
+def retrieval_metrics(ranked_relevance: List[List[bool]],
+                      k: int) -> Dict[str, float]:
+    """
+    计算recall@k和MRR
+
+    recall@k为前k个结果中至少有一个相关片段的问题占比（标准片段数未知时的常用口径）
+
+    Args:
+        ranked_relevance: 每个问题检索结果按排名的相关性
+        k: 截断位置
+
+    Returns:
+        {"recall_at_k": ..., "mrr": ...}
+    """
+    if not ranked_relevance:
+        return {"recall_at_k": 0.0, "mrr": 0.0}
+    hits = 0
+    reciprocal_ranks = 0.0
+    for relevance in ranked_relevance:
+        if any(relevance[:k]):
+            hits += 1
+        for rank, relevant in enumerate(relevance, start=1):
+            if relevant:
+                reciprocal_ranks += 1.0 / rank
+                break
+    return {
+        "recall_at_k": hits / len(ranked_relevance),
+        "mrr": reciprocal_ranks / len(ranked_relevance)
+    }
+
+
+class RAGBenchmark:
+    """
+    RAG基准测试
+
+    使用临时持久化目录（默认也使用临时嵌入缓存）重新入库，保证每次运行从冷启动开始，
+    生成阶段使用固定回复的桩LLM，只测量框架自身的开销；生成阶段把检索阶段的结果
+    直接交给RAG链的文档合并链，耗时不包含检索
+    """
+
+    def __init__(self,
+                 config_path: str,
+                 manager_class: type = RAGManager,
+                 manager_kwargs: Optional[Dict[str, Any]] = None,
+                 domain_paths: Optional[Dict[str, str]] = None,
+                 mode: Optional[str] = None,
+                 k: Optional[int] = None,
+                 warm_cache: bool = False,
+                 embedding_sample: int = 256):
+        """
+        初始化基准测试
+
+        Args:
+            config_path: RAG配置文件路径
+            manager_class: RAGManager或其子类
+            manager_kwargs: 传给管理器的其他参数
+            domain_paths: 覆盖配置中的领域文档路径，领域ID -> 路径
+            mode: 检索模式（dense、lexical、hybrid），为None时使用配置
+            k: 检索结果数，为None时使用配置
+            warm_cache: 是否使用配置中的嵌入缓存目录，为False时使用空的临时缓存
+            embedding_sample: 测量嵌入吞吐时使用的片段数
+        """
+        self.config_path = config_path
+        self.manager_class = manager_class
+        self.manager_kwargs = manager_kwargs or {}
+        self.domain_paths = domain_paths or {}
+        self.mode = mode
+        self.k = k
+        self.warm_cache = warm_cache
+        self.embedding_sample = embedding_sample
+
+    def _prepare_config(self, work_dir: str) -> str:
+        """生成基准测试使用的配置文件，返回其路径"""
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config["persist_directory"] = os.path.join(work_dir, "store")
+        # 问答缓存会让重复问题跳过检索和生成，基准测试中关闭
+        config.setdefault("answer_cache", {})["enabled"] = False
+        if not self.warm_cache:
+            config.setdefault("embedding_cache", {})["directory"] = \
+                os.path.join(work_dir, "embedding_cache")
+        for domain_id, path in self.domain_paths.items():
+            config.setdefault("domains", {}).setdefault(domain_id,
+                                                        {})["path"] = path
+        if self.k is not None:
+            config.setdefault("retriever", {}).setdefault(
+                "search_kwargs", {})["k"] = self.k
+
+        path = os.path.join(work_dir, "config.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        return path
+
+    def run(self, questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        运行基准测试
+
+        Args:
+            questions: load_questions读取的问题列表
+
+        Returns:
+            基准测试报告
+        """
+        work_dir = tempfile.mkdtemp(prefix="rag_benchmark_")
+        try:
+            return self._run(questions, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _run(self, questions: List[Dict[str, Any]],
+             work_dir: str) -> Dict[str, Any]:
+        config_path = self._prepare_config(work_dir)
+        stub_llm = FakeListChatModel(responses=["基准测试桩回复"])
+
+        # 1. 入库
+        start = time.perf_counter()
+        manager = self.manager_class(llm=stub_llm,
+                                     config_path=config_path,
+                                     **self.manager_kwargs)
+        manager.load_all_domains_from_config()
+        ingest_seconds = time.perf_counter() - start
+        domains = list(manager.rag_chains)
+        if not domains:
+            raise ValueError("没有成功加载任何领域")
+        chunks = sum(len(manager._get_sparse_index(d)) for d in domains)
+        k = manager.config.get("retriever", {}).get("search_kwargs",
+                                                    {}).get("k", 4)
+
+        # 2. 嵌入吞吐：直接调用底层模型，绕过嵌入缓存
+        embeddings_per_sec = self._embedding_throughput(manager, domains)
+
+        router = SemanticRAGRouter(manager)
+        validator = AnswerValidator(rag_manager=manager)
+        latencies: Dict[str, List[float]] = {
+            "routing": [],
+            "retrieval": [],
+            "generation": [],
+            "validation": []
+        }
+        if manager.reranker:
+            latencies["rerank"] = []
+        ranked_relevance = []
+        routed = 0
+        routed_correct = 0
+        for item in questions:
+            question = item["question"]
+
+            # 3. 路由
+            start = time.perf_counter()
+            routed_domain = router.route_question(question)
+            latencies["routing"].append((time.perf_counter() - start) * 1000)
+            if item.get("domain"):
+                routed += 1
+                routed_correct += routed_domain == item["domain"]
+            domain = item.get("domain") or routed_domain
+
+            # 4. 检索，启用重排时单独记录重排耗时
+            rerank_ms = manager.reranker.stats["total_ms"] \
+                if manager.reranker else 0.0
+            start = time.perf_counter()
+            documents = manager.retrieve(question, domain, mode=self.mode)
+            latencies["retrieval"].append(
+                (time.perf_counter() - start) * 1000)
+            if manager.reranker:
+                latencies["rerank"].append(manager.reranker.stats["total_ms"] -
+                                           rerank_ms)
+            if any(item.get(key) for key in ("gold_chunks", "gold_sources",
+                                             "gold_answers")):
+                ranked_relevance.append(
+                    [is_relevant(document, item) for document in documents])
+
+            # 5. 生成（桩LLM），使用检索阶段的结果，不重复检索
+            rag_chain = manager.rag_chains.get(manager._resolve_domain(domain))
+            if rag_chain is None:
+                continue
+            start = time.perf_counter()
+            answer = rag_chain.combine_docs_chain.invoke({
+                "input_documents": documents,
+                "question": question
+            })["output_text"]
+            latencies["generation"].append(
+                (time.perf_counter() - start) * 1000)
+
+            # 6. 答案验证
+            start = time.perf_counter()
+            validator.validate_answer(question, answer, documents, domain)
+            latencies["validation"].append(
+                (time.perf_counter() - start) * 1000)
+
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "manager": self.manager_class.__name__,
+            "retrieval_mode": self.mode or manager.config.get(
+                "retriever", {}).get("mode", "dense"),
+            "k": k,
+            "questions": len(questions),
+            "domains": domains,
+            "ingest": {
+                "seconds": ingest_seconds,
+                "chunks": chunks,
+                "chunks_per_sec": chunks / ingest_seconds
+                if ingest_seconds else 0.0
+            },
+            "embeddings_per_sec": embeddings_per_sec,
+            "routing_accuracy": routed_correct / routed if routed else None,
+            "retrieval": retrieval_metrics(ranked_relevance, k),
+            "latency": {
+                stage: latency_stats(values)
+                for stage, values in latencies.items()
+            },
+            "peak_rss_bytes": peak_rss()
+        }
+        logger.info(f"基准测试完成: recall@{k}="
+                    f"{report['retrieval']['recall_at_k']:.4f}，MRR="
+                    f"{report['retrieval']['mrr']:.4f}，检索 p50="
+                    f"{report['latency']['retrieval']['p50_ms']:.2f}ms")
+        return report
+
+    def _embedding_throughput(self, manager: RAGManager,
+                              domains: List[str]) -> float:
+        """用领域片段测量底层嵌入模型的吞吐（片段/秒）"""
+        texts = []
+        for domain_id in domains:
+            texts.extend(manager._get_sparse_index(domain_id).texts())
+            if len(texts) >= self.embedding_sample:
+                break
+        texts = texts[:self.embedding_sample]
+        if not texts:
+            return 0.0
+        embeddings = manager.embeddings
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings = embeddings.embeddings
+        start = time.perf_counter()
+        embeddings.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+        return len(texts) / elapsed if elapsed else 0.0
+
+
+def _flatten(report: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """将报告中的数值指标展平为 点分路径 -> 数值"""
+    metrics = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = float(value)
+    return metrics
+
+
+def compare_reports(report: Dict[str, Any],
+                    baseline: Dict[str, Any],
+                    tolerance: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    与基线报告对比
+
+    Args:
+        report: 本次报告
+        baseline: 基线报告
+        tolerance: 相对变差超过该比例的指标记为回退
+
+    Returns:
+        各指标的对比结果，包含基线值、当前值、相对变化和是否回退
+    """
+    current = _flatten(report)
+    previous = _flatten(baseline)
+    rows = []
+    for metric in sorted(set(current) & set(previous)):
+        if metric.split(".")[-1] in _NOT_COMPARED:
+            continue
+        old, new = previous[metric], current[metric]
+        change = (new - old) / abs(old) if old else 0.0
+        higher_is_better = any(name in metric for name in _HIGHER_IS_BETTER)
+        worse = -change if higher_is_better else change
+        rows.append({
+            "metric": metric,
+            "baseline": old,
+            "current": new,
+            "change": change,
+            "regression": worse > tolerance
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="RAG离线评估与延迟基准")
+    parser.add_argument("--questions", required=True, help="JSONL问题文件")
+    parser.add_argument("--config",
+                        default=os.path.join(os.path.dirname(__file__),
+                                             "config.json"),
+                        help="RAG配置文件")
+    parser.add_argument("--output", default="rag_benchmark.json",
+                        help="报告输出路径")
+    parser.add_argument("--baseline", help="用于对比的基线报告")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=0.1,
+                        help="相对变差超过该比例视为回退")
+    parser.add_argument("--manager",
+                        choices=["default", "multilingual"],
+                        default="default",
+                        help="使用RAGManager或MultilingualRAGManager（Qdrant内存模式）")
+    parser.add_argument("--domain",
+                        action="append",
+                        default=[],
+                        metavar="ID=PATH",
+                        help="覆盖领域文档路径，可重复")
+    parser.add_argument("--mode", choices=["dense", "lexical", "hybrid"])
+    parser.add_argument("--k", type=int, help="检索结果数")
+    parser.add_argument("--warm-cache",
+                        action="store_true",
+                        help="使用配置中的嵌入缓存，而不是空的临时缓存")
+    args = parser.parse_args(argv)
+
+    manager_class = RAGManager
+    manager_kwargs: Dict[str, Any] = {}
+    if args.manager == "multilingual":
+        from .multilingual_rag import MultilingualRAGManager
+        manager_class = MultilingualRAGManager
+        manager_kwargs = {"in_memory": True}
+
+    domain_paths = dict(item.split("=", 1) for item in args.domain)
+    benchmark = RAGBenchmark(args.config,
+                             manager_class=manager_class,
+                             manager_kwargs=manager_kwargs,
+                             domain_paths=domain_paths,
+                             mode=args.mode,
+                             k=args.k,
+                             warm_cache=args.warm_cache)
+    report = benchmark.run(load_questions(args.questions))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            comparison = compare_reports(report, json.load(f), args.tolerance)
+        report["comparison"] = {"baseline": args.baseline, "metrics": comparison}
+        for row in comparison:
+            flag = "回退" if row["regression"] else ""
+            print(f"{row['metric']:<40} {row['baseline']:>14.4f} "
+                  f"{row['current']:>14.4f} {row['change']:>+8.1%} {flag}")
+        regressions = [row for row in comparison if row["regression"]]
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"基准测试报告已保存到 {args.output}")
+    if regressions:
+        print(f"{len(regressions)} 项指标相对基线回退超过 {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+BM25稀疏索引
+倒排表保存在领域的持久化目录中，与向量数据库一起增量更新，检索时不需要嵌入模型
+"""
+
+import os
+import json
+import math
+import heapq
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from .text_utils import TOKENIZER_VERSION, tokenize
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BM25Index:
+    """
+    BM25倒排索引
+
+    以文件为单位增删片段，文件的哈希和片段ID与索引清单保持一致，
+    索引落后于清单时（首次启用或上次入库中断）可以据此补建
+    """
+
+    INDEX_FILE = "bm25_index.json"
+
+    def __init__(self, index_path: str, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化BM25索引
+
+        Args:
+            index_path: 索引文件路径
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        # 文件相对路径 -> {"hash": 内容哈希, "chunk_ids": 片段ID列表}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # 片段ID -> {"text": 文本, "metadata": 元数据, "length": 词数}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        # 检索词 -> {片段ID: 词频}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls,
+             persist_directory: str,
+             k1: float = 1.5,
+             b: float = 0.75) -> "BM25Index":
+        """
+        从领域持久化目录加载索引，不存在或分词规则已变化时返回空索引，由入库时补建
+
+        Args:
+            persist_directory: 领域持久化目录
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+
+        Returns:
+            BM25Index实例
+        """
+        index = cls(os.path.join(persist_directory, cls.INDEX_FILE), k1, b)
+        if os.path.exists(index.index_path):
+            with open(index.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("tokenizer_version") != TOKENIZER_VERSION:
+                logger.info(f"BM25索引 {index.index_path} 的分词规则已变化，将重建")
+                return index
+            index.files = data.get("files", {})
+            index.docs = data.get("docs", {})
+            index.postings = data.get("postings", {})
+            index.total_length = sum(doc["length"]
+                                     for doc in index.docs.values())
+        return index
+
+    @classmethod
+    def from_documents(cls,
+                       documents: List[Document],
+                       k1: float = 1.5,
+                       b: float = 0.75) -> "BM25Index":
+        """
+        用文档片段建立内存中的索引（不持久化），片段按metadata中的source分组
+
+        Args:
+            documents: 文档片段
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+
+        Returns:
+            BM25Index实例
+        """
+        index = cls("", k1, b)
+        grouped: Dict[str, List[Document]] = {}
+        for document in documents:
+            grouped.setdefault(str(document.metadata.get("source", "")),
+                               []).append(document)
+        for source, source_documents in grouped.items():
+            chunk_ids = [f"{source}:{i}" for i in range(len(source_documents))]
+            index.add_file(source, "", chunk_ids, source_documents)
+        return index
+
+    def save(self) -> None:
+        """保存索引，先写临时文件再替换"""
+        with self._lock:
+            tmp_path = self.index_path + ".tmp"
+            data = {
+                "tokenizer_version": TOKENIZER_VERSION,
+                "files": self.files,
+                "docs": self.docs,
+                "postings": self.postings
+            }
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.index_path)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def file_hash(self, file_key: str) -> Optional[str]:
+        """获取索引中记录的文件哈希，文件未入索引时返回None"""
+        entry = self.files.get(file_key)
+        return entry["hash"] if entry else None
+
+    def add_file(self, file_key: str, file_hash: str, chunk_ids: List[str],
+                 documents: List[Document]) -> None:
+        """
+        将文件的片段加入索引，文件已存在时先移除旧片段
+
+        Args:
+            file_key: 文件在领域内的相对路径
+            file_hash: 文件内容哈希
+            chunk_ids: 片段ID
+            documents: 文档片段
+        """
+        with self._lock:
+            self.remove_file(file_key)
+            for chunk_id, document in zip(chunk_ids, documents):
+                self._add_doc(chunk_id, document.page_content,
+                              document.metadata)
+            self.files[file_key] = {
+                "hash": file_hash,
+                "chunk_ids": list(chunk_ids)
+            }
+
+    def remove_file(self, file_key: str) -> None:
+        """从索引中移除文件的所有片段"""
+        with self._lock:
+            entry = self.files.pop(file_key, None)
+            if entry:
+                for chunk_id in entry["chunk_ids"]:
+                    self._remove_doc(chunk_id)
+
+    def _add_doc(self, chunk_id: str, text: str,
+                 metadata: Dict[str, Any]) -> None:
+        self._remove_doc(chunk_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        length = sum(counts.values())
+        self.docs[chunk_id] = {
+            "text": text,
+            "metadata": metadata,
+            "length": length
+        }
+        self.total_length += length
+
+    def _remove_doc(self, chunk_id: str) -> None:
+        doc = self.docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        # 重新分词找到片段所在的倒排表，避免为每个片段额外保存词表
+        for term in set(tokenize(doc["text"])):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= doc["length"]
+
+    def texts(self) -> List[str]:
+        """获取索引中所有片段的文本"""
+        with self._lock:
+            return [doc["text"] for doc in self.docs.values()]
+
+    def file_texts(self, file_key: str) -> List[str]:
+        """获取文件各片段的文本，按片段顺序排列"""
+        with self._lock:
+            entry = self.files.get(file_key)
+            if not entry:
+                return []
+            return [
+                self.docs[chunk_id]["text"] for chunk_id in entry["chunk_ids"]
+                if chunk_id in self.docs
+            ]
+
+    def search(self,
+               query: str,
+               k: int = 4,
+               filter: Optional[Dict[str, Any]] = None
+               ) -> List[Tuple[Document, float]]:
+        """
+        BM25检索
+
+        Args:
+            query: 查询文本
+            k: 返回结果数
+            filter: 元数据等值过滤条件
+
+        Returns:
+            按分数降序排列的 (文档, BM25分数) 列表
+        """
+        with self._lock:
+            n_docs = len(self.docs)
+            if n_docs == 0:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, tf in postings.items():
+                    length_norm = 1.0 - self.b + self.b * (
+                        self.docs[chunk_id]["length"] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * (
+                        tf * (self.k1 + 1.0) / (tf + self.k1 * length_norm))
+
+            if filter:
+                scores = {
+                    chunk_id: score
+                    for chunk_id, score in scores.items()
+                    if all(self.docs[chunk_id]["metadata"].get(key) == value
+                           for key, value in filter.items())
+                }
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(Document(id=chunk_id,
+                              page_content=self.docs[chunk_id]["text"],
+                              metadata=dict(self.docs[chunk_id]["metadata"])),
+                     score) for chunk_id, score in top]
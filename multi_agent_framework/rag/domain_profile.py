@@ -0,0 +1,248 @@
+"""
+领域画像
+由领域自身的文档片段聚类得到若干中心向量，随领域索引一起持久化和增量更新，
+语义路由据此做最近中心查找，不再只依赖一句领域描述
+"""
+
+import os
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from .numpy_store import normalize_rows, spherical_kmeans
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DomainProfile:
+    """
+    领域画像：领域片段向量的k个聚类中心
+
+    按文件保存各簇的向量和与片段数，中心为所有文件簇向量和的归一化结果。
+    新增文件时把片段分配给最近的中心，删除文件时减去它的贡献，都不需要
+    重新嵌入其他文件；自上次聚类以来变化的片段占比超过refit_ratio时重新聚类
+    """
+
+    PROFILE_FILE = "domain_profile.npz"
+
+    def __init__(self,
+                 profile_path: str,
+                 n_centroids: int = 8,
+                 refit_ratio: float = 0.5):
+        """
+        初始化领域画像
+
+        Args:
+            profile_path: 画像文件路径
+            n_centroids: 每个领域的聚类中心数
+            refit_ratio: 变化片段占比超过该值时重新聚类
+        """
+        self.profile_path = profile_path
+        self.n_centroids = n_centroids
+        self.refit_ratio = refit_ratio
+        # 文件相对路径 -> 内容哈希
+        self.file_hashes: Dict[str, str] = {}
+        # 文件相对路径 -> 各簇片段数 (k,) 和各簇向量和 (k, d)
+        self.file_counts: Dict[str, np.ndarray] = {}
+        self.file_sums: Dict[str, np.ndarray] = {}
+        self.centroids: Optional[np.ndarray] = None
+        # 上次聚类时的片段数，以及此后新增和删除的片段数
+        self.fitted_chunks = 0
+        self.changed_chunks = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls,
+             persist_directory: str,
+             n_centroids: int = 8,
+             refit_ratio: float = 0.5) -> "DomainProfile":
+        """
+        从领域持久化目录加载画像，不存在时返回空画像
+
+        Args:
+            persist_directory: 领域持久化目录
+            n_centroids: 每个领域的聚类中心数
+            refit_ratio: 变化片段占比超过该值时重新聚类
+
+        Returns:
+            DomainProfile实例
+        """
+        profile = cls(os.path.join(persist_directory, cls.PROFILE_FILE),
+                      n_centroids, refit_ratio)
+        if not os.path.exists(profile.profile_path):
+            return profile
+
+        with np.load(profile.profile_path) as data:
+            centroids = data["centroids"]
+            if len(centroids) != n_centroids:
+                # 中心数配置变化，放弃旧画像，下次同步时重新聚类
+                logger.info(f"领域画像 {profile.profile_path} 中心数变化，将重新聚类")
+                return profile
+            for i, file_key in enumerate(data["file_keys"].tolist()):
+                profile.file_hashes[file_key] = str(data["file_hashes"][i])
+                profile.file_counts[file_key] = data["counts"][i]
+                profile.file_sums[file_key] = data["sums"][i]
+            profile.centroids = centroids
+            profile.fitted_chunks = int(data["fitted_chunks"])
+            profile.changed_chunks = int(data["changed_chunks"])
+        return profile
+
+    def save(self) -> None:
+        """保存画像，先写临时文件再替换"""
+        with self._lock:
+            if self.centroids is None:
+                return
+            file_keys = sorted(self.file_hashes)
+            dim = self.centroids.shape[1]
+            tmp_path = self.profile_path + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                file_keys=np.array(file_keys, dtype=str),
+                file_hashes=np.array(
+                    [self.file_hashes[key] for key in file_keys], dtype=str),
+                counts=np.array([self.file_counts[key] for key in file_keys],
+                                dtype=np.int64).reshape(
+                                    len(file_keys), self.n_centroids),
+                sums=np.array([self.file_sums[key] for key in file_keys],
+                              dtype=np.float32).reshape(
+                                  len(file_keys), self.n_centroids, dim),
+                centroids=self.centroids,
+                fitted_chunks=self.fitted_chunks,
+                changed_chunks=self.changed_chunks)
+            os.replace(tmp_path, self.profile_path)
+
+    def __len__(self) -> int:
+        """画像覆盖的片段数"""
+        with self._lock:
+            return int(sum(counts.sum() for counts in self.file_counts.values()))
+
+    def file_hash(self, file_key: str) -> Optional[str]:
+        """获取画像中记录的文件哈希，文件未计入画像时返回None"""
+        return self.file_hashes.get(file_key)
+
+    def needs_refit(self, pending_chunks: int = 0) -> bool:
+        """
+        判断是否需要重新聚类
+
+        Args:
+            pending_chunks: 即将增量加入的片段数
+
+        Returns:
+            尚未聚类，或变化片段占比超过refit_ratio时为True
+        """
+        with self._lock:
+            if self.centroids is None:
+                return True
+            changed = self.changed_chunks + pending_chunks
+            return changed > self.refit_ratio * max(self.fitted_chunks, 1)
+
+    def fit(self, file_batches: Iterable[Dict[str, tuple]]) -> None:
+        """
+        对领域全部片段重新聚类
+
+        批次逐个处理、处理完即释放：第一批用球面k-means选出初始中心，之后每批把
+        片段分配给最近的中心并用累计的簇向量和更新中心（在线k-means）。
+        聚类在新画像上进行，完成后整体替换，期间路由仍使用旧中心
+
+        Args:
+            file_batches: 可迭代的批次，每批为 文件相对路径 -> (内容哈希, 片段向量矩阵)
+        """
+        fresh = DomainProfile(self.profile_path, self.n_centroids,
+                              self.refit_ratio)
+        for batch in file_batches:
+            fresh._fit_batch(batch)
+        with self._lock:
+            self.file_hashes = fresh.file_hashes
+            self.file_counts = fresh.file_counts
+            self.file_sums = fresh.file_sums
+            self.centroids = fresh.centroids
+            self.fitted_chunks = fresh.fitted_chunks
+            self.changed_chunks = 0
+        logger.info(f"领域画像 {self.profile_path} 重新聚类: "
+                    f"{self.fitted_chunks} 个片段")
+
+    def _fit_batch(self, file_vectors: Dict[str, tuple]) -> None:
+        """在线k-means的一步：分配一批文件的片段并更新中心"""
+        file_vectors = {
+            key: (file_hash, np.asarray(vectors, dtype=np.float32))
+            for key, (file_hash, vectors) in file_vectors.items()
+            if len(vectors)
+        }
+        if not file_vectors:
+            return
+        if self.centroids is None:
+            seed = normalize_rows(
+                np.concatenate([v for _, v in file_vectors.values()]))
+            centroids = spherical_kmeans(seed, self.n_centroids)
+            # 片段数少于中心数时补零行，保持中心矩阵形状固定
+            self.centroids = np.zeros((self.n_centroids, seed.shape[1]),
+                                      dtype=np.float32)
+            self.centroids[:len(centroids)] = centroids
+        for file_key, (file_hash, vectors) in file_vectors.items():
+            self._assign(file_key, file_hash, vectors)
+            self.fitted_chunks += len(vectors)
+        self._update_centroids()
+
+    def add_file(self, file_key: str, file_hash: str, vectors) -> None:
+        """
+        将文件的片段向量分配给最近的中心，文件已存在时先移除旧贡献
+
+        Args:
+            file_key: 文件在领域内的相对路径
+            file_hash: 文件内容哈希
+            vectors: 片段向量矩阵
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.centroids is None:
+                raise ValueError("领域画像尚未聚类，请先调用fit")
+            self.remove_file(file_key)
+            if not len(vectors):
+                return
+            self._assign(file_key, file_hash, vectors)
+            self.changed_chunks += len(vectors)
+            self._update_centroids()
+
+    def remove_file(self, file_key: str) -> None:
+        """从画像中减去文件的贡献"""
+        with self._lock:
+            self.file_hashes.pop(file_key, None)
+            self.file_sums.pop(file_key, None)
+            counts = self.file_counts.pop(file_key, None)
+            if counts is not None:
+                self.changed_chunks += int(counts.sum())
+                self._update_centroids()
+
+    def centroid_matrix(self) -> np.ndarray:
+        """获取非空簇的归一化中心矩阵，画像为空时返回0行矩阵"""
+        with self._lock:
+            if self.centroids is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            counts = sum(self.file_counts.values(),
+                         np.zeros(self.n_centroids, dtype=np.int64))
+            return self.centroids[counts > 0]
+
+    def _assign(self, file_key: str, file_hash: str,
+                vectors: np.ndarray) -> None:
+        """按最近中心累加文件的片段向量"""
+        vectors = normalize_rows(vectors)
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+        sums = np.zeros_like(self.centroids)
+        np.add.at(sums, assignments, vectors)
+        self.file_hashes[file_key] = file_hash
+        self.file_counts[file_key] = np.bincount(assignments,
+                                                 minlength=self.n_centroids)
+        self.file_sums[file_key] = sums
+
+    def _update_centroids(self) -> None:
+        """由各文件的簇向量和重新计算中心，空簇保留原中心"""
+        if self.centroids is None or not self.file_sums:
+            return
+        sums: np.ndarray = sum(self.file_sums.values())
+        counts = sum(self.file_counts.values())
+        occupied = counts > 0
+        self.centroids[occupied] = normalize_rows(sums[occupied])
@@ -0,0 +1,194 @@
+"""
+动态微批处理嵌入服务
+把并发到达的embed_query/embed_documents请求在几毫秒内攒成一批，一次前向计算完成
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 队列中的请求: (文本列表, 是否为查询, 结果future)
+_Request = Tuple[List[str], bool, Future]
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    微批处理嵌入模型
+
+    调用方线程提交请求后等待各自的future，后台线程负责攒批并调用底层模型。
+    查询和文档分别成批，单个请求不会被拆开
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 queries_as_documents: bool = True):
+        """
+        初始化微批处理嵌入模型
+
+        Args:
+            embeddings: 底层嵌入模型
+            max_batch_size: 每批最多的文本数（单个请求超过时单独成批）
+            max_wait_ms: 收到第一个请求后最多等待的毫秒数
+            queries_as_documents: 查询是否可以与文档一样批量编码，
+                为True时查询批次调用底层的embed_documents，否则逐条调用embed_query
+        """
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name",
+                                  type(embeddings).__name__)
+        self.encode_kwargs = getattr(embeddings, "encode_kwargs", None) or {}
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.queries_as_documents = queries_as_documents
+
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        # 上一批放不下、需要排在下一批最前面的请求
+        self._carry: Optional[_Request] = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._closed = False
+
+        # 统计信息
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run,
+                                                name="embedding-batcher",
+                                                daemon=True)
+                self._worker.start()
+
+    def submit(self, texts: List[str], is_query: bool = False) -> Future:
+        """
+        提交嵌入请求
+
+        Args:
+            texts: 文本列表
+            is_query: 是否为查询文本
+
+        Returns:
+            结果为嵌入向量列表的future
+        """
+        if self._closed:
+            raise RuntimeError("嵌入服务已关闭")
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._ensure_worker()
+        self._queue.put((list(texts), is_query, future))
+        return future
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入文档，阻塞直到所在批次完成"""
+        return self.submit(texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本，阻塞直到所在批次完成"""
+        return self.submit([text], is_query=True).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步批量嵌入文档"""
+        return await asyncio.wrap_future(self.submit(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询文本"""
+        vectors = await asyncio.wrap_future(self.submit([text],
+                                                        is_query=True))
+        return vectors[0]
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        """从第一个请求开始攒批，直到达到批大小上限或等待超时"""
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # 关闭信号放回队列，处理完当前批次后退出
+                self._queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                # 放不下的请求留给下一批
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._carry or self._queue.get()
+            self._carry = None
+            if first is None:
+                break
+            batch = self._collect(first)
+            queries = [request for request in batch if request[1]]
+            documents = [request for request in batch if not request[1]]
+            for requests, is_query in ((queries, True), (documents, False)):
+                if requests:
+                    self._encode(requests, is_query)
+
+    def _encode(self, requests: List[_Request], is_query: bool) -> None:
+        texts = [text for request in requests for text in request[0]]
+        try:
+            if is_query and not self.queries_as_documents:
+                vectors = [self.embeddings.embed_query(text) for text in texts]
+            else:
+                vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.requests += len(requests)
+        self.texts += len(texts)
+        offset = 0
+        for request_texts, _, future in requests:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取批处理统计信息
+
+        Returns:
+            批次数、请求数、文本数和平均批大小
+        """
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "texts": self.texts,
+            "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "queue_depth": self._queue.qsize()
+        }
+
+    def close(self) -> None:
+        """停止后台线程，已提交的请求会先处理完"""
+        self._closed = True
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
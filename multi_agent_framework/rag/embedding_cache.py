@@ -0,0 +1,345 @@
+"""
+嵌入向量缓存模块
+以 (模型名称, 是否归一化, 片段文本sha256) 为键，将嵌入向量持久化到磁盘，
+重建领域索引或用相同语料建立其他集合时，未变化的片段无需再次调用模型
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from multi_agent_framework.core.tracing import tracer
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# sqlite单条语句中参数数量的安全上限
+_SQLITE_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    """计算片段文本的sha256哈希"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCacheStore:
+    """
+    嵌入向量存储
+
+    向量按行追加到内存映射的二进制文件中（float16或float32），
+    文本哈希到行号的索引保存在同目录的sqlite文件中。
+    同一目录同时只应有一个进程写入
+    """
+
+    VECTORS_FILE = "vectors.bin"
+    INDEX_FILE = "index.sqlite"
+
+    def __init__(self, directory: str, dtype: str = "float16"):
+        """
+        初始化嵌入向量存储
+
+        Args:
+            directory: 存储目录，每个 (模型, 归一化) 组合使用独立目录
+            dtype: 向量存储精度，float16或float32
+        """
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._vectors_path = os.path.join(directory, self.VECTORS_FILE)
+        self._conn = sqlite3.connect(os.path.join(directory, self.INDEX_FILE),
+                                     check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                           "(key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta "
+                           "(name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        self.dim = self._get_meta("dim")
+        stored_dtype = self._get_meta("dtype")
+        if stored_dtype is not None:
+            # 已有数据时沿用原来的存储精度
+            self.dtype = np.dtype(stored_dtype)
+        self._rows = self._conn.execute(
+            "SELECT COALESCE(MAX(row) + 1, 0) FROM entries").fetchone()[0]
+        self._truncate_orphan_rows()
+
+        self._mmap: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_meta(self, name: str) -> Optional[Any]:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?",
+                                 (name, )).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, name: str, value: Any) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+            (name, json.dumps(value)))
+
+    def _row_bytes(self) -> int:
+        return int(self.dim) * self.dtype.itemsize
+
+    def _truncate_orphan_rows(self) -> None:
+        """写入向量后、写入索引前中断时，文件末尾会残留没有索引的行，启动时截掉"""
+        if self.dim is None or not os.path.exists(self._vectors_path):
+            return
+        expected_size = self._rows * self._row_bytes()
+        if os.path.getsize(self._vectors_path) > expected_size:
+            with open(self._vectors_path, 'r+b') as f:
+                f.truncate(expected_size)
+
+    def _get_mmap(self, min_rows: int) -> np.memmap:
+        """获取覆盖至少min_rows行的只读内存映射"""
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            self._mmap = np.memmap(self._vectors_path,
+                                   dtype=self.dtype,
+                                   mode='r',
+                                   shape=(self._rows, int(self.dim)))
+        return self._mmap
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        批量读取缓存的向量
+
+        Args:
+            keys: 文本哈希列表
+
+        Returns:
+            命中的 文本哈希 -> float32向量
+        """
+        with self._lock:
+            if not keys or self._rows == 0:
+                self.misses += len(keys)
+                return {}
+
+            rows: Dict[str, int] = {}
+            for i in range(0, len(keys), _SQLITE_BATCH):
+                batch = keys[i:i + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(
+                    self._conn.execute(
+                        f"SELECT key, row FROM entries WHERE key IN ({placeholders})",
+                        batch).fetchall())
+
+            result = {}
+            if rows:
+                matrix = self._get_mmap(max(rows.values()) + 1)
+                for key, row in rows.items():
+                    result[key] = np.asarray(matrix[row], dtype=np.float32)
+            self.hits += len(result)
+            self.misses += len(keys) - len(result)
+            return result
+
+    def put_many(self, keys: List[str], vectors: np.ndarray) -> None:
+        """
+        批量写入向量，已存在的键会被跳过
+
+        Args:
+            keys: 文本哈希列表
+            vectors: 形状为 (len(keys), dim) 的向量矩阵
+        """
+        if not keys:
+            return
+        vectors = np.asarray(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._set_meta("dim", self.dim)
+                self._set_meta("dtype", self.dtype.name)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"向量维度 {vectors.shape[1]} 与缓存维度 {self.dim} 不一致")
+
+            # 去掉已存在和重复的键
+            existing = set()
+            for i in range(0, len(keys), _SQLITE_BATCH):
+                batch = keys[i:i + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                existing.update(
+                    key for (key, ) in self._conn.execute(
+                        f"SELECT key FROM entries WHERE key IN ({placeholders})",
+                        batch))
+            new_rows: List[Tuple[str, int]] = []
+            new_indices = []
+            for i, key in enumerate(keys):
+                if key in existing:
+                    continue
+                existing.add(key)
+                new_rows.append((key, self._rows + len(new_rows)))
+                new_indices.append(i)
+            if not new_rows:
+                return
+
+            # 先追加向量，再写索引
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors[new_indices].astype(self.dtype).tobytes())
+            self._conn.executemany(
+                "INSERT INTO entries (key, row) VALUES (?, ?)", new_rows)
+            self._conn.commit()
+            self._rows += len(new_rows)
+
+    def close(self) -> None:
+        """关闭存储"""
+        with self._lock:
+            self._mmap = None
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带磁盘缓存的嵌入模型包装器
+
+    embed_documents 只对缓存未命中的文本调用底层模型；
+    embed_query 使用内存LRU缓存，同一请求中路由、检索、答案缓存和答案验证
+    对同一问题的多次嵌入只调用一次模型，查询文本不写入磁盘。
+    每次调用记录一个embedding span，含文本数和缓存命中情况
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 store: EmbeddingCacheStore,
+                 query_cache_size: int = 1024):
+        """
+        初始化带缓存的嵌入模型
+
+        Args:
+            embeddings: 底层嵌入模型
+            store: 嵌入向量存储
+            query_cache_size: 查询向量LRU缓存的条数，为0时不缓存查询
+        """
+        self.embeddings = embeddings
+        self.store = store
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量嵌入文档，优先读取缓存
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            嵌入向量列表
+        """
+        with tracer.span("embedding", kind="documents",
+                         texts=len(texts)) as span:
+            keys = [text_hash(text) for text in texts]
+            cached = self.store.get_many(keys)
+
+            # 同一批内重复的文本只嵌入一次
+            missing: Dict[str, str] = {}
+            for key, text in zip(keys, texts):
+                if key not in cached and key not in missing:
+                    missing[key] = text
+            span.set_attribute("cache_hits", len(texts) - len(missing))
+            span.set_attribute("cache_misses", len(missing))
+
+            if missing:
+                missing_keys = list(missing)
+                vectors = self.embeddings.embed_documents(
+                    [missing[key] for key in missing_keys])
+                vectors = np.asarray(vectors, dtype=np.float32)
+                self.store.put_many(missing_keys, vectors)
+                cached.update(zip(missing_keys, vectors))
+
+            return [cached[key].astype(np.float32).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本，优先读取内存LRU缓存"""
+        with tracer.span("embedding", kind="query", texts=1) as span:
+            if self.query_cache_size <= 0:
+                return self.embeddings.embed_query(text)
+
+            with self._query_lock:
+                vector = self._query_cache.get(text)
+                if vector is not None:
+                    self._query_cache.move_to_end(text)
+            span.set_attribute("cache_hit", vector is not None)
+            if vector is not None:
+                return list(vector)
+
+            vector = self.embeddings.embed_query(text)
+            with self._query_lock:
+                self._query_cache[text] = vector
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+            return list(vector)
+
+
+_stores: Dict[Tuple[str, str], EmbeddingCacheStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_cache_store(cache_dir: str,
+                    model_name: str,
+                    normalize: bool,
+                    dtype: str = "float16") -> EmbeddingCacheStore:
+    """
+    获取 (模型, 归一化) 对应的嵌入向量存储，同一进程内共享同一个实例
+
+    Args:
+        cache_dir: 缓存根目录
+        model_name: 嵌入模型名称
+        normalize: 嵌入向量是否归一化
+        dtype: 向量存储精度
+
+    Returns:
+        EmbeddingCacheStore实例
+    """
+    namespace = hashlib.sha256(
+        f"{model_name}|normalize={normalize}".encode('utf-8')).hexdigest()[:16]
+    key = (os.path.abspath(cache_dir), namespace)
+    with _stores_lock:
+        if key not in _stores:
+            directory = os.path.join(cache_dir, namespace)
+            _stores[key] = EmbeddingCacheStore(directory, dtype)
+            # 记录目录对应的模型，方便人工查看
+            info_path = os.path.join(directory, "model.json")
+            if not os.path.exists(info_path):
+                info = {"model_name": model_name, "normalize": normalize}
+                with open(info_path, 'w', encoding='utf-8') as f:
+                    json.dump(info, f, ensure_ascii=False)
+            logger.info(f"嵌入缓存: {model_name} -> {directory}，已缓存 "
+                        f"{len(_stores[key])} 条")
+        return _stores[key]
+
+
+def cache_embeddings(embeddings: Embeddings,
+                     cache_dir: str = "./embedding_cache",
+                     dtype: str = "float16",
+                     query_cache_size: int = 1024) -> CachedEmbeddings:
+    """
+    为HuggingFaceEmbeddings等嵌入模型加上磁盘缓存
+
+    Args:
+        embeddings: 嵌入模型，从其model_name和encode_kwargs中读取缓存键
+        cache_dir: 缓存根目录
+        dtype: 向量存储精度，float16或float32
+        query_cache_size: 查询向量LRU缓存的条数
+
+    Returns:
+        CachedEmbeddings实例
+    """
+    model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+    encode_kwargs = getattr(embeddings, "encode_kwargs", None) or {}
+    normalize = bool(encode_kwargs.get("normalize_embeddings", False))
+    store = get_cache_store(cache_dir, model_name, normalize, dtype)
+    return CachedEmbeddings(embeddings, store, query_cache_size)
+
@@ -0,0 +1,230 @@
+"""
+嵌入模型注册表
+每个嵌入模型在进程内只加载一次，各组件获取共享的、线程安全的编码句柄
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from multi_agent_framework.core.tracing import tracer
+
+from .embedding_cache import cache_embeddings
+from .embedding_batcher import BatchingEmbeddings
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _current_rss() -> Optional[int]:
+    """获取当前进程的常驻内存（字节），无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        return None
+
+
+class _LoadedModel:
+    """已加载的模型及其统计信息"""
+
+    def __init__(self, model_name: str, model_kwargs: Dict[str, Any]):
+        rss_before = _current_rss()
+        start = time.perf_counter()
+        self.embeddings = HuggingFaceEmbeddings(model_name=model_name,
+                                                model_kwargs=model_kwargs)
+        self.load_seconds = time.perf_counter() - start
+        rss_after = _current_rss()
+
+        self.model_name = model_name
+        self.model_kwargs = model_kwargs
+        self.rss_delta_bytes = (rss_after - rss_before
+                                if rss_before is not None
+                                and rss_after is not None else None)
+        self.param_bytes = self._count_param_bytes()
+        # 同一模型的编码调用串行执行，避免多线程同时推理互相抢占CPU
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.texts = 0
+
+    def _count_param_bytes(self) -> Optional[int]:
+        client = getattr(self.embeddings, "_client", None)
+        if client is None or not hasattr(client, "parameters"):
+            return None
+        return sum(p.numel() * p.element_size() for p in client.parameters())
+
+    def encode(self, texts: List[str],
+               encode_kwargs: Dict[str, Any]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        with self.lock:
+            vectors = self.embeddings._client.encode(texts, **encode_kwargs)
+            self.calls += 1
+            self.texts += len(texts)
+        return vectors.tolist()
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    共享模型的编码句柄
+
+    多个句柄可以指向同一个已加载的模型，各自使用不同的encode_kwargs。
+    每次编码记录一个embedding.model span，只包含模型推理的耗时
+    """
+
+    def __init__(self, model: _LoadedModel, encode_kwargs: Dict[str, Any]):
+        self._model = model
+        self.model_name = model.model_name
+        self.encode_kwargs = encode_kwargs
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入文档"""
+        if not texts:
+            return []
+        with tracer.span("embedding.model", kind="documents",
+                         texts=len(texts)):
+            return self._model.encode(texts, self.encode_kwargs)
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本"""
+        with tracer.span("embedding.model", kind="query", texts=1):
+            return self._model.encode([text], self.encode_kwargs)[0]
+
+
+class EmbeddingModelRegistry:
+    """
+    嵌入模型注册表
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], _LoadedModel] = {}
+        self._batchers: Dict[Tuple[int, str, int, float],
+                             BatchingEmbeddings] = {}
+        self._lock = threading.Lock()
+
+    def get(self,
+            model_name: str,
+            model_kwargs: Optional[Dict[str, Any]] = None,
+            encode_kwargs: Optional[Dict[str, Any]] = None
+            ) -> SharedEmbeddings:
+        """
+        获取模型的共享编码句柄，模型首次使用时加载
+
+        Args:
+            model_name: 模型名称
+            model_kwargs: 传给SentenceTransformer的参数，如device、local_files_only
+            encode_kwargs: 编码参数，如normalize_embeddings
+
+        Returns:
+            SharedEmbeddings实例
+        """
+        model_kwargs = dict(model_kwargs or {})
+        key = (model_name, json.dumps(model_kwargs, sort_keys=True,
+                                      default=str))
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = _LoadedModel(model_name, model_kwargs)
+                self._models[key] = model
+                rss_mb = (f"{model.rss_delta_bytes / 2**20:.1f}MB"
+                          if model.rss_delta_bytes is not None else "未知")
+                logger.info(f"加载嵌入模型 {model_name}，耗时 "
+                            f"{model.load_seconds:.2f}s，内存增加 {rss_mb}")
+        return SharedEmbeddings(model, dict(encode_kwargs or {}))
+
+    def get_batcher(self, handle: SharedEmbeddings, max_batch_size: int,
+                    max_wait_ms: float) -> BatchingEmbeddings:
+        """
+        获取句柄对应的微批处理服务，同一模型和编码参数共用一个服务，
+        这样不同组件的并发请求才能合并到同一批
+
+        Args:
+            handle: 共享编码句柄
+            max_batch_size: 每批最多的文本数
+            max_wait_ms: 攒批最多等待的毫秒数
+
+        Returns:
+            BatchingEmbeddings实例
+        """
+        key = (id(handle._model),
+               json.dumps(handle.encode_kwargs, sort_keys=True, default=str),
+               max_batch_size, max_wait_ms)
+        with self._lock:
+            batcher = self._batchers.get(key)
+            if batcher is None:
+                batcher = BatchingEmbeddings(handle, max_batch_size,
+                                             max_wait_ms)
+                self._batchers[key] = batcher
+        return batcher
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        各模型的加载耗时、内存占用和调用次数
+
+        Returns:
+            统计信息列表
+        """
+        with self._lock:
+            return [{
+                "model_name": model.model_name,
+                "model_kwargs": model.model_kwargs,
+                "load_seconds": model.load_seconds,
+                "rss_delta_bytes": model.rss_delta_bytes,
+                "param_bytes": model.param_bytes,
+                "calls": model.calls,
+                "texts": model.texts
+            } for model in self._models.values()]
+
+    def clear(self) -> None:
+        """释放所有模型，并停止微批处理服务"""
+        with self._lock:
+            batchers = list(self._batchers.values())
+            self._batchers.clear()
+            self._models.clear()
+        for batcher in batchers:
+            batcher.close()
+
+
+# 进程内共享的注册表
+registry = EmbeddingModelRegistry()
+
+
+def get_embeddings(model_name: str,
+                   model_kwargs: Optional[Dict[str, Any]] = None,
+                   encode_kwargs: Optional[Dict[str, Any]] = None,
+                   cache_config: Optional[Dict[str, Any]] = None,
+                   batching_config: Optional[Dict[str, Any]] = None
+                   ) -> Embeddings:
+    """
+    从共享注册表获取嵌入模型，并按需加上磁盘缓存
+
+    Args:
+        model_name: 模型名称
+        model_kwargs: 传给SentenceTransformer的参数
+        encode_kwargs: 编码参数
+        cache_config: 嵌入缓存配置（格式同config.json中的embedding_cache），
+            为None或enabled为false时不使用缓存
+        batching_config: 微批处理配置（格式同config.json中的embedding_batching），
+            为None或enabled为false时直接调用模型
+
+    Returns:
+        嵌入模型
+    """
+    handle = registry.get(model_name, model_kwargs, encode_kwargs)
+    embeddings: Embeddings = handle
+    if batching_config is not None and batching_config.get("enabled", False):
+        embeddings = registry.get_batcher(
+            handle, batching_config.get("max_batch_size", 32),
+            batching_config.get("max_wait_ms", 5.0))
+    if cache_config is not None and cache_config.get("enabled", True):
+        embeddings = cache_embeddings(
+            embeddings, cache_config.get("directory", "./embedding_cache"),
+            cache_config.get("dtype", "float16"),
+            cache_config.get("query_cache_size", 1024))
+    return embeddings
@@ -0,0 +1,131 @@
+"""
+混合检索器
+BM25词法检索与向量检索的结果通过倒数排名融合（RRF）合并
+"""
+
+import asyncio
+from typing import Dict, Any, List, Optional, Sequence
+
+from langchain_core.callbacks import (AsyncCallbackManagerForRetrieverRun,
+                                      CallbackManagerForRetrieverRun)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .bm25 import BM25Index
+
+
+def _doc_key(document: Document) -> str:
+    """
+    文档去重键：来源和文本
+
+    不使用片段ID：BM25结果带有片段ID，而langchain_community的Chroma返回的文档没有id，
+    Qdrant的_id是由片段ID换算的UUID，按ID融合时同一片段在两路结果中无法合并
+    """
+    return f"{document.metadata.get('source', '')}\n{document.page_content}"
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Document]],
+                           k: int = 4,
+                           rrf_k: int = 60,
+                           weights: Optional[Sequence[float]] = None
+                           ) -> List[Document]:
+    """
+    倒数排名融合
+
+    文档的融合分数为各结果列表中 weight / (rrf_k + 排名) 之和，
+    只依赖排名，不需要对BM25分数和余弦相似度做归一化
+
+    Args:
+        result_lists: 各检索器按相关性排序的结果
+        k: 返回结果数
+        rrf_k: 平滑常数，越大排名靠后的结果权重越高
+        weights: 各结果列表的权重，默认均为1
+
+    Returns:
+        融合后的前k个文档
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, document in enumerate(results, start=1):
+            key = _doc_key(document)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            documents.setdefault(key, document)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
+
+
+class BM25Retriever(BaseRetriever):
+    """
+    BM25检索器，只查倒排表，不调用嵌入模型
+    """
+
+    index: BM25Index
+    k: int = 4
+    filter: Optional[Dict[str, Any]] = None
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [
+            document
+            for document, _ in self.index.search(query, self.k, self.filter)
+        ]
+
+    async def _aget_relevant_documents(
+            self, query: str, *,
+            run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # 倒排表查询只需微秒级，直接在事件循环中执行
+        return [
+            document
+            for document, _ in self.index.search(query, self.k, self.filter)
+        ]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    混合检索器
+
+    向量检索器和BM25检索器各取fetch_k个候选，RRF融合后返回前k个
+    """
+
+    dense_retriever: BaseRetriever
+    sparse_retriever: BM25Retriever
+    k: int = 4
+    rrf_k: int = 60
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense_results = self.dense_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()})
+        sparse_results = self.sparse_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()})
+        return reciprocal_rank_fusion([dense_results, sparse_results],
+                                      k=self.k,
+                                      rrf_k=self.rrf_k,
+                                      weights=[
+                                          self.dense_weight,
+                                          self.sparse_weight
+                                      ])
+
+    async def _aget_relevant_documents(
+            self, query: str, *,
+            run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense_results, sparse_results = await asyncio.gather(
+            self.dense_retriever.ainvoke(
+                query, config={"callbacks": run_manager.get_child()}),
+            self.sparse_retriever.ainvoke(
+                query, config={"callbacks": run_manager.get_child()}))
+        return reciprocal_rank_fusion([dense_results, sparse_results],
+                                      k=self.k,
+                                      rrf_k=self.rrf_k,
+                                      weights=[
+                                          self.dense_weight,
+                                          self.sparse_weight
+                                      ])
@@ -0,0 +1,168 @@
+"""
+索引清单模块
+记录每个领域中各文件的内容哈希和对应的片段ID，用于增量重建索引
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+from typing import Dict, Any, List, Tuple
+
+# 清单文件名，保存在领域的持久化目录中
+MANIFEST_FILE_NAME = "index_manifest.json"
+
+
+def compute_file_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    计算文件内容的sha256哈希
+
+    Args:
+        file_path: 文件路径
+        block_size: 每次读取的字节数
+
+    Returns:
+        十六进制哈希字符串
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_ids(domain_id: str, file_key: str, file_hash: str,
+                   count: int) -> List[str]:
+    """
+    为文件的各个片段生成确定性的ID
+
+    ID为UUID格式，Chroma和Qdrant都可以直接使用
+
+    Args:
+        domain_id: 领域ID
+        file_key: 文件在领域内的相对路径
+        file_hash: 文件内容哈希
+        count: 片段数量
+
+    Returns:
+        片段ID列表
+    """
+    return [
+        str(uuid.uuid5(uuid.NAMESPACE_URL,
+                       f"{domain_id}:{file_key}:{file_hash}:{i}"))
+        for i in range(count)
+    ]
+
+
+class IndexManifest:
+    """
+    索引清单 - 记录领域内已入库文件的哈希和片段ID
+    """
+
+    def __init__(self, manifest_path: str):
+        """
+        初始化索引清单
+
+        Args:
+            manifest_path: 清单文件路径
+        """
+        self.manifest_path = manifest_path
+        # 文件相对路径 -> {"hash": 内容哈希, "chunk_ids": 片段ID列表}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # 最近一次提交的断点信息，入库中断后据此续传
+        self.checkpoint: Dict[str, Any] = {}
+
+    @classmethod
+    def load(cls, persist_directory: str) -> "IndexManifest":
+        """
+        从领域持久化目录加载清单，不存在时返回空清单
+
+        Args:
+            persist_directory: 领域持久化目录
+
+        Returns:
+            IndexManifest实例
+        """
+        manifest = cls(os.path.join(persist_directory, MANIFEST_FILE_NAME))
+        if os.path.exists(manifest.manifest_path):
+            with open(manifest.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            manifest.files = data.get("files", {})
+            manifest.checkpoint = data.get("checkpoint", {})
+        return manifest
+
+    def exists(self) -> bool:
+        """清单文件是否已存在于磁盘上"""
+        return os.path.exists(self.manifest_path)
+
+    def save(self) -> None:
+        """保存清单，先写临时文件再替换，避免中断时留下损坏的文件"""
+        tmp_path = self.manifest_path + ".tmp"
+        data = {"files": self.files, "checkpoint": self.checkpoint}
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def diff(
+        self, current_hashes: Dict[str, str]
+    ) -> Tuple[List[str], List[str], List[str]]:
+        """
+        比较当前文件哈希与清单记录
+
+        Args:
+            current_hashes: 文件相对路径 -> 当前内容哈希
+
+        Returns:
+            (新增文件, 已修改文件, 已删除文件)
+        """
+        added = [key for key in current_hashes if key not in self.files]
+        changed = [
+            key for key, file_hash in current_hashes.items()
+            if key in self.files and self.files[key]["hash"] != file_hash
+        ]
+        removed = [key for key in self.files if key not in current_hashes]
+        return sorted(added), sorted(changed), sorted(removed)
+
+    def get_chunk_ids(self, file_key: str) -> List[str]:
+        """获取文件对应的片段ID"""
+        entry = self.files.get(file_key)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def all_chunk_ids(self) -> List[str]:
+        """获取清单中记录的所有片段ID"""
+        return [
+            chunk_id for entry in self.files.values()
+            for chunk_id in entry["chunk_ids"]
+        ]
+
+    def set_file(self, file_key: str, file_hash: str,
+                 chunk_ids: List[str]) -> None:
+        """记录文件的哈希和片段ID"""
+        self.files[file_key] = {"hash": file_hash, "chunk_ids": chunk_ids}
+
+    def remove_file(self, file_key: str) -> None:
+        """从清单中移除文件"""
+        self.files.pop(file_key, None)
+
+    def commit(self, file_key: str) -> None:
+        """
+        记录断点并保存清单
+
+        在一批片段写入向量数据库之后调用，中断后重新入库时，
+        清单中已记录的文件会被跳过
+
+        Args:
+            file_key: 本批最后提交的文件
+        """
+        self.checkpoint = {
+            "last_committed_file": file_key,
+            "committed_files": len(self.files),
+            "updated_at": time.time()
+        }
+        self.save()
+
+    def clear(self) -> None:
+        """清空清单"""
+        self.files.clear()
+        self.checkpoint = {}
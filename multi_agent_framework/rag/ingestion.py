@@ -0,0 +1,198 @@
+"""
+文档入库流水线
+使用进程池并行完成文档解析和文本分割，并按批次输出文档片段
+"""
+
+import os
+import logging
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+from langchain_community.document_loaders import TextLoader
+from langchain_community.document_loaders import (
+    PDFMinerLoader, UnstructuredWordDocumentLoader, UnstructuredExcelLoader,
+    CSVLoader, PythonLoader)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 单个文件的处理结果: (文件路径, 文档片段列表, 错误信息)
+FileChunks = Tuple[str, List[Document], Optional[str]]
+
+
+def get_loader(file_path: str):
+    """根据文件扩展名选择合适的加载器"""
+    _, extension = os.path.splitext(file_path)
+    extension = extension.lower()
+
+    if extension == '.txt':
+        return TextLoader(file_path, encoding='utf-8')
+    elif extension == '.pdf':
+        return PDFMinerLoader(file_path)
+    elif extension in ['.doc', '.docx']:
+        return UnstructuredWordDocumentLoader(file_path)
+    elif extension in ['.xls', '.xlsx']:
+        return UnstructuredExcelLoader(file_path)
+    elif extension == '.csv':
+        return CSVLoader(file_path)
+    elif extension == '.py':
+        return PythonLoader(file_path)
+    else:
+        # 默认使用文本加载器
+        return TextLoader(file_path, encoding='utf-8')
+
+
+def load_and_split_file(file_path: str, chunk_size: int, chunk_overlap: int,
+                        metadata: Dict[str, Any]) -> FileChunks:
+    """
+    加载单个文件并进行文本分割
+
+    定义为模块级函数，以便在子进程中执行
+
+    Args:
+        file_path: 文件路径
+        chunk_size: 片段大小
+        chunk_overlap: 片段重叠大小
+        metadata: 追加到每个片段的元数据
+
+    Returns:
+        (文件路径, 文档片段列表, 错误信息)
+    """
+    try:
+        documents = get_loader(file_path).load()
+
+        # 为文档添加元数据
+        for doc in documents:
+            if 'source' not in doc.metadata:
+                doc.metadata['source'] = file_path
+            doc.metadata.update(metadata)
+
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return file_path, text_splitter.split_documents(documents), None
+    except Exception as e:
+        return file_path, [], str(e)
+
+
+class IngestionPipeline:
+    """
+    文档入库流水线
+
+    文件在进程池中并行解析和分割，同时在途的文件数有上限，
+    结果按批次输出给嵌入模型，内存占用与语料总量无关
+    """
+
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 batch_size: int = 256,
+                 max_pending_files: Optional[int] = None,
+                 chunk_size: int = 1000,
+                 chunk_overlap: int = 200):
+        """
+        初始化入库流水线
+
+        Args:
+            max_workers: 进程池大小，默认为CPU核数；小于等于1时在当前进程中串行处理
+            batch_size: 每批输出的片段数上限（单个文件的片段不会被拆到两批中）
+            max_pending_files: 同时在途的文件数上限，默认为进程池大小的2倍
+            chunk_size: 片段大小
+            chunk_overlap: 片段重叠大小
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.max_pending_files = max_pending_files or self.max_workers * 2
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "IngestionPipeline":
+        """
+        根据RAG配置创建流水线
+
+        Args:
+            config: RAG配置，读取其中的ingestion和text_splitter部分
+
+        Returns:
+            IngestionPipeline实例
+        """
+        ingestion_config = config.get("ingestion", {})
+        text_splitter_config = config.get("text_splitter", {})
+        return cls(
+            max_workers=ingestion_config.get("max_workers"),
+            batch_size=ingestion_config.get("batch_size", 256),
+            max_pending_files=ingestion_config.get("max_pending_files"),
+            chunk_size=text_splitter_config.get("chunk_size", 1000),
+            chunk_overlap=text_splitter_config.get("chunk_overlap", 200))
+
+    def iter_files(self, file_paths: List[str],
+                   metadata: Dict[str, Any]) -> Iterator[FileChunks]:
+        """
+        逐个输出文件的处理结果（按完成顺序）
+
+        Args:
+            file_paths: 文件路径列表
+            metadata: 追加到每个片段的元数据
+
+        Yields:
+            (文件路径, 文档片段列表, 错误信息)
+        """
+        if self.max_workers <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                yield load_and_split_file(file_path, self.chunk_size,
+                                          self.chunk_overlap, metadata)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            remaining = iter(file_paths)
+            pending: Set[Future] = set()
+            while True:
+                # 补充在途任务，数量不超过上限
+                for file_path in remaining:
+                    pending.add(
+                        executor.submit(load_and_split_file, file_path,
+                                        self.chunk_size, self.chunk_overlap,
+                                        metadata))
+                    if len(pending) >= self.max_pending_files:
+                        break
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def iter_batches(self, file_paths: List[str],
+                     metadata: Dict[str, Any]) -> Iterator[List[FileChunks]]:
+        """
+        按批次输出文件的处理结果
+
+        每批包含若干完整文件，片段总数不超过batch_size
+        （单个文件的片段数超过batch_size时单独成批）。
+        加载或分割失败的文件也会随批输出（片段为空、错误信息不为None），
+        由调用方决定如何处理
+
+        Args:
+            file_paths: 文件路径列表
+            metadata: 追加到每个片段的元数据
+
+        Yields:
+            文件处理结果列表
+        """
+        batch: List[FileChunks] = []
+        batch_chunks = 0
+        for file_chunks in self.iter_files(file_paths, metadata):
+            file_path, splits, error = file_chunks
+            if error:
+                logger.warning(f"加载文件 {file_path} 失败: {error}")
+
+            if batch and batch_chunks + len(splits) > self.batch_size:
+                yield batch
+                batch, batch_chunks = [], 0
+            batch.append(file_chunks)
+            batch_chunks += len(splits)
+
+        if batch:
+            yield batch
@@ -1,18 +1,28 @@
 """RAG管理器"""
 import os
 import json
-from typing import Dict, Any, List, Optional
-from langchain_huggingface import HuggingFaceEmbeddings
+import asyncio
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains import RetrievalQA
 from langchain.schema import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.prompts import PromptTemplate
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_community.document_loaders import (
-    PDFMinerLoader, UnstructuredWordDocumentLoader, UnstructuredExcelLoader,
-    CSVLoader, PythonLoader)
+
+from .index_manifest import IndexManifest, compute_file_hash, make_chunk_ids
+from .ingestion import IngestionPipeline, get_loader
+from .embedding_registry import get_embeddings
+from .numpy_store import NumpyVectorStore
+from .bm25 import BM25Index
+from .hybrid_retriever import BM25Retriever, HybridRetriever
+from .answer_cache import AnswerCache
+from .domain_profile import DomainProfile
+from .tfidf_model import TfidfModel, corpus_fingerprint
+from .reranker import CrossEncoderReranker, RerankingRetriever, get_reranker
+from multi_agent_framework.core.tracing import tracer, callbacks_config
 
 
 class RAGManager:
@@ -21,6 +31,9 @@ class RAGManager:
     支持多种文件类型加载、目录加载和向量数据库持久化
     """
 
+    # 未在配置中指定vector_store.type时使用的向量数据库
+    default_vector_store = "chroma"
+
     def __init__(self, llm=None, config_path: str = None):
         # 默认配置文件路径
         if config_path is None:
@@ -31,14 +44,53 @@ class RAGManager:
         self.config = self._load_config(config_path)
 
         self.rag_chains: Dict[str, RetrievalQA] = {}
-        self.embeddings = HuggingFaceEmbeddings(model_name=self.config.get(
-            "embeddings_model", "sentence-transformers/all-MiniLM-L6-v2"))
+        self.vectorstores: Dict[str, Any] = {}
+        self.sparse_indexes: Dict[str, BM25Index] = {}
+        self.domain_profiles: Dict[str, DomainProfile] = {}
+        # 领域画像每次更新后递增，语义路由据此判断是否需要重建中心矩阵
+        self.profiles_version = 0
+        self.tfidf_models: Dict[str, TfidfModel] = {}
+        self.embeddings = self._create_embeddings()
+        self.answer_cache = self._create_answer_cache()
+        self.reranker = self._create_reranker()
         self.llm = llm
         self.persist_directory = self.config.get("persist_directory",
                                                  "./chroma_db")
         # 确保持久化目录存在
         os.makedirs(self.persist_directory, exist_ok=True)
 
+    def _create_embeddings(self) -> Embeddings:
+        """从共享的模型注册表获取嵌入模型，同一模型在进程内只加载一次"""
+        return get_embeddings(
+            self.config.get("embeddings_model",
+                            "sentence-transformers/all-MiniLM-L6-v2"),
+            cache_config=self.config.get("embedding_cache", {}),
+            batching_config=self.config.get("embedding_batching"))
+
+    def _create_answer_cache(self) -> Optional[AnswerCache]:
+        """根据配置创建问答结果缓存，未启用时返回None"""
+        cache_config = self.config.get("answer_cache", {})
+        if not cache_config.get("enabled", False):
+            return None
+        return AnswerCache(
+            embeddings=self.embeddings
+            if cache_config.get("semantic", False) else None,
+            max_entries=cache_config.get("max_entries", 1024),
+            ttl_seconds=cache_config.get("ttl_seconds", 3600),
+            semantic_threshold=cache_config.get("semantic_threshold", 0.95))
+
+    def _create_reranker(self) -> Optional[CrossEncoderReranker]:
+        """按retriever.rerank配置获取共享的重排器，未启用时返回None"""
+        rerank_config = self.config.get("retriever", {}).get("rerank", {})
+        if not rerank_config.get("enabled", False):
+            return None
+        return get_reranker(
+            rerank_config.get("model",
+                              "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"),
+            device=rerank_config.get("device", "cpu"),
+            batch_size=rerank_config.get("batch_size", 32),
+            max_length=rerank_config.get("max_length", 512))
+
     def _load_config(self, config_path: str) -> Dict[str, Any]:
         """加载配置文件"""
         if not os.path.exists(config_path):
@@ -57,11 +109,80 @@ class RAGManager:
                     "search_type": "similarity",
                     "search_kwargs": {
                         "k": 4
+                    },
+                    "mode": "dense",
+                    "hybrid": {
+                        "fetch_k": 20,
+                        "rrf_k": 60,
+                        "dense_weight": 1.0,
+                        "sparse_weight": 1.0
+                    },
+                    "bm25": {
+                        "k1": 1.5,
+                        "b": 0.75
+                    },
+                    "rerank": {
+                        "enabled": False,
+                        "model": "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+                        "device": "cpu",
+                        "fetch_k": 20,
+                        "batch_size": 32,
+                        "max_length": 512,
+                        "token_budget": None
                     }
                 },
                 "text_splitter": {
                     "chunk_size": 1000,
                     "chunk_overlap": 200
+                },
+                "ingestion": {
+                    "max_workers": None,
+                    "batch_size": 256,
+                    "max_pending_files": None,
+                    "upsert_batch_size": 64,
+                    "upsert_parallelism": 2
+                },
+                "embedding_cache": {
+                    "enabled": True,
+                    "directory": "./embedding_cache",
+                    "dtype": "float16",
+                    "query_cache_size": 1024
+                },
+                "embedding_batching": {
+                    "enabled": False,
+                    "max_batch_size": 32,
+                    "max_wait_ms": 5
+                },
+                "router": {
+                    "margin_threshold": 0.1,
+                    "llm_timeout": 10.0,
+                    "llm_workers": 4,
+                    "centroids": {
+                        "enabled": True,
+                        "per_domain": 8,
+                        "refit_ratio": 0.5,
+                        "batch_chunks": 1024
+                    }
+                },
+                "validator": {
+                    "tfidf_max_features": 20000,
+                    "semantic_mode": "llm",
+                    "uncertain_band": [0.35, 0.65],
+                    "embedding_calibration": None
+                },
+                "answer_cache": {
+                    "enabled": False,
+                    "semantic": False,
+                    "semantic_threshold": 0.95,
+                    "max_entries": 1024,
+                    "ttl_seconds": 3600
+                },
+                "vector_store": {
+                    "numpy": {
+                        "ivf_threshold": 50000,
+                        "ivf_nlist": None,
+                        "ivf_nprobe": 8
+                    }
                 }
             }
 
@@ -107,6 +228,9 @@ class RAGManager:
             # 创建RAG链
             rag_chain = self._create_rag_chain(path, domain_id)
             self.rag_chains[domain_id] = rag_chain
+            # 领域重新建立索引后，之前缓存的答案可能已经过时
+            if self.answer_cache is not None:
+                self.answer_cache.invalidate_domain(domain_id)
             print(f"成功添加领域: {domain_id}")
             return True
         except Exception as e:
@@ -115,98 +239,409 @@ class RAGManager:
 
     def _get_loader(self, file_path: str):
         """根据文件扩展名选择合适的加载器"""
-        _, extension = os.path.splitext(file_path)
-        extension = extension.lower()
-
-        if extension == '.txt':
-            return TextLoader(file_path, encoding='utf-8')
-        elif extension == '.pdf':
-            return PDFMinerLoader(file_path)
-        elif extension in ['.doc', '.docx']:
-            return UnstructuredWordDocumentLoader(file_path)
-        elif extension in ['.xls', '.xlsx']:
-            return UnstructuredExcelLoader(file_path)
-        elif extension == '.csv':
-            return CSVLoader(file_path)
-        elif extension == '.py':
-            return PythonLoader(file_path)
+        return get_loader(file_path)
+
+    def _iter_source_files(self, path: str) -> List[str]:
+        """
+        列出路径下需要入库的文件
+        
+        Args:
+            path: 文档路径（可以是文件或目录）
+            
+        Returns:
+            按路径排序的文件列表
+        """
+        if os.path.isfile(path):
+            return [path]
+
+        file_paths = []
+        for root, _, files in os.walk(path):
+            for file in files:
+                file_paths.append(os.path.join(root, file))
+        return sorted(file_paths)
+
+    def _file_key(self, path: str, file_path: str) -> str:
+        """文件在领域内的标识，使用相对于领域路径的路径"""
+        if os.path.isfile(path):
+            return os.path.basename(file_path)
+        return os.path.relpath(file_path, path).replace(os.sep, "/")
+
+    def _add_chunks(self, vectorstore, documents: List[Any],
+                    ids: List[str]) -> None:
+        """
+        将一批文档片段写入向量数据库
+        
+        Args:
+            vectorstore: 向量数据库
+            documents: 文档片段
+            ids: 片段ID
+        """
+        vectorstore.add_documents(documents, ids=ids)
+
+    def _get_sparse_index(self, domain_id: str) -> BM25Index:
+        """获取领域的BM25索引，首次使用时从领域持久化目录加载"""
+        if domain_id not in self.sparse_indexes:
+            bm25_config = self.config.get("retriever", {}).get("bm25", {})
+            self.sparse_indexes[domain_id] = BM25Index.load(
+                os.path.join(self.persist_directory, domain_id),
+                k1=bm25_config.get("k1", 1.5),
+                b=bm25_config.get("b", 0.75))
+        return self.sparse_indexes[domain_id]
+
+    def _update_domain_profile(self, domain_id: str) -> None:
+        """
+        根据BM25索引中的片段增量更新领域画像
+
+        画像与BM25索引按文件哈希对齐：只处理画像中缺失或已变化的文件，
+        变化片段占比过高时对全部片段重新聚类。片段向量优先从向量数据库读回，
+        读不到的才嵌入（通常命中嵌入缓存）；按router.centroids.batch_chunks
+        个片段一批逐批送入画像，内存占用与领域规模无关
+
+        Args:
+            domain_id: 领域ID
+        """
+        centroid_config = self.config.get("router", {}).get("centroids", {})
+        if not centroid_config.get("enabled", True):
+            return
+
+        profile = self.domain_profiles.get(domain_id)
+        if profile is None:
+            profile = DomainProfile.load(
+                os.path.join(self.persist_directory, domain_id),
+                n_centroids=centroid_config.get("per_domain", 8),
+                refit_ratio=centroid_config.get("refit_ratio", 0.5))
+            self.domain_profiles[domain_id] = profile
+            self.profiles_version += 1
+
+        sparse_index = self._get_sparse_index(domain_id)
+        current_hashes = {
+            key: entry["hash"]
+            for key, entry in list(sparse_index.files.items())
+            if entry["chunk_ids"]
+        }
+        stale = [
+            key for key in list(profile.file_hashes)
+            if current_hashes.get(key) != profile.file_hash(key)
+        ]
+        missing = [
+            key for key in sorted(current_hashes)
+            if profile.file_hash(key) != current_hashes[key]
+        ]
+        if not stale and not missing:
+            return
+
+        for file_key in stale:
+            profile.remove_file(file_key)
+        pending_chunks = sum(
+            len(sparse_index.files[key]["chunk_ids"]) for key in missing)
+        refit = profile.needs_refit(pending_chunks)
+        batches = self._iter_profile_batches(
+            domain_id, sorted(current_hashes) if refit else missing,
+            max(1, centroid_config.get("batch_chunks", 1024)))
+        if refit:
+            profile.fit(batches)
         else:
-            # 默认使用文本加载器
-            return TextLoader(file_path, encoding='utf-8')
+            for batch in batches:
+                for file_key, (file_hash, chunk_vectors) in batch.items():
+                    profile.add_file(file_key, file_hash, chunk_vectors)
+        profile.save()
+        self.profiles_version += 1
+        print(f"领域 {domain_id} 更新领域画像: {len(profile)} 个片段")
+
+    def _iter_profile_batches(self, domain_id: str, file_keys: List[str],
+                              batch_chunks: int):
+        """
+        按文件分批生成画像所需的片段向量，每批约batch_chunks个片段
 
-    def _create_rag_chain(self, path: str, domain_id: str) -> RetrievalQA:
+        Args:
+            domain_id: 领域ID
+            file_keys: 文件相对路径
+            batch_chunks: 每批的片段数
+
+        Yields:
+            文件相对路径 -> (内容哈希, 片段向量矩阵)
         """
-        创建RAG链
+        sparse_index = self._get_sparse_index(domain_id)
+        vectorstore = self.vectorstores.get(domain_id)
+        group: List[str] = []
+        group_chunks = 0
+        for position, file_key in enumerate(file_keys):
+            group.append(file_key)
+            group_chunks += len(sparse_index.files[file_key]["chunk_ids"])
+            if group_chunks < batch_chunks and position < len(file_keys) - 1:
+                continue
+            entries = {
+                key: (sparse_index.files[key]["hash"],
+                      list(sparse_index.files[key]["chunk_ids"]))
+                for key in group
+            }
+            chunk_ids = [
+                chunk_id for _, ids in entries.values() for chunk_id in ids
+            ]
+            vectors = (self._stored_vectors(vectorstore, chunk_ids)
+                       if vectorstore is not None else {})
+            absent = [chunk_id for chunk_id in chunk_ids
+                      if chunk_id not in vectors]
+            if absent:
+                vectors.update(
+                    zip(absent,
+                        self.embeddings.embed_documents(
+                            [sparse_index.docs[chunk_id]["text"]
+                             for chunk_id in absent])))
+            yield {
+                key: (file_hash,
+                      np.asarray([vectors[chunk_id] for chunk_id in ids],
+                                 dtype=np.float32))
+                for key, (file_hash, ids) in entries.items()
+            }
+            group, group_chunks = [], 0
+
+    def _stored_vectors(self, vectorstore,
+                        chunk_ids: List[str]) -> Dict[str, Any]:
+        """
+        从向量数据库读回片段向量，不支持读取向量的数据库返回空字典
+
+        Args:
+            vectorstore: 向量数据库
+            chunk_ids: 片段ID
+
+        Returns:
+            片段ID -> 向量
+        """
+        if isinstance(vectorstore, NumpyVectorStore):
+            return vectorstore.get_vectors(chunk_ids)
+        if isinstance(vectorstore, Chroma):
+            result = vectorstore.get(ids=chunk_ids, include=["embeddings"])
+            embeddings = result.get("embeddings")
+            if embeddings is None:
+                return {}
+            return dict(zip(result["ids"], embeddings))
+        return {}
+
+    def get_tfidf_model(self, domain_id: str) -> TfidfModel:
+        """
+        获取领域的TF-IDF模型
+
+        模型在领域语料（BM25索引中的片段）上拟合一次并保存在领域持久化目录，
+        语料指纹变化（领域重新入库）后才重新拟合
+
+        Args:
+            domain_id: 领域ID
+
+        Returns:
+            TfidfModel实例，领域没有片段时为未拟合的模型
+        """
+        model = self.tfidf_models.get(domain_id)
+        if model is None:
+            model = TfidfModel.load(
+                os.path.join(self.persist_directory, domain_id),
+                max_features=self.config.get("validator", {}).get(
+                    "tfidf_max_features", 20000))
+            self.tfidf_models[domain_id] = model
+
+        sparse_index = self._get_sparse_index(domain_id)
+        fingerprint = corpus_fingerprint({
+            key: entry["hash"]
+            for key, entry in list(sparse_index.files.items())
+        })
+        if model.fingerprint != fingerprint and len(sparse_index):
+            model.fit(sparse_index.texts(), fingerprint)
+            model.save()
+        return model
+
+    def _sync_vectorstore(self, vectorstore, path: str, domain_id: str,
+                          manifest: IndexManifest) -> Dict[str, Any]:
+        """
+        根据索引清单增量同步向量数据库和BM25索引
+        
+        只对新增或内容变化的文件做嵌入，并删除已移除文件的片段；
+        BM25索引落后于清单的文件只补建BM25索引，不重新嵌入。
+        修改过的文件在新片段加载成功后才删除旧片段，加载失败时保留旧片段，
+        清单中仍是旧哈希，下次同步会重试
         
         Args:
+            vectorstore: 支持add_documents(ids=...)和delete(ids=...)的向量数据库
             path: 文档路径（可以是文件或目录）
-            domain_id: 领域ID，用于创建独立的向量存储
+            domain_id: 领域ID
+            manifest: 领域的索引清单
             
         Returns:
-            RetrievalQA链
+            {"changed": 向量数据库是否发生了变化,
+             "failed_files": 加载或分割失败的文件相对路径 -> 错误信息}
+        """
+        file_paths = {}
+        current_hashes = {}
+        for file_path in self._iter_source_files(path):
+            file_key = self._file_key(path, file_path)
+            file_paths[file_key] = file_path
+            current_hashes[file_key] = compute_file_hash(file_path)
+
+        sparse_index = self._get_sparse_index(domain_id)
+        added, changed, removed = manifest.diff(current_hashes)
+        backfill = [
+            key for key in sorted(current_hashes)
+            if key not in added and key not in changed
+            and sparse_index.file_hash(key) != current_hashes[key]
+        ]
+        for file_key in list(sparse_index.files):
+            if file_key not in current_hashes:
+                sparse_index.remove_file(file_key)
+
+        if not (added or changed or removed or backfill):
+            print(f"领域 {domain_id} 的文档没有变化，跳过嵌入")
+            return {"changed": False, "failed_files": {}}
+
+        print(f"领域 {domain_id} 增量更新: 新增 {len(added)} 个文件，"
+              f"修改 {len(changed)} 个文件，删除 {len(removed)} 个文件")
+        if backfill:
+            print(f"领域 {domain_id} 补建BM25索引: {len(backfill)} 个文件")
+
+        # 删除已移除文件的片段，已修改文件的旧片段在其新片段写入时删除
+        stale_ids = []
+        for file_key in removed:
+            stale_ids.extend(manifest.get_chunk_ids(file_key))
+            manifest.remove_file(file_key)
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+            manifest.save()
+
+        # 只嵌入新增和修改的文件：进程池并行解析和分割，按批次写入向量数据库，
+        # 每批写入后保存断点，中断后重新入库会跳过已提交的文件
+        pipeline = IngestionPipeline.from_config(self.config)
+        dense_keys = set(added + changed)
+        file_keys = {file_paths[key]: key for key in added + changed + backfill}
+        committed_files = 0
+        committed_chunks = 0
+        failed_files: Dict[str, str] = {}
+        for batch in pipeline.iter_batches(list(file_keys),
+                                           {"domain": domain_id}):
+            batch_splits = []
+            batch_ids = []
+            batch_entries = []
+            batch_stale_ids = []
+            for file_path, splits, error in batch:
+                file_key = file_keys[file_path]
+                if error:
+                    failed_files[file_key] = error
+                    continue
+                chunk_ids = make_chunk_ids(domain_id, file_key,
+                                           current_hashes[file_key],
+                                           len(splits))
+                sparse_index.add_file(file_key, current_hashes[file_key],
+                                      chunk_ids, splits)
+                committed_files += 1
+                if file_key not in dense_keys:
+                    continue
+                batch_entries.append((file_key, chunk_ids))
+                batch_stale_ids.extend(manifest.get_chunk_ids(file_key))
+                batch_splits.extend(splits)
+                batch_ids.extend(chunk_ids)
+            if batch_stale_ids:
+                vectorstore.delete(ids=batch_stale_ids)
+            if batch_splits:
+                self._add_chunks(vectorstore, batch_splits, batch_ids)
+
+            for file_key, chunk_ids in batch_entries:
+                manifest.set_file(file_key, current_hashes[file_key],
+                                  chunk_ids)
+            if batch_entries:
+                manifest.commit(batch_entries[-1][0])
+
+            committed_chunks += len(batch_splits)
+            failed_note = f"，失败 {len(failed_files)} 个文件" if failed_files else ""
+            print(f"领域 {domain_id} 入库进度: {committed_files}/{len(file_keys)} "
+                  f"个文件，{committed_chunks} 个片段{failed_note}")
+
+        sparse_index.save()
+        if failed_files:
+            print(f"领域 {domain_id} 有 {len(failed_files)} 个文件加载失败，"
+                  f"下次同步时重试（修改过的文件保留原有片段）: "
+                  f"{sorted(failed_files)}")
+        committed_dense = len(dense_keys) - len(
+            dense_keys.intersection(failed_files))
+        return {
+            "changed": bool(removed or committed_dense),
+            "failed_files": failed_files
+        }
+
+    def _search_kwargs(self, domain_id: str) -> Dict[str, Any]:
         """
-        # 创建向量存储（支持持久化）
+        获取领域检索参数的副本
+        
+        Args:
+            domain_id: 领域ID
+            
+        Returns:
+            传给检索器的search_kwargs
+        """
+        retriever_config = self.config.get("retriever", {})
+        return dict(retriever_config.get("search_kwargs", {"k": 4}))
+
+    def _vector_store_type(self, domain_id: str) -> str:
+        """
+        获取领域使用的向量数据库类型
+
+        领域配置中的vector_store优先，其次是全局vector_store.type，
+        都未配置时使用default_vector_store
+        """
+        domain_config = self.config.get("domains", {}).get(domain_id, {})
+        return (domain_config.get("vector_store")
+                or self.config.get("vector_store", {}).get("type")
+                or self.default_vector_store)
+
+    def _open_vectorstore(self, path: str, domain_id: str):
+        """
+        打开（或新建）领域的向量数据库，并根据索引清单增量同步文档
+
+        Args:
+            path: 文档路径（可以是文件或目录）
+            domain_id: 领域ID
+
+        Returns:
+            向量数据库
+        """
+        store_type = self._vector_store_type(domain_id)
         domain_persist_directory = os.path.join(self.persist_directory,
                                                 domain_id)
         os.makedirs(domain_persist_directory, exist_ok=True)
+        manifest = IndexManifest.load(domain_persist_directory)
 
-        # 检查是否已存在向量数据库
-        if os.path.exists(
-                os.path.join(domain_persist_directory, 'chroma.sqlite3')):
-            print(f"加载现有的向量数据库: {domain_persist_directory}")
-            # 加载现有的向量数据库
+        if store_type == "chroma":
             vectorstore = Chroma(persist_directory=domain_persist_directory,
                                  embedding_function=self.embeddings)
+            if not manifest.exists():
+                # 没有清单的旧数据库无法判断片段归属，清空后重建一次
+                existing_ids = vectorstore.get().get("ids", [])
+                if existing_ids:
+                    print(f"向量数据库 {domain_persist_directory} 缺少索引清单，将重新建立索引")
+                    vectorstore.delete(ids=existing_ids)
+        elif store_type == "numpy":
+            numpy_config = self.config.get("vector_store", {}).get("numpy", {})
+            vectorstore = NumpyVectorStore(
+                os.path.join(domain_persist_directory, "numpy_store"),
+                self.embeddings,
+                ivf_threshold=numpy_config.get("ivf_threshold", 50000),
+                ivf_nlist=numpy_config.get("ivf_nlist"),
+                ivf_nprobe=numpy_config.get("ivf_nprobe", 8))
+            if len(vectorstore) and not manifest.exists():
+                print(f"向量数据库 {domain_persist_directory} 缺少索引清单，将重新建立索引")
+                vectorstore.clear()
         else:
-            print(f"创建新的向量数据库: {domain_persist_directory}")
-            # 加载文档
-            if os.path.isfile(path):
-                # 单个文件
-                loader = self._get_loader(path)
-                documents = loader.load()
-            else:
-                # 目录中的所有支持的文件
-                loader = DirectoryLoader(path,
-                                         glob="**/*",
-                                         show_progress=True,
-                                         use_multithreading=True)
-                documents = loader.load()
-
-            if not documents:
-                raise ValueError(f"在路径 {path} 中未找到文档")
-
-            # 为文档添加元数据
-            for i, doc in enumerate(documents):
-                if 'source' not in doc.metadata:
-                    doc.metadata['source'] = path
-                doc.metadata['domain'] = domain_id
-
-            # 文本分割
-            text_splitter_config = self.config.get("text_splitter", {})
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=text_splitter_config.get("chunk_size", 1000),
-                chunk_overlap=text_splitter_config.get("chunk_overlap", 200))
-            splits = text_splitter.split_documents(documents)
-
-            # 创建新的向量数据库
-            vectorstore = Chroma.from_documents(
-                documents=splits,
-                embedding=self.embeddings,
-                persist_directory=domain_persist_directory)
+            raise ValueError(f"不支持的向量数据库类型: {store_type}")
+
+        if self._sync_vectorstore(vectorstore, path, domain_id,
+                                  manifest)["changed"]:
             # 持久化数据
             vectorstore.persist()
 
-        # 创建检索链
-        retriever_config = self.config.get("retriever", {})
-        search_kwargs = retriever_config.get("search_kwargs", {"k": 4})
-
-        # 创建检索器，支持过滤器
-        retriever = vectorstore.as_retriever(search_type=retriever_config.get(
-            "search_type", "similarity"),
-                                             search_kwargs=search_kwargs)
+        if not manifest.files:
+            raise ValueError(f"在路径 {path} 中未找到文档")
+        return vectorstore
 
-        # 定义提示模板 - 使用ChatPromptTemplate支持更复杂的对话
-        prompt = ChatPromptTemplate.from_messages([
+    def _create_prompt(self) -> ChatPromptTemplate:
+        """创建RAG链使用的提示模板"""
+        # 使用ChatPromptTemplate支持更复杂的对话
+        return ChatPromptTemplate.from_messages([
             (
                 "system",
                 '请根据以下上下文回答问题：{context}',
@@ -214,6 +649,121 @@ class RAGManager:
             MessagesPlaceholder(variable_name="messages"),
         ])
 
+    def _retrieval_mode(self, domain_id: str) -> str:
+        """
+        获取领域的检索模式: dense（向量）、lexical（BM25）或 hybrid（RRF融合）
+
+        领域配置中的retrieval_mode优先，其次是retriever.mode
+        """
+        domain_config = self.config.get("domains", {}).get(domain_id, {})
+        return (domain_config.get("retrieval_mode")
+                or self.config.get("retriever", {}).get("mode", "dense"))
+
+    def _create_retriever(self,
+                          domain_id: str,
+                          mode: Optional[str] = None,
+                          filter: Optional[Any] = None) -> BaseRetriever:
+        """
+        按检索模式创建领域的检索器，启用重排时在外层包装重排检索器
+        
+        Args:
+            domain_id: 领域ID
+            mode: 检索模式，为None时使用配置中的模式
+            filter: 过滤条件，BM25只支持元数据等值过滤（dict）
+            
+        Returns:
+            检索器
+        """
+        if self.reranker is None:
+            return self._create_base_retriever(domain_id, mode, filter)
+
+        # 基础检索器多取fetch_k个候选，重排后只保留k个
+        rerank_config = self.config.get("retriever", {}).get("rerank", {})
+        k = self._search_kwargs(domain_id).get("k", 4)
+        fetch_k = max(k, rerank_config.get("fetch_k", 20))
+        return RerankingRetriever(
+            base_retriever=self._create_base_retriever(domain_id, mode, filter,
+                                                       fetch_k),
+            reranker=self.reranker,
+            k=k,
+            token_budget=rerank_config.get("token_budget"))
+
+    def _create_base_retriever(self,
+                               domain_id: str,
+                               mode: Optional[str] = None,
+                               filter: Optional[Any] = None,
+                               k: Optional[int] = None) -> BaseRetriever:
+        """
+        按检索模式创建领域的基础检索器
+
+        Args:
+            domain_id: 领域ID
+            mode: 检索模式，为None时使用配置中的模式
+            filter: 过滤条件，BM25只支持元数据等值过滤（dict）
+            k: 返回结果数，为None时使用search_kwargs中的k
+
+        Returns:
+            检索器
+        """
+        mode = mode or self._retrieval_mode(domain_id)
+        retriever_config = self.config.get("retriever", {})
+        search_kwargs = self._search_kwargs(domain_id)
+        if filter is not None:
+            search_kwargs["filter"] = filter
+            if mode != "dense" and not isinstance(filter, dict):
+                print(f"BM25检索不支持该过滤条件，领域 {domain_id} 改用向量检索")
+                mode = "dense"
+        if k is not None:
+            search_kwargs["k"] = k
+        k = search_kwargs.get("k", 4)
+
+        if mode == "dense":
+            return self.vectorstores[domain_id].as_retriever(
+                search_type=retriever_config.get("search_type", "similarity"),
+                search_kwargs=search_kwargs)
+
+        hybrid_config = retriever_config.get("hybrid", {})
+        fetch_k = max(k, hybrid_config.get("fetch_k", 20))
+        sparse_retriever = BM25Retriever(
+            index=self._get_sparse_index(domain_id),
+            k=k if mode == "lexical" else fetch_k,
+            filter=filter)
+        if mode == "lexical":
+            # 纯词法检索只查倒排表，不调用嵌入模型
+            return sparse_retriever
+        if mode != "hybrid":
+            raise ValueError(f"不支持的检索模式: {mode}")
+
+        search_kwargs["k"] = fetch_k
+        dense_retriever = self.vectorstores[domain_id].as_retriever(
+            search_type=retriever_config.get("search_type", "similarity"),
+            search_kwargs=search_kwargs)
+        return HybridRetriever(
+            dense_retriever=dense_retriever,
+            sparse_retriever=sparse_retriever,
+            k=k,
+            rrf_k=hybrid_config.get("rrf_k", 60),
+            dense_weight=hybrid_config.get("dense_weight", 1.0),
+            sparse_weight=hybrid_config.get("sparse_weight", 1.0))
+
+    def _create_rag_chain(self, path: str, domain_id: str) -> RetrievalQA:
+        """
+        创建RAG链
+        
+        Args:
+            path: 文档路径（可以是文件或目录）
+            domain_id: 领域ID，用于创建独立的向量存储
+            
+        Returns:
+            RetrievalQA链
+        """
+        self.vectorstores[domain_id] = self._open_vectorstore(path, domain_id)
+        self._update_domain_profile(domain_id)
+        self.get_tfidf_model(domain_id)
+
+        # 创建检索器，检索模式见配置中的retriever.mode
+        retriever = self._create_retriever(domain_id)
+
         # 创建RAG链 - 使用ConversationalRetrievalChain来支持ChatPromptTemplate
         from langchain.chains import ConversationalRetrievalChain
 
@@ -221,41 +771,176 @@ class RAGManager:
             llm=self.llm,
             retriever=retriever,
             chain_type="stuff",
-            condense_question_prompt=prompt,
+            condense_question_prompt=self._create_prompt(),
             return_source_documents=True)
 
         return rag_chain
 
+    def retrieve(self,
+                 question: str,
+                 domain: str = None,
+                 filter: Optional[Dict[str, Any]] = None,
+                 mode: Optional[str] = None) -> List[Any]:
+        """
+        只检索相关片段，不调用大模型
+        
+        Args:
+            question: 问题
+            domain: 领域ID，如果为None则使用默认领域
+            filter: 过滤条件
+            mode: 检索模式（dense、lexical、hybrid），为None时使用配置
+            
+        Returns:
+            按相关性排序的文档片段
+        """
+        if domain is None or domain not in self.vectorstores:
+            domain = self.config.get("default_domain", "technical")
+        if domain not in self.vectorstores:
+            return []
+        return self._create_retriever(domain, mode, filter).invoke(question)
+
+    async def aretrieve(self,
+                        question: str,
+                        domain: str = None,
+                        filter: Optional[Dict[str, Any]] = None,
+                        mode: Optional[str] = None) -> List[Any]:
+        """异步检索相关片段，参数和返回值同retrieve"""
+        if domain is None or domain not in self.vectorstores:
+            domain = self.config.get("default_domain", "technical")
+        if domain not in self.vectorstores:
+            return []
+        return await self._create_retriever(domain, mode,
+                                            filter).ainvoke(question)
+
+    def _resolve_domain(self, domain: Optional[str]) -> str:
+        """未指定或未加载的领域使用默认领域"""
+        if domain is None or domain not in self.rag_chains:
+            domain = self.config.get("default_domain", "technical")
+        return domain
+
+    def _domain_not_found(self, domain: str) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "error": f"未找到领域 {domain} 的知识库",
+            "answer": ""
+        }
+
     def query(self,
               question: str,
               domain: str = None,
               filter: Optional[Dict[str, Any]] = None,
+              mode: Optional[str] = None,
               **kwargs) -> Dict[str, Any]:
         """
         查询RAG系统
         
+        启用answer_cache时先查问答结果缓存；带有对话历史的查询不使用缓存
+        
         Args:
             question: 问题
             domain: 领域ID，如果为None则使用默认领域
             filter: 过滤条件，用于过滤检索结果
+            mode: 检索模式（dense、lexical、hybrid），为None时使用配置
             **kwargs: 传递给prompt的额外变量
             
         Returns:
-            查询结果
+            查询结果，命中缓存时包含 "cached": True
         """
         # 如果没有指定领域，则使用默认领域
-        if domain is None or domain not in self.rag_chains:
-            domain = self.config.get("default_domain", "technical")
-
+        domain = self._resolve_domain(domain)
         if domain not in self.rag_chains:
-            return {
-                "success": False,
-                "error": f"未找到领域 {domain} 的知识库",
-                "answer": ""
-            }
-
+            return self._domain_not_found(domain)
+
+        with tracer.span("rag.query", domain=domain, mode=mode) as span:
+            if self.answer_cache is None or not self._is_cacheable(kwargs):
+                return self._invoke_chain(question, domain, filter, mode,
+                                          **kwargs)
+
+            cached, vector = self.answer_cache.lookup(question, domain, filter,
+                                                      mode)
+            span.set_attribute("cache_hit", cached is not None)
+            if cached is not None:
+                return {**cached, "cached": True}
+
+            result = self._invoke_chain(question, domain, filter, mode,
+                                        **kwargs)
+            if result.get("success"):
+                self.answer_cache.put(question,
+                                      domain,
+                                      result,
+                                      filter=filter,
+                                      mode=mode,
+                                      vector=vector)
+            return result
+
+    async def aquery(self,
+                     question: str,
+                     domain: str = None,
+                     filter: Optional[Dict[str, Any]] = None,
+                     mode: Optional[str] = None,
+                     **kwargs) -> Dict[str, Any]:
+        """
+        异步查询RAG系统，参数和返回值同query
+        
+        检索和大模型调用使用LangChain的异步接口，多个会话可以在同一个事件循环中并发
+        """
+        domain = self._resolve_domain(domain)
+        if domain not in self.rag_chains:
+            return self._domain_not_found(domain)
+
+        with tracer.span("rag.query", domain=domain, mode=mode) as span:
+            if self.answer_cache is None or not self._is_cacheable(kwargs):
+                return await self._ainvoke_chain(question, domain, filter, mode,
+                                                 **kwargs)
+
+            # 语义层需要嵌入问题，放到线程中执行，避免阻塞事件循环
+            cached, vector = await asyncio.to_thread(self.answer_cache.lookup,
+                                                     question, domain, filter,
+                                                     mode)
+            span.set_attribute("cache_hit", cached is not None)
+            if cached is not None:
+                return {**cached, "cached": True}
+
+            result = await self._ainvoke_chain(question, domain, filter, mode,
+                                               **kwargs)
+            if result.get("success"):
+                self.answer_cache.put(question,
+                                      domain,
+                                      result,
+                                      filter=filter,
+                                      mode=mode,
+                                      vector=vector)
+            return result
+
+    def _is_cacheable(self, kwargs: Dict[str, Any]) -> bool:
+        """只有单轮问答的结果可以缓存，多轮对话的答案依赖上下文"""
+        return not kwargs.get("chat_history") and len(
+            kwargs.get("messages") or []) <= 1
+
+    def _prepare_chain(self, question: str, domain: str,
+                       filter: Optional[Dict[str, Any]], mode: Optional[str],
+                       **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """
+        准备领域的RAG链和输入
+        
+        Args:
+            question: 问题
+            domain: 已加载的领域ID
+            filter: 过滤条件
+            mode: 检索模式
+            **kwargs: 传递给prompt的额外变量
+            
+        Returns:
+            (RAG链, 链的输入)
+        """
         rag_chain = self.rag_chains[domain]
 
+        # 如果提供了过滤器或指定了检索模式，则使用替换了检索器的链副本，
+        # 不修改共享的链，并发查询之间互不影响
+        if filter is not None or mode is not None:
+            rag_chain = rag_chain.copy(
+                update={"retriever": self._create_retriever(domain, mode, filter)})
+
         # 创建输入消息
         input_messages = [HumanMessage(content=question)]
 
@@ -266,34 +951,36 @@ class RAGManager:
             "chat_history": [],  # ConversationalRetrievalChain需要chat_history
             **kwargs
         }
+        return rag_chain, input_data
 
-        # 如果提供了过滤器，则临时修改检索器
-        if filter is not None:
-            # 获取原始检索器的配置
-            original_retriever = rag_chain.retriever
-            retriever_config = self.config.get("retriever", {})
-            search_kwargs = retriever_config.get("search_kwargs", {"k": 4})
-            search_kwargs["filter"] = filter
-
-            # 创建新的带过滤器的检索器
-            new_retriever = original_retriever.vectorstore.as_retriever(
-                search_type=retriever_config.get("search_type", "similarity"),
-                search_kwargs=search_kwargs)
-
-            # 临时替换检索器
-            rag_chain.retriever = new_retriever
-            result = rag_chain.invoke(input_data)
-            # 恢复原始检索器
-            rag_chain.retriever = original_retriever
-        else:
-            result = rag_chain.invoke(input_data)
-
+    def _format_result(self, result: Dict[str, Any],
+                       domain: str) -> Dict[str, Any]:
         return {
             "success": True,
             "answer": result.get("answer", ""),
-            "sources": result.get("source_documents", [])
+            "sources": result.get("source_documents", []),
+            "domain": domain
         }
 
+    def _invoke_chain(self, question: str, domain: str,
+                      filter: Optional[Dict[str, Any]], mode: Optional[str],
+                      **kwargs) -> Dict[str, Any]:
+        """调用领域的RAG链，参数同_prepare_chain"""
+        rag_chain, input_data = self._prepare_chain(question, domain, filter,
+                                                    mode, **kwargs)
+        return self._format_result(
+            rag_chain.invoke(input_data, config=callbacks_config()), domain)
+
+    async def _ainvoke_chain(self, question: str, domain: str,
+                             filter: Optional[Dict[str, Any]],
+                             mode: Optional[str], **kwargs) -> Dict[str, Any]:
+        """异步调用领域的RAG链，参数同_prepare_chain"""
+        rag_chain, input_data = self._prepare_chain(question, domain, filter,
+                                                    mode, **kwargs)
+        return self._format_result(
+            await rag_chain.ainvoke(input_data, config=callbacks_config()),
+            domain)
+
     def list_domains(self) -> List[Dict[str, str]]:
         """
         列出所有领域
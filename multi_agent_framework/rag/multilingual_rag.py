@@ -5,25 +5,25 @@
 
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Optional, Union, cast
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
-from langchain.schema import HumanMessage
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.prompts import PromptTemplate
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_community.document_loaders import (
-    PDFMinerLoader, UnstructuredWordDocumentLoader, UnstructuredExcelLoader,
-    CSVLoader, PythonLoader)
 import logging
 
 from langchain_qdrant import Qdrant
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from qdrant_client.http.models import (
+    BinaryQuantization, BinaryQuantizationConfig, Disabled, Distance,
+    QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+    ScalarType, SearchParams, VectorParams)
 
 # 导入原始的RAGManager
 from .manager import RAGManager
+from .index_manifest import IndexManifest
+from .embedding_registry import get_embeddings
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +36,8 @@ class MultilingualRAGManager(RAGManager):
     继承自RAGManager，使用bge-m3嵌入模型和Qdrant向量数据库支持多语言检索
     """
 
+    default_vector_store = "qdrant"
+
     def __init__(self,
                  llm=None,
                  config_path: Optional[str] = None,
@@ -56,6 +58,10 @@ class MultilingualRAGManager(RAGManager):
             embeddings_model: 嵌入模型名称
             offline: 是否使用离线模式
         """
+        # 嵌入模型参数需要在父类初始化之前设置，父类会调用_create_embeddings
+        self.embeddings_model = embeddings_model
+        self.offline = offline
+
         # 调用父类初始化方法
         # 修复类型问题：使用cast将Optional[str]转换为str以满足父类签名要求
         super().__init__(llm, cast(str, config_path))
@@ -71,43 +77,314 @@ class MultilingualRAGManager(RAGManager):
                                               port=qdrant_port)
             logger.info(f"连接到Qdrant服务: {qdrant_host}:{qdrant_port}")
 
-        # 初始化嵌入模型
+        logger.info(f"使用嵌入模型: {embeddings_model}")
+        logger.info("多语言RAG管理器初始化完成")
+
+    def _create_embeddings(self) -> Embeddings:
+        """
+        获取嵌入模型，重写父类方法以使用bge-m3
+        
+        Returns:
+            共享注册表中的嵌入模型
+        """
         model_kwargs = {'device': 'cpu'}  # type: Dict[str, Any]
-        if offline:
+        if self.offline:
             model_kwargs['local_files_only'] = True
 
         # 使用bge-m3作为嵌入模型，支持多语言
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embeddings_model,
-            model_kwargs=model_kwargs,
-            encode_kwargs={'normalize_embeddings': True})
-        logger.info(f"使用嵌入模型: {embeddings_model}")
-        logger.info("多语言RAG管理器初始化完成")
+        return get_embeddings(self.embeddings_model,
+                              model_kwargs=model_kwargs,
+                              encode_kwargs={'normalize_embeddings': True},
+                              cache_config=self.config.get(
+                                  "embedding_cache", {}),
+                              batching_config=self.config.get(
+                                  "embedding_batching"))
+
+    def _quantization_config(self, domain_id: str) -> Dict[str, Any]:
+        """获取领域的量化配置，未配置时返回空字典"""
+        domain_config = self.config.get("domains", {}).get(domain_id, {})
+        return domain_config.get("quantization", {})
+
+    def _build_quantization(self, domain_id: str):
+        """
+        根据领域配置构建Qdrant量化参数
+        
+        支持的type: "int8"（标量量化）、"binary"（二值量化）
+        
+        Args:
+            domain_id: 领域ID
+            
+        Returns:
+            量化参数，未配置量化时返回None
+        """
+        quantization = self._quantization_config(domain_id)
+        quantization_type = quantization.get("type")
+        always_ram = quantization.get("always_ram", True)
+        if quantization_type == "int8":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=quantization.get("quantile", 0.99),
+                always_ram=always_ram))
+        elif quantization_type == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(
+                always_ram=always_ram))
+        elif quantization_type:
+            raise ValueError(f"不支持的量化类型: {quantization_type}")
+        return None
+
+    def _create_collection(self, collection_name: str,
+                           domain_id: str) -> None:
+        """
+        创建Qdrant集合
+        
+        领域配置了量化时，原始float向量可以放到磁盘上（on_disk_vectors），
+        内存中只保留量化后的向量
+        
+        Args:
+            collection_name: 集合名称
+            domain_id: 领域ID
+        """
+        quantization_config = self._build_quantization(domain_id)
+        on_disk = bool(quantization_config is not None
+                       and self._quantization_config(domain_id).get(
+                           "on_disk_vectors", True))
+        self.qdrant_client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=1024,
+                                        distance=Distance.COSINE,
+                                        on_disk=on_disk),
+            quantization_config=quantization_config,
+        )
+
+    def _sync_quantization(self, collection_name: str,
+                           domain_id: str) -> None:
+        """
+        使已存在集合的量化参数与领域配置一致，配置中去掉quantization时关闭量化
+
+        内存模式（:memory:）不支持量化，集合不会记录量化参数，这里的更新也不生效
+
+        Args:
+            collection_name: 集合名称
+            domain_id: 领域ID
+        """
+        quantization_config = self._build_quantization(domain_id)
+        current = self.qdrant_client.get_collection(
+            collection_name=collection_name).config.quantization_config
+        if quantization_config == current:
+            return
+        if quantization_config is None:
+            logger.info(f"关闭Qdrant集合 {collection_name} 的量化")
+            quantization_config = Disabled.DISABLED
+        else:
+            logger.info(f"更新Qdrant集合 {collection_name} 的量化参数")
+        self.qdrant_client.update_collection(
+            collection_name=collection_name,
+            quantization_config=quantization_config)
+
+    def _quantized_search_params(self, domain_id: str,
+                                 ignore: bool = False
+                                 ) -> Optional[SearchParams]:
+        """
+        构建量化检索参数：先用量化向量取 oversampling*k 个候选，再用float向量精确重排
+        
+        Args:
+            domain_id: 领域ID
+            ignore: 是否忽略量化，直接使用float向量检索（用于对比基线）
+            
+        Returns:
+            检索参数，未配置量化时返回None
+        """
+        quantization = self._quantization_config(domain_id)
+        if not quantization.get("type"):
+            return None
+        return SearchParams(quantization=QuantizationSearchParams(
+            ignore=ignore,
+            rescore=quantization.get("rescore", True),
+            oversampling=quantization.get("oversampling", 2.0)))
+
+    def _search_kwargs(self, domain_id: str) -> Dict[str, Any]:
+        """
+        获取领域检索参数，配置了量化的领域附加量化检索参数
+        
+        Args:
+            domain_id: 领域ID
+            
+        Returns:
+            传给检索器的search_kwargs
+        """
+        search_kwargs = super()._search_kwargs(domain_id)
+        if self._vector_store_type(domain_id) != "qdrant":
+            return search_kwargs
+        search_params = self._quantized_search_params(domain_id)
+        if search_params is not None:
+            search_kwargs["search_params"] = search_params
+        return search_kwargs
+
+    def evaluate_quantization(self,
+                              domain_id: str,
+                              questions: List[str],
+                              k: Optional[int] = None) -> Dict[str, Any]:
+        """
+        对比量化检索与float基线的召回率和延迟
+        
+        注意：Qdrant内存模式（:memory:）不支持量化，两者结果会完全一致，
+        需要连接Qdrant服务才能得到有意义的对比
+        
+        Args:
+            domain_id: 领域ID，需要已配置quantization
+            questions: 用于评估的问题列表
+            k: 返回结果数，默认使用检索配置中的k
+            
+        Returns:
+            召回率和两种检索方式的延迟统计（毫秒）
+        """
+        quantized_params = self._quantized_search_params(domain_id)
+        if quantized_params is None:
+            raise ValueError(f"领域 {domain_id} 未配置量化")
+        baseline_params = self._quantized_search_params(domain_id,
+                                                        ignore=True)
+        if k is None:
+            k = super()._search_kwargs(domain_id).get("k", 4)
+        collection_name = f"rag_collection_{domain_id}"
 
-    def _create_rag_chain(self, path: str, domain_id: str) -> RetrievalQA:
+        def timed_search(vector, search_params):
+            start = time.perf_counter()
+            points = self.qdrant_client.query_points(
+                collection_name=collection_name,
+                query=vector,
+                limit=k,
+                search_params=search_params,
+                with_payload=False).points
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            return [point.id for point in points], elapsed_ms
+
+        recalls = []
+        baseline_latencies = []
+        quantized_latencies = []
+        for question in questions:
+            vector = self.embeddings.embed_query(question)
+            baseline_ids, baseline_ms = timed_search(vector, baseline_params)
+            quantized_ids, quantized_ms = timed_search(vector,
+                                                       quantized_params)
+            baseline_latencies.append(baseline_ms)
+            quantized_latencies.append(quantized_ms)
+            if baseline_ids:
+                recalls.append(
+                    len(set(baseline_ids) & set(quantized_ids)) /
+                    len(baseline_ids))
+
+        def latency_stats(latencies):
+            if not latencies:
+                return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+            ordered = sorted(latencies)
+            return {
+                "mean_ms": sum(ordered) / len(ordered),
+                "p50_ms": ordered[int(0.5 * (len(ordered) - 1))],
+                "p95_ms": ordered[int(0.95 * (len(ordered) - 1))]
+            }
+
+        report = {
+            "domain": domain_id,
+            "quantization": self._quantization_config(domain_id),
+            "k": k,
+            "questions": len(questions),
+            "recall_at_k": sum(recalls) / len(recalls) if recalls else 0.0,
+            "float_baseline": latency_stats(baseline_latencies),
+            "quantized": latency_stats(quantized_latencies)
+        }
+        logger.info(f"领域 {domain_id} 量化评估: recall@{k}="
+                    f"{report['recall_at_k']:.4f}，float p50="
+                    f"{report['float_baseline']['p50_ms']:.2f}ms，量化 p50="
+                    f"{report['quantized']['p50_ms']:.2f}ms")
+        return report
+
+    def _add_chunks(self, vectorstore, documents: List[Any],
+                    ids: List[str]) -> None:
         """
-        创建RAG链，重写父类方法以使用Qdrant和bge-m3
+        将一批文档片段分成若干子批次，并行嵌入并写入Qdrant
+        
+        子批次大小和并行度由配置中的ingestion.upsert_batch_size和
+        ingestion.upsert_parallelism控制
+        
+        Args:
+            vectorstore: Qdrant向量数据库
+            documents: 文档片段
+            ids: 片段ID
+        """
+        ingestion_config = self.config.get("ingestion", {})
+        batch_size = max(1, ingestion_config.get("upsert_batch_size", 64))
+        parallelism = max(1, ingestion_config.get("upsert_parallelism", 1))
+
+        sub_batches = [(documents[i:i + batch_size], ids[i:i + batch_size])
+                       for i in range(0, len(documents), batch_size)]
+        if parallelism == 1 or len(sub_batches) == 1:
+            for sub_documents, sub_ids in sub_batches:
+                vectorstore.add_documents(sub_documents,
+                                          ids=sub_ids,
+                                          batch_size=batch_size)
+            return
+
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = [
+                executor.submit(vectorstore.add_documents,
+                                sub_documents,
+                                ids=sub_ids,
+                                batch_size=batch_size)
+                for sub_documents, sub_ids in sub_batches
+            ]
+            # 任一子批次失败时抛出异常，本批文件不会记录到断点中
+            for future in futures:
+                future.result()
+
+    def _stored_vectors(self, vectorstore,
+                        chunk_ids: List[str]) -> Dict[str, Any]:
+        """
+        从Qdrant集合读回片段的原始向量，其他数据库交给父类处理
+
+        Args:
+            vectorstore: 向量数据库
+            chunk_ids: 片段ID
+
+        Returns:
+            片段ID -> 向量
+        """
+        if not isinstance(vectorstore, Qdrant):
+            return super()._stored_vectors(vectorstore, chunk_ids)
+        records = self.qdrant_client.retrieve(
+            collection_name=vectorstore.collection_name,
+            ids=chunk_ids,
+            with_payload=False,
+            with_vectors=True)
+        return {
+            str(record.id): record.vector
+            for record in records if record.vector is not None
+        }
+
+    def _open_vectorstore(self, path: str, domain_id: str):
+        """
+        打开领域的向量数据库，重写父类方法以默认使用Qdrant
+        
+        领域配置为chroma或numpy时交给父类处理
         
         Args:
             path: 文档路径（可以是文件或目录）
-            domain_id: 领域ID，用于创建独立的向量存储
+            domain_id: 领域ID
             
         Returns:
-            RetrievalQA链
+            向量数据库
         """
+        if self._vector_store_type(domain_id) != "qdrant":
+            return super()._open_vectorstore(path, domain_id)
+
         # 创建Qdrant集合
         collection_name = f"rag_collection_{domain_id}"
 
-        try:
-            # 尝试创建集合，如果已存在会抛出异常
-            self.qdrant_client.create_collection(
-                collection_name=collection_name,
-                vectors_config=VectorParams(size=1024,
-                                            distance=Distance.COSINE),
-            )
+        if self.qdrant_client.collection_exists(collection_name):
+            # 已存在的集合按当前配置更新量化参数
+            self._sync_quantization(collection_name, domain_id)
+        else:
+            self._create_collection(collection_name, domain_id)
             logger.info(f"创建新的Qdrant集合: {collection_name}")
-        except Exception as e:
-            logger.info(f"Qdrant集合 {collection_name} 已存在或创建失败: {str(e)}")
 
         # 创建Qdrant实例
         qdrant = Qdrant(
@@ -116,57 +393,36 @@ class MultilingualRAGManager(RAGManager):
             embeddings=self.embeddings,
         )
 
-        # 检查集合是否为空，如果为空则加载文档
+        # 根据索引清单增量同步文档
+        domain_persist_directory = os.path.join(self.persist_directory,
+                                                domain_id)
+        os.makedirs(domain_persist_directory, exist_ok=True)
+        manifest = IndexManifest.load(domain_persist_directory)
+
         collection_info = self.qdrant_client.get_collection(
             collection_name=collection_name)
-        if collection_info.points_count == 0:
-            logger.info(f"集合 {collection_name} 为空，正在加载文档...")
-            # 加载文档
-            if os.path.isfile(path):
-                # 单个文件
-                loader = self._get_loader(path)
-                documents = loader.load()
-            else:
-                # 目录中的所有支持的文件
-                loader = DirectoryLoader(path,
-                                         glob="**/*",
-                                         show_progress=True,
-                                         use_multithreading=True)
-                documents = loader.load()
-
-            if not documents:
-                raise ValueError(f"在路径 {path} 中未找到文档")
-
-            # 为文档添加元数据
-            for i, doc in enumerate(documents):
-                if 'source' not in doc.metadata:
-                    doc.metadata['source'] = path
-                doc.metadata['domain'] = domain_id
-
-            # 文本分割
-            text_splitter_config = self.config.get("text_splitter", {})
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=text_splitter_config.get("chunk_size", 1000),
-                chunk_overlap=text_splitter_config.get("chunk_overlap", 200))
-            splits = text_splitter.split_documents(documents)
-
-            logger.info(f"文档分割完成，共 {len(splits)} 个片段")
-
-            # 将文档添加到Qdrant
-            qdrant.add_documents(splits)
-            logger.info(f"文档已添加到Qdrant集合 {collection_name}")
-
-        # 创建检索链
-        retriever_config = self.config.get("retriever", {})
-        search_kwargs = retriever_config.get("search_kwargs", {"k": 4})
-
-        # 创建检索器
-        retriever = qdrant.as_retriever(search_type=retriever_config.get(
-            "search_type", "similarity"),
-                                        search_kwargs=search_kwargs)
-
-        # 定义提示模板
-        prompt = ChatPromptTemplate.from_messages([
+        if collection_info.points_count == 0 and manifest.files:
+            # 集合为空（例如内存模式重启后），清单记录已失效
+            logger.info(f"集合 {collection_name} 为空，忽略已有的索引清单")
+            manifest.clear()
+        elif collection_info.points_count and not manifest.exists():
+            # 没有清单的旧集合无法判断片段归属，重建一次
+            logger.info(f"集合 {collection_name} 缺少索引清单，将重新建立索引")
+            self.qdrant_client.delete_collection(
+                collection_name=collection_name)
+            self._create_collection(collection_name, domain_id)
+
+        if self._sync_vectorstore(qdrant, path, domain_id,
+                                  manifest)["changed"]:
+            logger.info(f"文档已同步到Qdrant集合 {collection_name}")
+
+        if not manifest.files:
+            raise ValueError(f"在路径 {path} 中未找到文档")
+        return qdrant
+
+    def _create_prompt(self) -> ChatPromptTemplate:
+        """创建DNS专家提示模板，重写父类方法"""
+        return ChatPromptTemplate.from_messages([
             (
                 "system",
                 """你是一位资深 DNS（域名系统）技术专家，精通 DNS 协议、解析流程、记录类型、安全机制（如 DNSSEC）、EDNS、权威/递归服务器架构、常见故障排查及最佳实践。你的任务是以清晰、准确、专业且易于理解的方式回答用户关于 DNS 的问题。
@@ -201,83 +457,3 @@ class MultilingualRAGManager(RAGManager):
             ),
             MessagesPlaceholder(variable_name="messages"),
         ])
-
-        # 创建RAG链
-        from langchain.chains import ConversationalRetrievalChain
-
-        rag_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            chain_type="stuff",
-            condense_question_prompt=prompt,
-            return_source_documents=True)
-
-        return rag_chain
-
-    def query(self,
-              question: str,
-              domain: Optional[str] = None,
-              filter: Optional[Dict[str, Any]] = None,
-              **kwargs) -> Dict[str, Any]:
-        """
-        查询RAG系统
-        
-        Args:
-            question: 问题
-            domain: 领域ID，如果为None则使用默认领域
-            filter: 过滤条件，用于过滤检索结果
-            **kwargs: 传递给prompt的额外变量
-            
-        Returns:
-            查询结果
-        """
-        # 如果没有指定领域，则使用默认领域
-        if domain is None or domain not in self.rag_chains:
-            domain = self.config.get("default_domain", "technical")
-
-        if domain not in self.rag_chains:
-            return {
-                "success": False,
-                "error": f"未找到领域 {domain} 的知识库",
-                "answer": ""
-            }
-
-        rag_chain = self.rag_chains[domain]
-
-        # 创建输入消息
-        input_messages = [HumanMessage(content=question)]
-
-        # 合并question和kwargs作为输入
-        input_data = {
-            "question": question,
-            "messages": input_messages,
-            "chat_history": [],  # ConversationalRetrievalChain需要chat_history
-            **kwargs
-        }
-
-        # 如果提供了过滤器，则临时修改检索器
-        if filter is not None:
-            # 获取原始检索器的配置
-            original_retriever = rag_chain.retriever
-            retriever_config = self.config.get("retriever", {})
-            search_kwargs = retriever_config.get("search_kwargs", {"k": 4})
-            search_kwargs["filter"] = filter
-
-            # 创建新的带过滤器的检索器
-            new_retriever = original_retriever.vectorstore.as_retriever(
-                search_type=retriever_config.get("search_type", "similarity"),
-                search_kwargs=search_kwargs)
-
-            # 临时替换检索器
-            rag_chain.retriever = new_retriever
-            result = rag_chain.invoke(input_data)
-            # 恢复原始检索器
-            rag_chain.retriever = original_retriever
-        else:
-            result = rag_chain.invoke(input_data)
-
-        return {
-            "success": True,
-            "answer": result.get("answer", ""),
-            "sources": result.get("source_documents", [])
-        }
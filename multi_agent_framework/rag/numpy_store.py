@@ -0,0 +1,560 @@
+"""
+NumPy向量存储
+归一化后的嵌入向量保存在内存映射的.npy矩阵中，元数据保存在追加写的jsonl旁路文件中。
+检索为一次矩阵向量乘法加argpartition；领域规模超过阈值后切换为IVF分区检索
+"""
+
+import os
+import ast
+import json
+import uuid
+import logging
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Callable
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# .npy文件头固定为128字节，追加行时原地改写shape
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_SIZE = 128
+
+
+def _write_npy_header(f, rows: int, dim: int) -> None:
+    """写入固定长度的.npy文件头（float32、C顺序）"""
+    header = repr({
+        'descr': '<f4',
+        'fortran_order': False,
+        'shape': (rows, dim)
+    })
+    header_len = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2
+    header = header.ljust(header_len - 1) + "\n"
+    f.seek(0)
+    f.write(_NPY_MAGIC)
+    f.write(header_len.to_bytes(2, "little"))
+    f.write(header.encode('latin1'))
+
+
+def _read_npy_shape(path: str) -> Tuple[int, int]:
+    """读取固定长度文件头中的shape"""
+    with open(path, 'rb') as f:
+        prefix = f.read(_NPY_HEADER_SIZE)
+    header = ast.literal_eval(prefix[len(_NPY_MAGIC) + 2:].decode('latin1'))
+    return header['shape']
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """将向量按行归一化为float32"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def spherical_kmeans(vectors: np.ndarray,
+            n_clusters: int,
+            iterations: int = 10,
+            seed: int = 0) -> np.ndarray:
+    """
+    对归一化向量做球面k-means
+
+    Args:
+        vectors: 归一化向量矩阵
+        n_clusters: 聚类数
+        iterations: 迭代次数
+        seed: 随机种子
+
+    Returns:
+        归一化的聚类中心矩阵
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters,
+                                   replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignments == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                # 空簇重新随机选点
+                centroids[c] = vectors[rng.integers(len(vectors))]
+        centroids = normalize_rows(centroids)
+    return centroids
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    基于NumPy的向量存储
+
+    目录结构:
+        vectors.npy     归一化向量矩阵，只追加，删除通过墓碑标记
+        metadata.jsonl  追加写的操作日志（add/delete），启动时重放
+        ivf.npz         IVF分区（聚类中心和每行所属分区）
+
+    冷启动只需内存映射vectors.npy，多个工作进程可以共享同一份页缓存。
+    同一目录同时只应有一个进程写入
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    METADATA_FILE = "metadata.jsonl"
+    IVF_FILE = "ivf.npz"
+
+    def __init__(self,
+                 persist_directory: str,
+                 embedding: Embeddings,
+                 ivf_threshold: int = 50000,
+                 ivf_nlist: Optional[int] = None,
+                 ivf_nprobe: int = 8,
+                 compact_ratio: float = 0.3):
+        """
+        初始化NumPy向量存储
+
+        Args:
+            persist_directory: 持久化目录
+            embedding: 嵌入模型
+            ivf_threshold: 有效片段数达到该值后启用IVF分区检索
+            ivf_nlist: IVF分区数，默认为 4*sqrt(片段数)
+            ivf_nprobe: 每次检索扫描的分区数
+            compact_ratio: 已删除行占比超过该值时压缩文件
+        """
+        self.persist_directory = persist_directory
+        self.embedding = embedding
+        self.ivf_threshold = ivf_threshold
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.compact_ratio = compact_ratio
+        os.makedirs(persist_directory, exist_ok=True)
+
+        self._vectors_path = os.path.join(persist_directory, self.VECTORS_FILE)
+        self._metadata_path = os.path.join(persist_directory,
+                                           self.METADATA_FILE)
+        self._ivf_path = os.path.join(persist_directory, self.IVF_FILE)
+        self._lock = threading.RLock()
+
+        # 每行的ID、文本和元数据；已删除的行ID为None
+        self._ids: List[Optional[str]] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._alive: np.ndarray = np.zeros(0, dtype=bool)
+        # IVF分区: 聚类中心、已建索引的行数、每行所属分区
+        self._centroids: Optional[np.ndarray] = None
+        self._ivf_rows = 0
+        self._ivf_assignments: Optional[np.ndarray] = None
+
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    # ---------- 持久化 ----------
+
+    def _load(self) -> None:
+        """重放元数据日志并内存映射向量矩阵"""
+        if os.path.exists(self._metadata_path):
+            with open(self._metadata_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record["op"] == "add":
+                        self._append_row(record["id"], record["text"],
+                                         record["metadata"])
+                    elif record["op"] == "delete":
+                        self._delete_row(record["id"])
+
+        if os.path.exists(self._vectors_path):
+            rows, dim = _read_npy_shape(self._vectors_path)
+            if rows > len(self._ids):
+                # 写入向量后、写入元数据前中断，丢弃多出的行
+                self._rewrite_header(len(self._ids), dim)
+            self._remap()
+
+        if os.path.exists(self._ivf_path):
+            ivf = np.load(self._ivf_path)
+            self._centroids = ivf["centroids"]
+            self._ivf_assignments = ivf["assignments"]
+            self._ivf_rows = len(self._ivf_assignments)
+
+    def _append_row(self, row_id: str, text: str,
+                    metadata: Dict[str, Any]) -> None:
+        if row_id in self._id_to_row:
+            self._delete_row(row_id)
+        self._id_to_row[row_id] = len(self._ids)
+        self._ids.append(row_id)
+        self._texts.append(text)
+        self._metadatas.append(metadata)
+
+    def _delete_row(self, row_id: str) -> None:
+        row = self._id_to_row.pop(row_id, None)
+        if row is not None:
+            self._ids[row] = None
+
+    def _rewrite_header(self, rows: int, dim: int) -> None:
+        with open(self._vectors_path, 'r+b') as f:
+            _write_npy_header(f, rows, dim)
+            f.truncate(_NPY_HEADER_SIZE + rows * dim * 4)
+
+    def _remap(self) -> None:
+        """重新内存映射向量矩阵"""
+        self._matrix = None
+        if os.path.exists(self._vectors_path) and self._ids:
+            self._matrix = np.load(self._vectors_path, mmap_mode='r')
+        self._alive = np.array([row_id is not None for row_id in self._ids],
+                               dtype=bool)
+
+    def _append_vectors(self, vectors: np.ndarray) -> None:
+        """在.npy文件末尾追加行，并改写文件头中的行数"""
+        rows = len(self._ids)
+        dim = vectors.shape[1]
+        if not os.path.exists(self._vectors_path):
+            with open(self._vectors_path, 'wb') as f:
+                _write_npy_header(f, 0, dim)
+        # 先释放内存映射，Windows下映射中的文件不能被改写
+        self._matrix = None
+        with open(self._vectors_path, 'r+b') as f:
+            f.seek(_NPY_HEADER_SIZE + rows * dim * 4)
+            f.write(np.ascontiguousarray(vectors, dtype='<f4').tobytes())
+            _write_npy_header(f, rows + len(vectors), dim)
+
+    def _append_log(self, records: List[Dict[str, Any]]) -> None:
+        with open(self._metadata_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def persist(self) -> None:
+        """
+        整理存储文件
+
+        写入是即时持久化的，这里只在已删除行过多时压缩文件，
+        并在规模达到阈值时重建IVF分区
+        """
+        with self._lock:
+            deleted = len(self._ids) - len(self._id_to_row)
+            if self._ids and deleted / len(self._ids) > self.compact_ratio:
+                self._compact()
+            self._maybe_build_ivf()
+
+    def _compact(self) -> None:
+        """去掉已删除的行，重写向量矩阵和元数据日志"""
+        alive_rows = [i for i, row_id in enumerate(self._ids) if row_id]
+        dim = self._matrix.shape[1] if self._matrix is not None else 0
+        vectors = (np.asarray(self._matrix[alive_rows], dtype=np.float32)
+                   if alive_rows and self._matrix is not None else np.zeros(
+                       (0, dim), dtype=np.float32))
+        records = [{
+            "op": "add",
+            "id": self._ids[i],
+            "text": self._texts[i],
+            "metadata": self._metadatas[i]
+        } for i in alive_rows]
+        self._matrix = None
+
+        tmp_vectors = self._vectors_path + ".tmp"
+        with open(tmp_vectors, 'wb') as f:
+            _write_npy_header(f, len(vectors), dim)
+            f.write(vectors.tobytes())
+        tmp_metadata = self._metadata_path + ".tmp"
+        with open(tmp_metadata, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_metadata, self._metadata_path)
+
+        self._ids, self._texts, self._metadatas = [], [], []
+        self._id_to_row = {}
+        for record in records:
+            self._append_row(record["id"], record["text"], record["metadata"])
+        # 行号变化后IVF分区失效
+        self._drop_ivf()
+        self._remap()
+        logger.info(f"向量存储 {self.persist_directory} 压缩完成，剩余 {len(records)} 行")
+
+    def _drop_ivf(self) -> None:
+        self._centroids = None
+        self._ivf_assignments = None
+        self._ivf_rows = 0
+        if os.path.exists(self._ivf_path):
+            os.remove(self._ivf_path)
+
+    def _maybe_build_ivf(self) -> None:
+        """规模达到阈值且未建索引的尾部超过10%时，重建IVF分区"""
+        alive = len(self._id_to_row)
+        if alive < self.ivf_threshold or self._matrix is None:
+            return
+        if (self._centroids is not None
+                and len(self._ids) - self._ivf_rows <= 0.1 * self._ivf_rows):
+            return
+
+        nlist = self.ivf_nlist or max(1, int(4 * np.sqrt(alive)))
+        alive_rows = np.flatnonzero(self._alive)
+        # 用抽样向量训练聚类中心，再为所有行分配分区
+        rng = np.random.default_rng(0)
+        sample_size = min(len(alive_rows), max(nlist * 40, 10000))
+        sample = np.asarray(self._matrix[rng.choice(alive_rows,
+                                                    sample_size,
+                                                    replace=False)])
+        centroids = spherical_kmeans(sample, nlist)
+        assignments = np.empty(len(self._ids), dtype=np.int32)
+        for start in range(0, len(self._ids), 65536):
+            block = np.asarray(self._matrix[start:start + 65536])
+            assignments[start:start + len(block)] = np.argmax(
+                block @ centroids.T, axis=1)
+
+        np.savez(self._ivf_path, centroids=centroids, assignments=assignments)
+        self._centroids = centroids
+        self._ivf_assignments = assignments
+        self._ivf_rows = len(assignments)
+        logger.info(f"向量存储 {self.persist_directory} 建立IVF分区: "
+                    f"{nlist} 个分区，{len(assignments)} 行")
+
+    # ---------- 写入 ----------
+
+    def add_texts(self,
+                  texts: Iterable[str],
+                  metadatas: Optional[List[dict]] = None,
+                  *,
+                  ids: Optional[List[str]] = None,
+                  **kwargs: Any) -> List[str]:
+        """
+        嵌入并写入文本
+
+        Args:
+            texts: 文本
+            metadatas: 元数据
+            ids: 片段ID，已存在的ID会被覆盖
+
+        Returns:
+            片段ID列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = normalize_rows(
+            np.asarray(self.embedding.embed_documents(texts),
+                       dtype=np.float32))
+
+        with self._lock:
+            # 先写向量，再写元数据日志；日志中的记录才算提交
+            self._append_vectors(vectors)
+            records = []
+            for row_id, text, metadata in zip(ids, texts, metadatas):
+                if row_id in self._id_to_row:
+                    records.append({"op": "delete", "id": row_id})
+                records.append({
+                    "op": "add",
+                    "id": row_id,
+                    "text": text,
+                    "metadata": metadata
+                })
+            self._append_log(records)
+            for row_id, text, metadata in zip(ids, texts, metadatas):
+                self._append_row(row_id, text, metadata)
+            self._remap()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> bool:
+        """
+        删除片段（墓碑标记，压缩时真正移除）
+
+        Args:
+            ids: 片段ID列表
+
+        Returns:
+            是否执行了删除
+        """
+        if not ids:
+            return False
+        with self._lock:
+            existing = [row_id for row_id in ids if row_id in self._id_to_row]
+            if not existing:
+                return False
+            self._append_log([{"op": "delete", "id": row_id}
+                              for row_id in existing])
+            for row_id in existing:
+                self._alive[self._id_to_row[row_id]] = False
+                self._delete_row(row_id)
+        return True
+
+    def clear(self) -> None:
+        """删除所有数据"""
+        with self._lock:
+            self._matrix = None
+            for path in (self._vectors_path, self._metadata_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._ids, self._texts, self._metadatas = [], [], []
+            self._id_to_row = {}
+            self._drop_ivf()
+            self._remap()
+
+    def __len__(self) -> int:
+        return len(self._id_to_row)
+
+    # ---------- 检索 ----------
+
+    def _candidate_rows(self, query: np.ndarray,
+                        centroids: Optional[np.ndarray],
+                        assignments: Optional[np.ndarray],
+                        total_rows: int) -> Optional[np.ndarray]:
+        """IVF检索的候选行；未建IVF时返回None表示全量扫描"""
+        if centroids is None:
+            return None
+        nprobe = min(self.ivf_nprobe, len(centroids))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.flatnonzero(np.isin(assignments, probe))
+        # 建立分区之后追加的行全部参与计算
+        tail = np.arange(len(assignments), total_rows)
+        return np.concatenate([rows, tail])
+
+    @staticmethod
+    def _matches(metadata: Dict[str, Any],
+                 filter: Optional[Dict[str, Any]]) -> bool:
+        if not filter:
+            return True
+        return all(metadata.get(key) == value for key, value in filter.items())
+
+    def similarity_search_with_score_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        按向量检索
+
+        Args:
+            embedding: 查询向量
+            k: 返回结果数
+            filter: 元数据等值过滤条件
+
+        Returns:
+            (文档, 余弦相似度) 列表
+        """
+        query = normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
+        # 只在锁内取快照，矩阵乘法和top-k在锁外进行，并发检索互不阻塞。
+        # 写入和压缩会替换矩阵和各列表而不是原地修改，快照保持一致；
+        # 检索期间被删除的行在组装结果时跳过
+        with self._lock:
+            if self._matrix is None or not self._id_to_row:
+                return []
+            matrix = self._matrix
+            alive = self._alive.copy()
+            ids, texts, metadatas = self._ids, self._texts, self._metadatas
+            centroids, assignments = self._centroids, self._ivf_assignments
+
+        rows = self._candidate_rows(query, centroids, assignments, len(alive))
+        if rows is None:
+            scores = np.asarray(matrix @ query)
+            rows = np.arange(len(scores))
+        else:
+            scores = np.asarray(matrix[rows] @ query)
+
+        mask = alive[rows]
+        if filter:
+            mask &= np.fromiter(
+                (self._matches(metadatas[row], filter) for row in rows),
+                dtype=bool,
+                count=len(rows))
+        rows, scores = rows[mask], scores[mask]
+        if len(rows) == 0:
+            return []
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            row_id = ids[rows[i]]
+            if row_id is None:
+                continue
+            results.append((Document(id=row_id,
+                                     page_content=texts[rows[i]],
+                                     metadata=dict(metadatas[rows[i]])),
+                            float(scores[i])))
+        return results
+
+    def similarity_search_by_vector(self,
+                                    embedding: List[float],
+                                    k: int = 4,
+                                    **kwargs: Any) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs)
+        ]
+
+    def similarity_search_with_score(self,
+                                     query: str,
+                                     k: int = 4,
+                                     **kwargs: Any
+                                     ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self,
+                          query: str,
+                          k: int = 4,
+                          **kwargs: Any) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_score(
+                query, k, **kwargs)
+        ]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # 余弦相似度映射到[0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        """按ID获取文档"""
+        with self._lock:
+            return [
+                Document(id=row_id,
+                         page_content=self._texts[self._id_to_row[row_id]],
+                         metadata=dict(
+                             self._metadatas[self._id_to_row[row_id]]))
+                for row_id in ids if row_id in self._id_to_row
+            ]
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """
+        按ID读取已存储的归一化向量，只读取请求的行
+
+        Args:
+            ids: 片段ID
+
+        Returns:
+            片段ID -> 向量，不存在的ID不在结果中
+        """
+        with self._lock:
+            if self._matrix is None:
+                return {}
+            found = [row_id for row_id in ids if row_id in self._id_to_row]
+            rows = [self._id_to_row[row_id] for row_id in found]
+            vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+        return dict(zip(found, vectors))
+
+    @classmethod
+    def from_texts(cls,
+                   texts: List[str],
+                   embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None,
+                   *,
+                   ids: Optional[List[str]] = None,
+                   persist_directory: str = "./numpy_store",
+                   **kwargs: Any) -> "NumpyVectorStore":
+        """创建向量存储并写入文本"""
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        store.persist()
+        return store
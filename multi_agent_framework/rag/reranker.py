@@ -0,0 +1,215 @@
+"""
+交叉编码器重排
+检索器先多取候选，再用本地的小型交叉编码器对 (问题, 片段) 打分，
+只把前k个或不超过token预算的片段交给LLM
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.callbacks import (AsyncCallbackManagerForRetrieverRun,
+                                      CallbackManagerForRetrieverRun)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .text_utils import tokenize
+from multi_agent_framework.core.tracing import tracer
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    交叉编码器重排器
+
+    模型在首次重排时加载，同一模型的推理串行执行，避免多线程同时推理互相抢占CPU
+    """
+
+    def __init__(self,
+                 model_name: str,
+                 device: str = "cpu",
+                 batch_size: int = 32,
+                 max_length: int = 512):
+        """
+        初始化重排器
+
+        Args:
+            model_name: 交叉编码器模型名称
+            device: 推理设备
+            batch_size: 每批打分的 (问题, 片段) 对数
+            max_length: 每对文本的最大token数，超出部分截断
+        """
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model = None
+        self._lock = threading.Lock()
+        # 统计信息: 重排次数、打分的片段数、重排总耗时（毫秒）
+        self.stats = {"calls": 0, "pairs": 0, "total_ms": 0.0}
+
+    def _load_model(self):
+        """加载交叉编码器，调用方需持有self._lock"""
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            start = time.perf_counter()
+            self._model = CrossEncoder(self.model_name,
+                                       device=self.device,
+                                       max_length=self.max_length)
+            logger.info(f"加载重排模型 {self.model_name}，耗时 "
+                        f"{time.perf_counter() - start:.2f}s")
+        return self._model
+
+    def count_tokens(self, text: str) -> int:
+        """
+        估算文本的token数，模型已加载时使用其分词器，否则按检索词计数
+
+        Args:
+            text: 文本
+
+        Returns:
+            token数
+        """
+        tokenizer = getattr(self._model, "tokenizer", None)
+        if tokenizer is not None:
+            return len(tokenizer.tokenize(text))
+        return len(tokenize(text))
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        """
+        计算问题与各片段的相关性分数
+
+        Args:
+            query: 问题
+            documents: 候选片段
+
+        Returns:
+            与documents一一对应的分数
+        """
+        if not documents:
+            return []
+        pairs = [[query, document.page_content] for document in documents]
+        with self._lock:
+            model = self._load_model()
+            start = time.perf_counter()
+            scores = model.predict(pairs,
+                                   batch_size=self.batch_size,
+                                   show_progress_bar=False)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["calls"] += 1
+            self.stats["pairs"] += len(pairs)
+            self.stats["total_ms"] += elapsed_ms
+        return [float(score) for score in scores]
+
+    def rerank(self,
+               query: str,
+               documents: List[Document],
+               k: int = 4,
+               token_budget: Optional[int] = None) -> List[Document]:
+        """
+        按交叉编码器分数重排候选片段
+
+        Args:
+            query: 问题
+            documents: 候选片段
+            k: 最多返回的片段数
+            token_budget: 返回片段的token总数上限，为None时只按k截断；
+                分数最高的片段即使超出预算也会保留
+
+        Returns:
+            重排后的片段，metadata中带有rerank_score
+        """
+        with tracer.span("retriever.rerank",
+                         model=self.model_name,
+                         candidates=len(documents)) as span:
+            scores = self.score(query, documents)
+            # 稳定排序，分数相同时保持检索器原来的顺序
+            ranked = sorted(range(len(documents)),
+                            key=scores.__getitem__,
+                            reverse=True)
+
+            selected = []
+            used_tokens = 0
+            for i in ranked[:k]:
+                if token_budget is not None:
+                    tokens = self.count_tokens(documents[i].page_content)
+                    if selected and used_tokens + tokens > token_budget:
+                        break
+                    used_tokens += tokens
+                selected.append(
+                    Document(id=getattr(documents[i], "id", None),
+                             page_content=documents[i].page_content,
+                             metadata={
+                                 **documents[i].metadata,
+                                 "rerank_score": scores[i]
+                             }))
+            span.set_attribute("kept", len(selected))
+        return selected
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    重排检索器
+
+    基础检索器返回fetch_k个候选，交叉编码器重排后返回前k个
+    """
+
+    base_retriever: BaseRetriever
+    reranker: Any
+    k: int = 4
+    token_budget: Optional[int] = None
+
+    def _get_relevant_documents(
+            self, query: str, *,
+            run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        candidates = self.base_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()})
+        return self.reranker.rerank(query, candidates, self.k,
+                                    self.token_budget)
+
+    async def _aget_relevant_documents(
+            self, query: str, *,
+            run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = await self.base_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()})
+        # 模型推理占用CPU，放到线程中执行
+        return await asyncio.to_thread(self.reranker.rerank, query,
+                                       candidates, self.k, self.token_budget)
+
+
+# 进程内共享的重排器，同一模型只加载一次
+_rerankers: Dict[Tuple[str, str, int, int], CrossEncoderReranker] = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name: str,
+                 device: str = "cpu",
+                 batch_size: int = 32,
+                 max_length: int = 512) -> CrossEncoderReranker:
+    """
+    获取共享的重排器
+
+    Args:
+        model_name: 交叉编码器模型名称
+        device: 推理设备
+        batch_size: 每批打分的 (问题, 片段) 对数
+        max_length: 每对文本的最大token数
+
+    Returns:
+        CrossEncoderReranker实例
+    """
+    key = (model_name, device, batch_size, max_length)
+    with _rerankers_lock:
+        reranker = _rerankers.get(key)
+        if reranker is None:
+            reranker = CrossEncoderReranker(model_name, device, batch_size,
+                                            max_length)
+            _rerankers[key] = reranker
+    return reranker
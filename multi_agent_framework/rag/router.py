@@ -3,23 +3,47 @@ RAG路由模块
 提供基于语义相似度和LLM的智能路由选择功能
 """
 
+import asyncio
+import contextvars
 import numpy as np
-from langchain_huggingface import HuggingFaceEmbeddings
-from sklearn.metrics.pairwise import cosine_similarity
+from .embedding_registry import get_embeddings
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 import logging
-from typing import Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional, Tuple
+
+from multi_agent_framework.core.tracing import tracer
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _normalize_rows(vectors) -> np.ndarray:
+    """将向量按行归一化，返回C连续的float32矩阵"""
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回分数最高的k个下标，按分数降序排列"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
 class SemanticRAGRouter:
     """
     基于语义相似度的RAG路由选择器
-    使用嵌入模型计算问题与各领域描述的相似度
+    使用嵌入模型计算问题与各领域中心的相似度，领域的相似度为其最近中心的相似度；
+    中心来自领域画像（片段聚类中心），没有画像的领域使用领域描述的嵌入向量
     """
 
     def __init__(self, rag_manager):
@@ -30,8 +54,11 @@ class SemanticRAGRouter:
             rag_manager: RAG管理器实例
         """
         self.rag_manager = rag_manager
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2")
+        # 复用RAG管理器已加载的嵌入模型，避免重复加载
+        self.embeddings = getattr(rag_manager, "embeddings", None)
+        if self.embeddings is None:
+            self.embeddings = get_embeddings(
+                "sentence-transformers/all-MiniLM-L6-v2")
 
         # 获取各领域的描述
         domains_config = rag_manager.config.get("domains", {})
@@ -40,11 +67,18 @@ class SemanticRAGRouter:
             self.domain_descriptions[domain_id] = domain_info.get(
                 "description", "")
 
-        # 预计算领域描述的嵌入向量
-        self.domain_embeddings = {}
-        for domain_id, description in self.domain_descriptions.items():
-            self.domain_embeddings[domain_id] = self.embeddings.embed_query(
-                description)
+        # 预计算领域描述的嵌入向量，领域画像不可用时作为该领域的唯一中心
+        self.domain_ids = list(self.domain_descriptions)
+        self.description_matrix = _normalize_rows(
+            self.embeddings.embed_documents(
+                [self.domain_descriptions[d] for d in self.domain_ids])
+            if self.domain_ids else np.zeros((0, 0), dtype=np.float32))
+        # (中心矩阵, 各领域第一行的下标)，同一领域的中心按行相邻，
+        # 路由时一次矩阵向量乘法后按领域取最大值
+        self._domain_index = (self.description_matrix,
+                              np.arange(len(self.domain_ids)))
+        self._profiles_version = None
+        self._refresh_domain_index()
 
         logger.info(f"语义路由初始化完成，加载了{len(self.domain_descriptions)}个领域")
 
@@ -58,18 +92,130 @@ class SemanticRAGRouter:
         Returns:
             最匹配的领域ID
         """
-        # 计算问题的嵌入向量
-        question_embedding = self.embeddings.embed_query(question)
+        with tracer.span("router.semantic") as span:
+            # 计算问题的嵌入向量
+            question_embedding = self.embeddings.embed_query(question)
+            domain = self._select_domain(self._similarities(question_embedding))
+            span.set_attribute("domain", domain)
+            return domain
+
+    async def aroute_question(self, question):
+        """
+        异步选择最合适的领域，参数和返回值同route_question
+        """
+        with tracer.span("router.semantic") as span:
+            question_embedding = await self.embeddings.aembed_query(question)
+            domain = self._select_domain(self._similarities(question_embedding))
+            span.set_attribute("domain", domain)
+            return domain
+
+    def score_question(self, question) -> Dict[str, float]:
+        """
+        计算问题与各领域的相似度
+        
+        Args:
+            question: 用户问题
+            
+        Returns:
+            领域ID -> 余弦相似度
+        """
+        return self._similarities(self.embeddings.embed_query(question))
 
-        # 计算与各领域描述的相似度
-        similarities: Dict[str, float] = {}
-        for domain_id, domain_embedding in self.domain_embeddings.items():
-            similarity = cosine_similarity(
-                np.array(question_embedding).reshape(1, -1),
-                np.array(domain_embedding).reshape(1, -1))[0][0]
-            similarities[domain_id] = float(similarity)
+    async def ascore_question(self, question) -> Dict[str, float]:
+        """异步计算问题与各领域的相似度，返回值同score_question"""
+        return self._similarities(await
+                                  self.embeddings.aembed_query(question))
 
-        # 返回相似度最高的领域
+    @property
+    def domain_matrix(self) -> np.ndarray:
+        """所有领域的中心矩阵"""
+        return self._domain_index[0]
+
+    def _refresh_domain_index(self):
+        """
+        领域画像变化后重建中心矩阵
+
+        有领域画像的领域使用其片段聚类中心，否则使用领域描述的嵌入向量
+        """
+        version = getattr(self.rag_manager, "profiles_version", 0)
+        if version == self._profiles_version:
+            return self._domain_index
+        profiles = getattr(self.rag_manager, "domain_profiles", {})
+        blocks = []
+        row_starts = []
+        rows = 0
+        for i, domain_id in enumerate(self.domain_ids):
+            profile = profiles.get(domain_id)
+            centroids = (profile.centroid_matrix()
+                         if profile is not None else None)
+            if (centroids is None or not len(centroids) or
+                    centroids.shape[1] != self.description_matrix.shape[1]):
+                centroids = self.description_matrix[i:i + 1]
+            row_starts.append(rows)
+            blocks.append(centroids)
+            rows += len(centroids)
+        if blocks:
+            self._domain_index = (_normalize_rows(np.concatenate(blocks)),
+                                  np.asarray(row_starts, dtype=np.int64))
+        self._profiles_version = version
+        logger.info(f"语义路由中心矩阵: {len(self.domain_ids)} 个领域，{rows} 个中心")
+        return self._domain_index
+
+    def _domain_scores(self, question_matrix: np.ndarray) -> np.ndarray:
+        """计算问题与各领域最近中心的相似度，返回 (问题数, 领域数) 矩阵"""
+        matrix, row_starts = self._refresh_domain_index()
+        return np.maximum.reduceat(question_matrix @ matrix.T,
+                                   row_starts,
+                                   axis=1)
+
+    def _similarities(self, question_embedding) -> Dict[str, float]:
+        """计算问题向量与各领域最近中心的相似度"""
+        scores = self._domain_scores(_normalize_rows([question_embedding]))[0]
+        return dict(zip(self.domain_ids, scores.tolist()))
+
+    def top_domains(self, question, k: int = 3) -> List[Tuple[str, float]]:
+        """
+        返回与问题最相似的k个领域
+        
+        Args:
+            question: 用户问题
+            k: 返回的领域数
+            
+        Returns:
+            按相似度降序排列的 (领域ID, 相似度) 列表
+        """
+        scores = self._domain_scores(
+            _normalize_rows([self.embeddings.embed_query(question)]))[0]
+        return [(self.domain_ids[i], float(scores[i]))
+                for i in _top_k_indices(scores, k)]
+
+    def route_questions(self,
+                        questions: List[str],
+                        batch_size: int = 256) -> List[str]:
+        """
+        批量路由问题，用于离线重新标注聊天记录
+        
+        问题按批调用embed_documents嵌入，每批与中心矩阵做一次矩阵乘法
+        
+        Args:
+            questions: 问题列表
+            batch_size: 每批嵌入的问题数
+            
+        Returns:
+            与questions一一对应的领域ID
+        """
+        domains: List[str] = []
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            question_matrix = _normalize_rows(
+                self.embeddings.embed_documents(batch))
+            best = np.argmax(self._domain_scores(question_matrix), axis=1)
+            domains.extend(self.domain_ids[i] for i in best)
+        logger.info(f"语义路由批量处理了{len(questions)}个问题")
+        return domains
+
+    def _select_domain(self, similarities: Dict[str, float]):
+        """返回相似度最高的领域"""
         best_domain = max(similarities, key=lambda x: similarities[x])
         logger.info(
             f"语义路由选择领域: {best_domain} (相似度: {similarities[best_domain]:.4f})")
@@ -88,7 +234,8 @@ class LLMBasedRAGRouter:
         
         Args:
             rag_manager: RAG管理器实例
-            llm: 大型语言模型实例
+            llm: 大型语言模型实例，建议使用temperature=0的模型，
+                如local_llm_get(temperature=0)，相同问题的路由结果可以命中响应缓存
         """
         self.rag_manager = rag_manager
         self.llm = llm
@@ -131,53 +278,101 @@ class LLMBasedRAGRouter:
         Returns:
             最匹配的领域ID
         """
-        try:
-            result = self.routing_chain.invoke({
-                "domains": self.domains_description,
-                "question": question
-            })
-
-            selected_domain = result["text"].strip()
-            # 验证选择的领域是否有效
-            domains_config = self.rag_manager.config.get("domains", {})
-            if selected_domain in domains_config:
-                logger.info(f"LLM路由选择领域: {selected_domain}")
-                return selected_domain
-            else:
-                # 如果LLM返回无效领域，使用默认领域
-                default_domain = self.rag_manager.config.get(
-                    "default_domain", "technical")
-                logger.warning(
-                    f"LLM选择了无效领域: {selected_domain}，回退到默认领域: {default_domain}")
-                return default_domain
-        except Exception as e:
-            # 出现错误时回退到默认领域
+        with tracer.span("router.llm"):
+            try:
+                result = self.routing_chain.invoke({
+                    "domains": self.domains_description,
+                    "question": question
+                })
+                return self._resolve_domain(result["text"])
+            except Exception as e:
+                return self._fallback_domain(e)
+
+    async def aroute_question(self, question):
+        """
+        使用LLM的异步接口选择最合适的领域，参数和返回值同route_question
+        """
+        with tracer.span("router.llm"):
+            try:
+                result = await self.routing_chain.ainvoke({
+                    "domains": self.domains_description,
+                    "question": question
+                })
+                return self._resolve_domain(result["text"])
+            except Exception as e:
+                return self._fallback_domain(e)
+
+    def _resolve_domain(self, text):
+        """校验LLM返回的领域名称，无效时使用默认领域"""
+        selected_domain = text.strip()
+        # 验证选择的领域是否有效
+        domains_config = self.rag_manager.config.get("domains", {})
+        if selected_domain in domains_config:
+            logger.info(f"LLM路由选择领域: {selected_domain}")
+            return selected_domain
+        else:
+            # 如果LLM返回无效领域，使用默认领域
             default_domain = self.rag_manager.config.get(
                 "default_domain", "technical")
-            logger.error(f"LLM路由出现错误: {e}，回退到默认领域: {default_domain}")
+            logger.warning(
+                f"LLM选择了无效领域: {selected_domain}，回退到默认领域: {default_domain}")
             return default_domain
 
+    def _fallback_domain(self, error):
+        """出现错误时回退到默认领域"""
+        default_domain = self.rag_manager.config.get("default_domain",
+                                                     "technical")
+        logger.error(f"LLM路由出现错误: {error}，回退到默认领域: {default_domain}")
+        return default_domain
+
 
 class HybridRAGRouter:
     """
     混合RAG路由选择器
     结合语义相似度和LLM的路由策略
+
+    hybrid策略下语义路由第一名领先第二名的相似度超过margin_threshold时直接返回，
+    否则等待LLM结果，超过llm_timeout秒仍未返回时使用语义路由的结果。
+    同步接口先计算语义路由（约一次嵌入），只在需要时才提交LLM调用，
+    避免线程池被已开始、结果又被丢弃的LLM调用占满；异步接口两者并发，提前返回时取消LLM任务
     """
 
-    def __init__(self, rag_manager, llm=None):
+    def __init__(self,
+                 rag_manager,
+                 llm=None,
+                 margin_threshold: Optional[float] = None,
+                 llm_timeout: Optional[float] = None):
         """
         初始化混合路由选择器
         
         Args:
             rag_manager: RAG管理器实例
             llm: 大型语言模型实例（可选）
+            margin_threshold: 语义路由提前返回所需的相似度差值，
+                默认读取配置中的router.margin_threshold
+            llm_timeout: 等待LLM路由的最长秒数，默认读取配置中的router.llm_timeout
         """
         self.rag_manager = rag_manager
         self.llm = llm
 
+        router_config = rag_manager.config.get("router", {})
+        self.margin_threshold = (margin_threshold
+                                 if margin_threshold is not None else
+                                 router_config.get("margin_threshold", 0.1))
+        self.llm_timeout = (llm_timeout if llm_timeout is not None else
+                            router_config.get("llm_timeout", 10.0))
+
         # 初始化各种路由方法
         self.semantic_router = SemanticRAGRouter(rag_manager)
         self.llm_router = LLMBasedRAGRouter(rag_manager, llm) if llm else None
+        # 同步接口在线程池中执行LLM路由，与语义路由并发
+        self._executor = ThreadPoolExecutor(
+            max_workers=router_config.get("llm_workers", 4),
+            thread_name_prefix="llm-router") if self.llm_router else None
+
+        # 统计信息: 语义路由提前返回、等到LLM结果、等待LLM超时的次数
+        self.stats = {"early_exits": 0, "llm_decisions": 0, "llm_timeouts": 0}
+        self._stats_lock = threading.Lock()
 
         logger.info("混合路由初始化完成")
 
@@ -192,32 +387,114 @@ class HybridRAGRouter:
         Returns:
             最匹配的领域ID
         """
-        if strategy == "semantic":
-            return self.semantic_router.route_question(question)
-        elif strategy == "llm" and self.llm_router:
-            return self.llm_router.route_question(question)
-        elif strategy == "hybrid":
-            # 默认使用语义路由
-            semantic_domain = self.semantic_router.route_question(question)
-
-            # 如果有LLM，可以进一步确认
-            if self.llm_router:
-                llm_domain = self.llm_router.route_question(question)
-                # 如果两种方法结果一致，更有信心
-                if semantic_domain == llm_domain:
-                    logger.info(f"混合路由: 语义和LLM结果一致，选择领域: {semantic_domain}")
+        with tracer.span("router.hybrid", strategy=strategy):
+            if strategy == "semantic":
+                return self.semantic_router.route_question(question)
+            elif strategy == "llm" and self.llm_router:
+                return self.llm_router.route_question(question)
+            elif strategy == "hybrid":
+                if not self.llm_router:
+                    return self.semantic_router.route_question(question)
+
+                # 先计算语义路由，领先幅度不足时才提交LLM路由
+                similarities = self.semantic_router.score_question(question)
+                semantic_domain = self.semantic_router._select_domain(similarities)
+                if self._clears_margin(similarities):
                     return semantic_domain
-                else:
-                    # 如果结果不一致，优先使用LLM的结果
-                    logger.info(
-                        f"混合路由: 语义路由选择{semantic_domain}，LLM路由选择{llm_domain}，优先使用LLM结果"
-                    )
-                    return llm_domain
+
+                # 复制当前上下文，LLM路由的span挂在本次路由的span下
+                llm_future = self._executor.submit(
+                    contextvars.copy_context().run,
+                    self.llm_router.route_question, question)
+                try:
+                    llm_domain = llm_future.result(timeout=self.llm_timeout)
+                except FutureTimeoutError:
+                    llm_future.cancel()
+                    return self._on_llm_timeout(semantic_domain)
+                self._count("llm_decisions")
+                tracer.current_span().set_attribute("decision", "llm")
+                return self._combine(semantic_domain, llm_domain)
             else:
-                return semantic_domain
+                return self._default_domain()
+
+    async def aroute_question(self, question, strategy="hybrid"):
+        """
+        异步路由问题，参数和返回值同route_question
+        
+        hybrid策略下语义路由和LLM路由并发执行，提前返回时取消LLM调用
+        """
+        with tracer.span("router.hybrid", strategy=strategy):
+            if strategy == "semantic":
+                return await self.semantic_router.aroute_question(question)
+            elif strategy == "llm" and self.llm_router:
+                return await self.llm_router.aroute_question(question)
+            elif strategy == "hybrid":
+                if not self.llm_router:
+                    return await self.semantic_router.aroute_question(question)
+
+                llm_task = asyncio.ensure_future(
+                    self.llm_router.aroute_question(question))
+                try:
+                    similarities = await self.semantic_router.ascore_question(
+                        question)
+                except BaseException:
+                    llm_task.cancel()
+                    raise
+                semantic_domain = self.semantic_router._select_domain(similarities)
+                if self._clears_margin(similarities):
+                    llm_task.cancel()
+                    return semantic_domain
+
+                try:
+                    llm_domain = await asyncio.wait_for(llm_task,
+                                                        timeout=self.llm_timeout)
+                except asyncio.TimeoutError:
+                    return self._on_llm_timeout(semantic_domain)
+                self._count("llm_decisions")
+                tracer.current_span().set_attribute("decision", "llm")
+                return self._combine(semantic_domain, llm_domain)
+            else:
+                return self._default_domain()
+
+    def _count(self, key: str) -> None:
+        """统计计数，同步接口可能在多个线程中并发调用"""
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _clears_margin(self, similarities: Dict[str, float]) -> bool:
+        """语义路由第一名领先第二名的相似度是否达到提前返回的阈值"""
+        ranked = sorted(similarities.values(), reverse=True)
+        margin = ranked[0] - ranked[1] if len(ranked) > 1 else float("inf")
+        if margin >= self.margin_threshold:
+            self._count("early_exits")
+            tracer.current_span().set_attribute("decision", "early_exit")
+            logger.info(f"混合路由: 语义路由领先 {margin:.4f}，跳过LLM路由")
+            return True
+        return False
+
+    def _on_llm_timeout(self, semantic_domain):
+        self._count("llm_timeouts")
+        tracer.current_span().set_attribute("decision", "llm_timeout")
+        logger.warning(f"混合路由: LLM路由超过 {self.llm_timeout}s 未返回，"
+                       f"使用语义路由结果: {semantic_domain}")
+        return semantic_domain
+
+    def _combine(self, semantic_domain, llm_domain):
+        """合并语义路由和LLM路由的结果"""
+        # 如果两种方法结果一致，更有信心
+        if semantic_domain == llm_domain:
+            logger.info(f"混合路由: 语义和LLM结果一致，选择领域: {semantic_domain}")
+            return semantic_domain
         else:
-            # 默认策略
-            default_domain = self.rag_manager.config.get(
-                "default_domain", "technical")
-            logger.info(f"使用默认领域: {default_domain}")
-            return default_domain
+            # 如果结果不一致，优先使用LLM的结果
+            logger.info(
+                f"混合路由: 语义路由选择{semantic_domain}，LLM路由选择{llm_domain}，优先使用LLM结果"
+            )
+            return llm_domain
+
+    def _default_domain(self):
+        # 默认策略
+        default_domain = self.rag_manager.config.get("default_domain",
+                                                     "technical")
+        logger.info(f"使用默认领域: {default_domain}")
+        return default_domain
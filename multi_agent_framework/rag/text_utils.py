@@ -0,0 +1,54 @@
+"""
+文本分词工具
+英文和数字按单词切分，中日韩文字按字的二元组切分，供BM25等词法检索使用
+"""
+
+import re
+from typing import List
+
+# 英文/数字单词，或连续的中日韩文字
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff"
+                            r"\uac00-\ud7af\uf900-\ufaff]+")
+
+# 分词规则的版本，停用词或切分方式变化时递增，持久化的BM25索引和TF-IDF模型据此重建
+TOKENIZER_VERSION = 2
+
+# 与英文停用词同形的DNS助记符：记录类型A、ANY（查询类型），类IN，EDNS的DO标志位，
+# 在RFC里都是检索词，不能作为停用词去掉
+DNS_MNEMONICS = frozenset(["a", "any", "in", "do"])
+
+# 常见英文停用词，不含DNS_MNEMONICS；其余词都不是记录类型、类、操作码、
+# 响应码或头部标志位的助记符
+ENGLISH_STOP_WORDS = frozenset("""
+an and are as at be been but by for from has have if into is it its of
+on or such that the their then there these they this to was were will with
+which who whom what when where why how can could should would may might must
+shall does did not no nor so than too very s t just over under again
+further once here all both each few more most other some only own same
+""".split()) - DNS_MNEMONICS
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为检索词
+
+    英文统一转为小写并去掉停用词；连续的中日韩文字切成相邻两字的二元组，
+    单独一个字时保留该字
+
+    Args:
+        text: 文本
+
+    Returns:
+        检索词列表（保留重复，用于统计词频）
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token[0].isascii():
+            if token not in ENGLISH_STOP_WORDS:
+                tokens.append(token)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
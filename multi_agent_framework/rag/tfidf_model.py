@@ -0,0 +1,149 @@
+"""
+领域TF-IDF模型
+词表和IDF在领域语料上拟合一次并随领域持久化，请求时只做transform
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+from .text_utils import TOKENIZER_VERSION, tokenize
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 尚未拟合时使用的无状态向量化器，只有词频没有IDF，可在多线程间共享
+_HASHING_VECTORIZER = HashingVectorizer(tokenizer=tokenize,
+                                        token_pattern=None,
+                                        lowercase=False,
+                                        alternate_sign=False,
+                                        norm='l2')
+
+
+def corpus_fingerprint(file_hashes: Dict[str, Optional[str]]) -> str:
+    """
+    计算语料指纹，语料中任一文件增删、内容变化或分词规则变化时指纹随之变化
+
+    Args:
+        file_hashes: 文件相对路径 -> 内容哈希
+
+    Returns:
+        sha256十六进制串
+    """
+    digest = hashlib.sha256(f"tokenizer:{TOKENIZER_VERSION}\n".encode('utf-8'))
+    for file_key in sorted(file_hashes):
+        digest.update(f"{file_key}\0{file_hashes[file_key] or ''}\n".encode(
+            'utf-8'))
+    return digest.hexdigest()
+
+
+class TfidfModel:
+    """
+    领域TF-IDF模型
+
+    使用text_utils.tokenize分词，中文按二元组切分。拟合后的向量化器不再修改，
+    transform可以在多线程中并发调用；重新拟合时先构建新的向量化器再整体替换
+    """
+
+    MODEL_FILE = "tfidf_model.pkl"
+
+    def __init__(self, model_path: Optional[str] = None,
+                 max_features: int = 20000):
+        """
+        初始化TF-IDF模型
+
+        Args:
+            model_path: 模型文件路径，为None时不持久化
+            max_features: 词表最大词数
+        """
+        self.model_path = model_path
+        self.max_features = max_features
+        self.fingerprint: Optional[str] = None
+        self._vectorizer: Optional[TfidfVectorizer] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, persist_directory: str,
+             max_features: int = 20000) -> "TfidfModel":
+        """
+        从领域持久化目录加载模型，不存在时返回未拟合的模型
+
+        Args:
+            persist_directory: 领域持久化目录
+            max_features: 词表最大词数
+
+        Returns:
+            TfidfModel实例
+        """
+        model = cls(os.path.join(persist_directory, cls.MODEL_FILE),
+                    max_features)
+        if os.path.exists(model.model_path):
+            try:
+                with open(model.model_path, 'rb') as f:
+                    data = pickle.load(f)
+                model._vectorizer = data["vectorizer"]
+                model.fingerprint = data["fingerprint"]
+            except Exception as e:
+                logger.warning(f"加载TF-IDF模型 {model.model_path} 失败: {e}，将重新拟合")
+        return model
+
+    @property
+    def is_fitted(self) -> bool:
+        return self._vectorizer is not None
+
+    def fit(self, texts: List[str], fingerprint: Optional[str] = None) -> None:
+        """
+        在领域语料上拟合词表和IDF
+
+        Args:
+            texts: 领域片段文本
+            fingerprint: 语料指纹，用于判断模型是否过期
+        """
+        vectorizer = TfidfVectorizer(tokenizer=tokenize,
+                                     token_pattern=None,
+                                     lowercase=False,
+                                     max_features=self.max_features,
+                                     sublinear_tf=True)
+        vectorizer.fit(texts)
+        with self._lock:
+            self._vectorizer = vectorizer
+            self.fingerprint = fingerprint
+        logger.info(f"TF-IDF模型拟合完成: {len(texts)} 个片段，"
+                    f"{len(vectorizer.vocabulary_)} 个词")
+
+    def save(self) -> None:
+        """保存模型，先写临时文件再替换"""
+        if self.model_path is None:
+            return
+        with self._lock:
+            if self._vectorizer is None:
+                return
+            data = {
+                "vectorizer": self._vectorizer,
+                "fingerprint": self.fingerprint
+            }
+        tmp_path = self.model_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(tmp_path, self.model_path)
+
+    def transform(self, texts: List[str]):
+        """
+        将文本转换为L2归一化的稀疏矩阵，行向量的点积即余弦相似度
+
+        Args:
+            texts: 文本
+
+        Returns:
+            scipy稀疏矩阵，未拟合时使用哈希词频向量
+        """
+        vectorizer = self._vectorizer
+        if vectorizer is None:
+            return _HASHING_VECTORIZER.transform(texts)
+        return vectorizer.transform(texts)
@@ -1,6 +1,7 @@
 """质量检查反思器"""
 from typing import Dict, Any
 from multi_agent_framework.reflection.base import BaseReflector
+from multi_agent_framework.core.tracing import tracer, record_token_usage
 
 
 class QualityCheckerReflector(BaseReflector):
@@ -45,7 +46,9 @@ class QualityCheckerReflector(BaseReflector):
         """
         
         # 调用LLM进行质量检查
-        response = self.llm.invoke(prompt)
+        with tracer.span("reflection.quality_check") as span:
+            response = self.llm.invoke(prompt)
+            record_token_usage(span, response)
         
         # 解析LLM响应
         response_text = response.content
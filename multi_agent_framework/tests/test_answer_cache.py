@@ -0,0 +1,51 @@
+"""AnswerCache语义层的测试"""
+from langchain_core.embeddings import Embeddings
+
+from multi_agent_framework.rag.answer_cache import AnswerCache
+
+
+class TableEmbeddings(Embeddings):
+    """按预设的表返回问题向量"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def embed_documents(self, texts):
+        return [self.table[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.table[text]
+
+
+def test_expired_best_match_does_not_block_valid_match():
+    cache = AnswerCache(TableEmbeddings({
+        "stale": [1.0, 0.0],
+        "fresh": [0.96, 0.28],
+        "query": [0.99, 0.141],
+    }), ttl_seconds=60, semantic_threshold=0.9)
+    cache.put("stale", "dns", {"answer": "stale"})
+    cache.put("fresh", "dns", {"answer": "fresh"})
+    # 最相似的条目已过期
+    for entry in cache._entries.values():
+        if entry.question == "stale":
+            entry.created_at -= 120
+
+    result, _ = cache.lookup("query", "dns")
+    assert result == {"answer": "fresh"}
+    assert cache.semantic_hits == 1
+    assert cache.expirations == 1
+    assert len(cache._entries) == 1
+
+
+def test_semantic_lookup_respects_scope_and_threshold():
+    cache = AnswerCache(TableEmbeddings({
+        "cached": [1.0, 0.0],
+        "near": [0.99, 0.141],
+        "far": [0.0, 1.0],
+    }), semantic_threshold=0.9)
+    cache.put("cached", "dns", {"answer": "cached"})
+
+    assert cache.lookup("near", "dns")[0] == {"answer": "cached"}
+    assert cache.lookup("far", "dns")[0] is None
+    assert cache.lookup("near", "other")[0] is None
+    assert (cache.semantic_hits, cache.misses) == (1, 2)
@@ -0,0 +1,198 @@
+"""CheckpointStore持久化、移出内存和后台写入的测试"""
+import sqlite3
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from multi_agent_framework.core.checkpoint import CheckpointStore
+
+
+class BlockingConnection:
+    """包装写连接：executemany在release前阻塞，可以指定失败的次数"""
+
+    def __init__(self, conn: sqlite3.Connection, failures: int = 0):
+        self.conn = conn
+        self.failures = failures
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.conn.__exit__(*exc_info)
+
+    def executemany(self, *args):
+        self.started.set()
+        self.release.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.executemany(*args)
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def close(self):
+        self.conn.close()
+
+
+def stored_ids(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute(
+            "SELECT conversation_id FROM conversations")}
+
+
+def new_store(db_path: str, **kwargs) -> CheckpointStore:
+    # 后台线程只在close时写入，测试中手动调用flush
+    kwargs.setdefault("flush_interval", 60)
+    return CheckpointStore(db_path,
+                           default_factory=lambda: {"chat_history": []},
+                           **kwargs)
+
+
+def test_round_trip_with_messages(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    state = {
+        "chat_history": [HumanMessage(content="什么是DNSSEC？"),
+                         AIMessage(content="DNS安全扩展")],
+        "current_task": "rag",
+        "tags": ("dns", "security"),
+    }
+    store = new_store(db_path)
+    store.save("c1", state)
+    store.close()
+
+    reopened = new_store(db_path)
+    try:
+        loaded = reopened.get("c1")
+        assert loaded["chat_history"] == state["chat_history"]
+        assert isinstance(loaded["chat_history"][0], HumanMessage)
+        assert isinstance(loaded["chat_history"][1], AIMessage)
+        assert loaded["current_task"] == "rag"
+        assert loaded["tags"] == ["dns", "security"]
+        assert reopened.metrics()["loads"] == 1
+        # 已在内存中的会话不再读数据库
+        assert reopened.get("c1") is loaded
+        assert reopened.get("unknown") == {"chat_history": []}
+    finally:
+        reopened.close()
+
+
+def test_get_evicted_session_returns_pending_snapshot(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    store = new_store(db_path, max_active=1)
+    try:
+        store.save("c1", {"chat_history": [HumanMessage(content="第一轮")]})
+        store.save("c2", {"chat_history": []})
+        metrics = store.metrics()
+        assert (metrics["active"], metrics["pending"]) == (1, 2)
+        assert metrics["evictions"] == 1
+        assert stored_ids(db_path) == set()
+
+        # c1已移出内存且尚未写入数据库，应读到待写入的快照而不是新会话
+        state = store.get("c1")
+        assert state["chat_history"] == [HumanMessage(content="第一轮")]
+        assert store.metrics()["loads"] == 0
+
+        store.flush()
+        assert stored_ids(db_path) == {"c1", "c2"}
+    finally:
+        store.close()
+
+
+def test_get_during_flush_reads_writing_snapshot(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    store = new_store(db_path, max_active=1)
+    blocking = BlockingConnection(store._write_conn)
+    store._write_conn = blocking
+    try:
+        store.save("c1", {"chat_history": [HumanMessage(content="写入中")]})
+        store.save("c2", {"chat_history": []})
+        flusher = threading.Thread(target=store.flush)
+        flusher.start()
+        assert blocking.started.wait(5)
+
+        assert store.get("c1")["chat_history"] == \
+            [HumanMessage(content="写入中")]
+        blocking.release.set()
+        flusher.join(5)
+        assert stored_ids(db_path) == {"c1", "c2"}
+    finally:
+        blocking.release.set()
+        store.close()
+
+
+def test_delete_racing_flush(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    store = new_store(db_path)
+    blocking = BlockingConnection(store._write_conn)
+    store._write_conn = blocking
+    try:
+        store.save("c1", {"chat_history": [HumanMessage(content="要删除")]})
+        store.save("c2", {"chat_history": []})
+        flusher = threading.Thread(target=store.flush)
+        flusher.start()
+        assert blocking.started.wait(5)
+
+        # 删除要等正在进行的写入结束，否则写入会把已删除的会话写回数据库
+        deleter = threading.Thread(target=store.delete, args=("c1", ))
+        deleter.start()
+        deleter.join(0.2)
+        assert deleter.is_alive()
+
+        blocking.release.set()
+        flusher.join(5)
+        deleter.join(5)
+        assert not deleter.is_alive()
+        assert stored_ids(db_path) == {"c2"}
+        assert store.get("c1") == {"chat_history": []}
+
+        # 尚未写入的快照被删除后，之后的写入不会再写回
+        store.save("c3", {"chat_history": []})
+        store.delete("c3")
+        store.flush()
+        assert stored_ids(db_path) == {"c2"}
+    finally:
+        blocking.release.set()
+        store.close()
+
+    reopened = new_store(db_path)
+    try:
+        assert reopened.get("c1") == {"chat_history": []}
+        assert reopened.metrics()["loads"] == 0
+    finally:
+        reopened.close()
+
+
+def test_failed_write_is_retried(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    store = new_store(db_path)
+    blocking = BlockingConnection(store._write_conn, failures=1)
+    store._write_conn = blocking
+    try:
+        store.save("c1", {"chat_history": [], "turn": 1})
+        store.save("c2", {"chat_history": [], "turn": 1})
+        flusher = threading.Thread(target=store.flush)
+        flusher.start()
+        assert blocking.started.wait(5)
+        # 写入失败期间又保存过的会话以新快照为准
+        store.save("c1", {"chat_history": [], "turn": 2})
+        blocking.release.set()
+        flusher.join(5)
+        assert stored_ids(db_path) == set()
+        assert store.metrics()["pending"] == 2
+
+        store.flush()
+        assert stored_ids(db_path) == {"c1", "c2"}
+        assert store.metrics()["pending"] == 0
+    finally:
+        blocking.release.set()
+        store.close()
+
+    reopened = new_store(db_path)
+    try:
+        assert reopened.get("c1")["turn"] == 2
+        assert reopened.get("c2")["turn"] == 1
+    finally:
+        reopened.close()
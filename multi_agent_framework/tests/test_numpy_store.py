@@ -0,0 +1,150 @@
+"""NumpyVectorStore持久化、删除压缩和IVF检索的测试"""
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from multi_agent_framework.rag.numpy_store import (NumpyVectorStore,
+                                                   _read_npy_shape)
+
+
+class IndexEmbeddings(Embeddings):
+    """文本为行号，返回预先生成的向量矩阵中的对应行"""
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[int(text)].tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[int(text)].tolist()
+
+
+def random_vectors(rows: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(rows, dim)).astype(
+        np.float32)
+
+
+def clustered_vectors(rows: int, clusters: int = 20, dim: int = 32,
+                      seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(clusters, size=rows)
+    return (centers[labels] +
+            0.3 * rng.normal(size=(rows, dim))).astype(np.float32)
+
+
+def add_rows(store: NumpyVectorStore, rows: range):
+    return store.add_texts([str(i) for i in rows],
+                           [{"row": i, "parity": i % 2} for i in rows],
+                           ids=[f"id-{i}" for i in rows])
+
+
+def test_round_trip_after_reopen(tmp_path):
+    embeddings = IndexEmbeddings(random_vectors(50))
+    store = NumpyVectorStore(str(tmp_path), embeddings)
+    add_rows(store, range(50))
+    before = store.similarity_search_with_score("7", k=5)
+    assert before[0][0].id == "id-7"
+    assert abs(before[0][1] - 1.0) < 1e-5
+
+    reopened = NumpyVectorStore(str(tmp_path), embeddings)
+    assert len(reopened) == 50
+    after = reopened.similarity_search_with_score("7", k=5)
+    assert [(d.id, d.page_content, d.metadata) for d, _ in after] == \
+        [(d.id, d.page_content, d.metadata) for d, _ in before]
+    assert np.allclose([s for _, s in after], [s for _, s in before])
+    assert [d.id for d in reopened.get_by_ids(["id-3", "missing"])] == \
+        ["id-3"]
+    vector = reopened.get_vectors(["id-3"])["id-3"]
+    expected = embeddings.vectors[3] / np.linalg.norm(embeddings.vectors[3])
+    assert np.allclose(vector, expected, atol=1e-6)
+
+
+def test_filter_and_overwrite(tmp_path):
+    embeddings = IndexEmbeddings(random_vectors(20))
+    store = NumpyVectorStore(str(tmp_path), embeddings)
+    add_rows(store, range(10))
+    results = store.similarity_search("4", k=10, filter={"parity": 1})
+    assert len(results) == 5
+    assert all(doc.metadata["parity"] == 1 for doc in results)
+
+    # 已存在的ID被覆盖，重新打开后仍只保留新内容
+    store.add_texts(["15"], [{"row": 15}], ids=["id-4"])
+    reopened = NumpyVectorStore(str(tmp_path), embeddings)
+    assert len(reopened) == 10
+    assert reopened.similarity_search("15", k=1)[0].id == "id-4"
+    assert reopened.get_by_ids(["id-4"])[0].page_content == "15"
+
+
+def test_delete_and_compact(tmp_path):
+    embeddings = IndexEmbeddings(random_vectors(40))
+    store = NumpyVectorStore(str(tmp_path), embeddings, compact_ratio=0.3)
+    add_rows(store, range(40))
+    deleted = [f"id-{i}" for i in range(0, 40, 2)]
+    assert store.delete(ids=deleted)
+    assert not store.delete(ids=["missing"])
+    assert len(store) == 20
+    # 墓碑标记的行不再出现在结果中
+    assert all(doc.id not in deleted
+               for doc in store.similarity_search("0", k=40))
+
+    vectors_path = os.path.join(str(tmp_path), NumpyVectorStore.VECTORS_FILE)
+    assert _read_npy_shape(vectors_path)[0] == 40
+    store.persist()
+    assert _read_npy_shape(vectors_path)[0] == 20
+
+    reopened = NumpyVectorStore(str(tmp_path), embeddings)
+    assert len(reopened) == 20
+    assert reopened.get_by_ids(deleted) == []
+    top = reopened.similarity_search("3", k=1)[0]
+    assert (top.id, top.metadata["row"]) == ("id-3", 3)
+
+
+def test_vectors_without_metadata_are_discarded_on_load(tmp_path):
+    embeddings = IndexEmbeddings(random_vectors(10))
+    store = NumpyVectorStore(str(tmp_path), embeddings)
+    add_rows(store, range(5))
+    # 模拟写入向量后、写入元数据日志前中断
+    store._append_vectors(np.asarray(embeddings.vectors[5:8]))
+
+    reopened = NumpyVectorStore(str(tmp_path), embeddings)
+    assert len(reopened) == 5
+    vectors_path = os.path.join(str(tmp_path), NumpyVectorStore.VECTORS_FILE)
+    assert _read_npy_shape(vectors_path)[0] == 5
+    add_rows(reopened, range(5, 7))
+    assert reopened.similarity_search("6", k=1)[0].id == "id-6"
+
+
+def test_ivf_recall_matches_flat_search(tmp_path):
+    rows = 3000
+    embeddings = IndexEmbeddings(clustered_vectors(rows))
+    flat = NumpyVectorStore(str(tmp_path / "flat"), embeddings,
+                            ivf_threshold=rows + 1)
+    ivf = NumpyVectorStore(str(tmp_path / "ivf"), embeddings,
+                           ivf_threshold=1000,
+                           ivf_nlist=32,
+                           ivf_nprobe=8)
+    for store in (flat, ivf):
+        add_rows(store, range(rows))
+        store.persist()
+    assert flat._centroids is None
+    assert ivf._centroids is not None
+
+    # 建立分区之后追加的行也能检索到
+    extra = NumpyVectorStore(str(tmp_path / "ivf"), embeddings,
+                             ivf_nprobe=8)
+    assert extra._centroids is not None
+    add_rows(extra, range(rows - 1, rows))
+    assert extra._ivf_rows < len(extra._ids)
+    assert extra.similarity_search(str(rows - 1), k=1)[0].id == \
+        f"id-{rows - 1}"
+
+    k = 10
+    recalls = []
+    for query in range(0, rows, 97):
+        expected = {d.id for d in flat.similarity_search(str(query), k=k)}
+        found = {d.id for d in extra.similarity_search(str(query), k=k)}
+        recalls.append(len(expected & found) / k)
+    assert np.mean(recalls) >= 0.9
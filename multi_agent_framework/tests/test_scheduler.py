@@ -0,0 +1,173 @@
+"""TaskScheduler优先级分派、背压、超时和关闭的测试"""
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+from multi_agent_framework.agents.base import BaseAgent
+from multi_agent_framework.core.scheduler import QueueFullError, TaskScheduler
+
+
+class GatedAgent(BaseAgent):
+    """同步实现的智能体，process在gate打开前一直阻塞"""
+
+    def __init__(self, agent_id: str = "worker"):
+        super().__init__(agent_id, agent_id, "测试用智能体")
+        self.capabilities = ["work"]
+        self.gate = threading.Event()
+        self.started = []
+        self.finished = []
+        self._lock = threading.Lock()
+
+    def process(self, state):
+        with self._lock:
+            self.started.append(state.get("n"))
+        self.gate.wait(5)
+        with self._lock:
+            self.finished.append(state.get("n"))
+        return {**state, "done": True}
+
+
+def wait_until(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_queued_tasks_run_in_priority_order():
+    agent = GatedAgent()
+    scheduler = TaskScheduler({"worker": agent},
+                              max_workers=1,
+                              agent_concurrency=1)
+    try:
+        # 第一个任务占住唯一的名额，其余任务排队
+        first = scheduler.submit({"type": "work", "state": {"n": 0}})
+        assert wait_until(lambda: agent.started == [0])
+        futures = [
+            scheduler.submit({"type": "work", "state": {"n": n}}, priority=p)
+            for n, p in ((1, 5), (2, 1), (3, 5), (4, 0))
+        ]
+        agent.gate.set()
+        for future in [first] + futures:
+            assert future.result(timeout=5)["done"]
+        # 优先级相同时按提交顺序
+        assert agent.started == [0, 4, 2, 1, 3]
+    finally:
+        agent.gate.set()
+        scheduler.shutdown()
+
+
+def test_full_queue_rejects_or_waits():
+    agent = GatedAgent()
+    scheduler = TaskScheduler({"worker": agent},
+                              max_workers=1,
+                              max_queue_size=1,
+                              agent_concurrency=1)
+    try:
+        scheduler.submit({"type": "work", "state": {"n": 0}})
+        assert wait_until(lambda: agent.started == [0])
+        scheduler.submit({"type": "work", "state": {"n": 1}})
+        with pytest.raises(QueueFullError):
+            scheduler.submit({"type": "work", "state": {"n": 2}})
+        with pytest.raises(QueueFullError):
+            scheduler.submit({"type": "work", "state": {"n": 2}},
+                             block=True,
+                             queue_timeout=0.05)
+        assert scheduler.metrics()["rejected"] == 2
+
+        # 名额释放后，阻塞的提交得以入队
+        threading.Timer(0.1, agent.gate.set).start()
+        future = scheduler.submit({"type": "work", "state": {"n": 3}},
+                                  block=True,
+                                  queue_timeout=5)
+        assert future.result(timeout=5)["done"]
+    finally:
+        agent.gate.set()
+        scheduler.shutdown()
+
+
+def test_timed_out_thread_keeps_its_slot_until_it_finishes():
+    agent = GatedAgent()
+    scheduler = TaskScheduler({"worker": agent},
+                              max_workers=1,
+                              agent_concurrency=1,
+                              task_timeout=0.1)
+    try:
+        first = scheduler.submit({"type": "work", "state": {"n": 0}})
+        with pytest.raises(TimeoutError):
+            first.result(timeout=5)
+        second = scheduler.submit({"type": "work", "state": {"n": 1}},
+                                  timeout=5)
+        # 超时的process仍在运行，第二个任务不能开始
+        time.sleep(0.2)
+        metrics = scheduler.metrics()
+        assert agent.started == [0]
+        assert metrics["in_flight"] == 1
+        assert metrics["queue_depth"] == 1
+        assert metrics["timed_out"] == 0
+
+        agent.gate.set()
+        assert second.result(timeout=5)["done"]
+        assert agent.finished == [0, 1]
+        metrics = scheduler.metrics()
+        assert metrics["timed_out"] == 1
+        assert metrics["completed"] == 1
+        assert metrics["in_flight"] == 0
+    finally:
+        agent.gate.set()
+        scheduler.shutdown()
+
+
+def test_agent_concurrency_limit():
+    agent = GatedAgent()
+    scheduler = TaskScheduler({"worker": agent},
+                              max_workers=4,
+                              agent_concurrency=2)
+    try:
+        futures = [
+            scheduler.submit({"type": "work", "state": {"n": n}})
+            for n in range(4)
+        ]
+        assert wait_until(lambda: len(agent.started) == 2)
+        time.sleep(0.1)
+        assert len(agent.started) == 2
+        assert scheduler.metrics()["running_by_agent"] == {"worker": 2}
+        agent.gate.set()
+        assert all(future.result(timeout=5)["done"] for future in futures)
+    finally:
+        agent.gate.set()
+        scheduler.shutdown()
+
+
+def test_unhandled_task_type_fails():
+    scheduler = TaskScheduler({"worker": GatedAgent()})
+    try:
+        future = scheduler.submit({"type": "unknown"})
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+
+
+def test_shutdown_without_wait_cancels_queued_tasks():
+    agent = GatedAgent()
+    scheduler = TaskScheduler({"worker": agent},
+                              max_workers=1,
+                              agent_concurrency=1)
+    running = scheduler.submit({"type": "work", "state": {"n": 0}})
+    assert wait_until(lambda: agent.started == [0])
+    queued = scheduler.submit({"type": "work", "state": {"n": 1}})
+
+    threading.Timer(0.1, agent.gate.set).start()
+    scheduler.shutdown(wait=False)
+    # 执行中的任务会等待其结束，排队的任务被取消
+    assert running.result(timeout=0)["done"]
+    with pytest.raises(CancelledError):
+        queued.result(timeout=0)
+    assert agent.started == [0]
+    with pytest.raises(RuntimeError):
+        scheduler.submit({"type": "work"})
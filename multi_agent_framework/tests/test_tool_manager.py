@@ -0,0 +1,56 @@
+"""ToolManager并发执行和结果缓存的测试"""
+import time
+
+from multi_agent_framework.core.tool_manager import ToolManager
+from multi_agent_framework.tools.base import BaseTool
+
+
+class SlowCachedTool(BaseTool):
+    """执行较慢、开启结果缓存的工具"""
+
+    cache_ttl = 60
+
+    def __init__(self, delay: float):
+        super().__init__("cached", "执行较慢的可缓存工具")
+        self.delay = delay
+        self.calls = 0
+
+    def run(self, input_data):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"success": True, "result": input_data}
+
+
+def test_duplicate_cached_calls_time_out_without_raising():
+    manager = ToolManager(max_workers=1)
+    manager.register_tool(SlowCachedTool(delay=0.5))
+    try:
+        # 第一个调用占住唯一的线程，后两个相同的调用共用一个还未开始的Future
+        results = manager.execute_many([
+            {"tool": "cached", "input": {"x": 0}},
+            {"tool": "cached", "input": {"x": 1}},
+            {"tool": "cached", "input": {"x": 1}},
+        ], timeout=0.2)
+        assert len(results) == 3
+        assert all(not result["success"] for result in results)
+        assert all("超时" in result["error"] for result in results)
+    finally:
+        manager.shutdown()
+
+
+def test_duplicate_cached_calls_run_once():
+    tool = SlowCachedTool(delay=0.01)
+    manager = ToolManager(max_workers=2)
+    manager.register_tool(tool)
+    try:
+        results = manager.execute_many([
+            {"tool": "cached", "input": {"x": 1}},
+            {"tool": "cached", "input": {"x": 1}},
+            {"tool": "missing", "input": {}},
+        ], timeout=5)
+        assert [result["success"] for result in results] == [True, True, False]
+        assert tool.calls == 1
+        assert manager.execute_tool("cached", {"x": 1})["success"]
+        assert tool.calls == 1
+    finally:
+        manager.shutdown()
@@ -8,6 +8,15 @@ class BaseTool(ABC):
     工具基类 - 所有工具都应该继承此类
     """
     
+    # 结果缓存时间（秒），为None时不缓存；只有输入相同、结果就相同的工具才应开启
+    cache_ttl: Optional[float] = None
+    
+    # 执行超时（秒），为None时execute_tool不限时，execute_many使用ToolManager的默认值
+    timeout: Optional[float] = None
+    
+    # 同时执行的调用数上限，为None时不限制
+    max_concurrency: Optional[int] = None
+    
     def __init__(self, name: str, description: str):
         self.name = name
         self.description = description
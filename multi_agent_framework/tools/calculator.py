@@ -8,6 +8,9 @@ class CalculatorTool(BaseTool):
     计算器工具 - 执行数学计算
     """
     
+    # 纯计算，相同表达式的结果不变
+    cache_ttl = 3600
+    
     def __init__(self):
         super().__init__("calculator", "执行数学计算")
         
@@ -8,6 +8,10 @@ class WeatherTool(BaseTool):
     天气查询工具 - 获取天气信息
     """
     
+    # 同一城市的天气短时间内不变，限制并发避免触发天气API限流
+    cache_ttl = 600
+    max_concurrency = 4
+    
     def __init__(self):
         super().__init__("weather", "查询天气信息")
         
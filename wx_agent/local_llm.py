@@ -1,35 +1,174 @@
 from langchain_openai import ChatOpenAI
 from langchain.chat_models import init_chat_model
 from langchain_community.chat_models import ChatTongyi
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
 from dotenv import load_dotenv
-from langchain_core.globals import set_llm_cache
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
 import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
 from pydantic import SecretStr
 # 加载环境变量
 load_dotenv('./../.env')
 
+# 响应缓存的sqlite文件路径
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.sqlite")
+# 内存LRU层最多保存的响应数
+LLM_CACHE_MEMORY_SIZE = 512
 
-def get_llm():
+
+class LLMResponseCache(BaseCache):
+    """
+    大模型响应缓存：内存LRU层 + sqlite磁盘层
+
+    键为 (模型参数, 提示词) 的sha256，模型参数中包含模型名称和temperature，
+    相同提示词在不同模型或温度下互不命中
+    """
+
+    def __init__(self, database_path=LLM_CACHE_PATH,
+                 memory_size=LLM_CACHE_MEMORY_SIZE):
+        self.database_path = database_path
+        self.memory_size = max(1, memory_size)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(database_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                           "(key TEXT PRIMARY KEY, generations TEXT NOT NULL, "
+                           "created_at REAL NOT NULL)")
+        self._conn.commit()
+
+        # 统计信息
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        llm_hash = hashlib.sha256(llm_string.encode('utf-8')).hexdigest()
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return f"{llm_hash}:{prompt_hash}"
+
+    def _remember(self, key: str, generations) -> None:
+        self._memory[key] = generations
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            generations = self._memory.get(key)
+            if generations is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return generations
+
+            row = self._conn.execute(
+                "SELECT generations FROM responses WHERE key = ?",
+                (key, )).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            generations = [loads(item) for item in json.loads(row[0])]
+            self._remember(key, generations)
+            self.disk_hits += 1
+            return generations
+
+    def update(self, prompt: str, llm_string: str,
+               return_val: Sequence[Any]) -> None:
+        key = self._key(prompt, llm_string)
+        value = json.dumps([dumps(generation) for generation in return_val])
+        with self._lock:
+            self._remember(key, list(return_val))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, generations, created_at) "
+                "VALUES (?, ?, ?)", (key, value, time.time()))
+            self._conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中率统计"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_size": len(self._memory)
+            }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """获取进程内共享的响应缓存"""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache()
+        return _llm_cache
+
+
+def llm_cache_stats():
+    """获取响应缓存的命中率统计"""
+    return get_llm_cache().stats()
+
+
+def _cache_for(temperature, cache=True, force_cache=False):
+    """
+    为模型实例选择响应缓存
+
+    temperature大于0（或未指定，由服务端决定）时输出不确定，默认不缓存，
+    force_cache为True时仍然缓存
+    """
+    if not cache:
+        return None
+    if temperature != 0 and not force_cache:
+        return None
+    return get_llm_cache()
+
+
+def get_llm(temperature=None, cache=True, force_cache=False):
     # 获取千问API密钥
     dashscope_api_key = os.getenv("DASHSCOPE_API_KEY")
+    model_kwargs = {} if temperature is None else {"temperature": temperature}
     # 初始化千问模型
-    llm = ChatTongyi(api_key=dashscope_api_key, model="qwen-turbo")
+    llm = ChatTongyi(api_key=dashscope_api_key,
+                     model="qwen-turbo",
+                     model_kwargs=model_kwargs,
+                     cache=_cache_for(temperature, cache, force_cache))
     return llm
 
 
 
-def local_llm_get():
+def local_llm_get(temperature=0.7, cache=True, force_cache=False):
     llm = ChatOpenAI(base_url="http://127.0.0.1:8080/v1",
                      api_key="sk-my-local-key-12345",
-                     temperature=0.7)
+                     temperature=temperature,
+                     cache=_cache_for(temperature, cache, force_cache))
     return llm
 
 
-def qwen_llm_get():
+def qwen_llm_get(temperature=0.7, cache=True, force_cache=False):
     llm = init_chat_model(
         model="qwen2.5-7b-instruct-q4_0",  # 模型名称
         model_provider="openai",  # 使用openai提供者（兼容模式）
         base_url="http://127.0.0.1:8080/v1",
         api_key="sk-my-local-key-12345",
-        temperature=0.7)
-    return llm
\ No newline at end of file
+        temperature=temperature,
+        cache=_cache_for(temperature, cache, force_cache))
+    return llm
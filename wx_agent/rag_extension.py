@@ -6,24 +6,38 @@ RAG功能扩展模块
 import os
 from typing import Dict, List, Optional, Any, Tuple
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate,ChatPromptTemplate
 from langchain.docstore.document import Document
 import re
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multi_agent_framework.rag.embedding_registry import get_embeddings
 
 class RAGExtension:
     """RAG功能扩展类"""
     
-    def __init__(self, embeddings_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, embeddings_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 embedding_cache_dir: Optional[str] = "./embedding_cache",
+                 batching_config: Optional[Dict[str, Any]] = None):
         """
         初始化RAG扩展
         
         Args:
             embeddings_model: 用于生成嵌入的模型名称
+            embedding_cache_dir: 嵌入向量缓存目录，为None时不使用缓存
+            batching_config: 微批处理配置，如{"enabled": True, "max_batch_size": 32, "max_wait_ms": 5}，
+                并发检索时多个查询合并成一次模型调用
         """
-        self.embeddings = HuggingFaceEmbeddings(model_name=embeddings_model)
+        cache_config = ({"directory": embedding_cache_dir}
+                        if embedding_cache_dir else None)
+        self.embeddings = get_embeddings(embeddings_model,
+                                         cache_config=cache_config,
+                                         batching_config=batching_config)
         self.vector_stores: Dict[str, Chroma] = {}  # 不同领域的向量数据库
         self.domain_keywords: Dict[str, List[str]] = {}  # 领域关键词映射
         self.retrievers: Dict[str, Any] = {}  # 检索器
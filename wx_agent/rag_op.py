@@ -1,5 +1,4 @@
 from langchain_community.document_loaders import DirectoryLoader
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.chat_models import ChatTongyi
 from langchain.tools import BaseTool
@@ -22,6 +21,14 @@ from local_llm import local_llm_get, get_llm
 from local_log import (LogLevel, debug_log, info_log, warning_log, error_log,
                        set_logger)
 
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multi_agent_framework.rag.embedding_registry import get_embeddings
+from multi_agent_framework.rag.bm25 import BM25Index
+from multi_agent_framework.rag.hybrid_retriever import (BM25Retriever,
+                                                        HybridRetriever)
+
 # 配置文件路径
 CONFIG_FILE_PATH = r"D:\tuchuan\tc_test\py-test-ai\wx_agent\rag_config.json"
 
@@ -57,6 +64,12 @@ USER_DOC_PATHS = {
 # 对话历史记录的最大轮数
 MAX_HISTORY_LENGTH = 5
 
+# 嵌入向量缓存目录，重建向量库时未变化的文本块无需再次嵌入
+EMBEDDING_CACHE_DIR = "./embedding_cache"
+
+# 检索模式: dense（向量检索）、lexical（BM25，不加载嵌入模型）、hybrid（两者RRF融合）
+RETRIEVAL_MODE = "dense"
+
 
 def load_config():
     """从配置文件加载用户配置"""
@@ -136,6 +149,45 @@ def load_doc_dir(dir_path, file_type=".txt"):
     return docs
 
 
+def build_retriever(texts, retrieval_mode=None, k=4, fetch_k=20):
+    """
+    根据检索模式创建检索器
+
+    lexical模式只建立BM25索引，不加载嵌入模型；
+    hybrid模式向量检索和BM25各取fetch_k个候选，RRF融合后返回前k个
+    """
+    retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+    sparse_retriever = None
+    if retrieval_mode in ("lexical", "hybrid"):
+        info_log("BM25索引创建中...")
+        sparse_retriever = BM25Retriever(
+            index=BM25Index.from_documents(texts),
+            k=k if retrieval_mode == "lexical" else fetch_k)
+        if retrieval_mode == "lexical":
+            info_log(f"BM25索引创建完成，文本块数量为{len(texts)}")
+            return sparse_retriever
+
+    embeddings = get_embeddings(
+        "sentence-transformers/all-MiniLM-L6-v2",
+        cache_config={"directory": EMBEDDING_CACHE_DIR})
+
+    info_log(f"向量库创建中...")
+    vectorstore = Chroma.from_documents(texts,
+                                        embeddings,
+                                        collection_name="rag_collection")
+    info_log(f"向量库加载中...")
+    dense_retriever = vectorstore.as_retriever(
+        search_type="similarity",
+        search_kwargs={"k": k if sparse_retriever is None else fetch_k})
+    info_log(f"向量库加载完成，向量库大小为{len(texts)}")
+
+    if sparse_retriever is None:
+        return dense_retriever
+    return HybridRetriever(dense_retriever=dense_retriever,
+                           sparse_retriever=sparse_retriever,
+                           k=k)
+
+
 def retriever_tool_get(dir_path, llm, prompt_type="default"):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=500,
                                                    chunk_overlap=100,
@@ -146,17 +198,7 @@ def retriever_tool_get(dir_path, llm, prompt_type="default"):
     texts = text_splitter.split_documents(documents)
     info_log(f"文档加载完成，文本块数量为{len(texts)}")
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-    info_log(f"向量库创建中...")
-    vectorstore = Chroma.from_documents(texts,
-                                        embeddings,
-                                        collection_name="rag_collection")
-    info_log(f"向量库加载中...")
-    retriever = vectorstore.as_retriever(search_type="similarity",
-                                         search_kwargs={"k": 4})
-    info_log(f"向量库加载完成，向量库大小为{len(texts)}")
+    retriever = build_retriever(texts)
 
     # 根据提示词类型选择模板
     prompt_template = USER_PROMPTS.get(prompt_type, DETAILED_PROMPT_TEMPLATE)
@@ -186,17 +228,7 @@ def conversational_retriever_tool_get(dir_path, llm):
     texts = text_splitter.split_documents(documents)
     info_log(f"文档加载完成，文本块数量为{len(texts)}")
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-    info_log(f"向量库创建中...")
-    vectorstore = Chroma.from_documents(texts,
-                                        embeddings,
-                                        collection_name="rag_collection")
-    info_log(f"向量库加载中...")
-    retriever = vectorstore.as_retriever(search_type="similarity",
-                                         search_kwargs={"k": 4})
-    info_log(f"向量库加载完成，向量库大小为{len(texts)}")
+    retriever = build_retriever(texts)
 
     # 创建支持对话历史的Chain
     qa_chain = ConversationalRetrievalChain.from_llm(